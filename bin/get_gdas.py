@@ -10,17 +10,22 @@ import requests
 import os
 import sys
 sys.path.append(f'{os.path.dirname(os.path.realpath(__file__))}/../utils')
-from utils import parse_time, parse_forecast_hours, edit_file, run, cli, check_files, check_file_size, is_downloading
+from utils import parse_time, parse_forecast_hours, edit_file, run, cli, check_files, check_file_size, download_lock, open_catalog, register_bkg_file
 
-def get_gdas(output_root, start_time, end_time, args):
+def get_gdas(output_root, start_time, end_time, args, fatal=True):
+	# When not fatal, return times whose files are not downloaded (failed or being downloaded by others).
 	if not os.path.isdir(output_root):
 		os.makedirs(output_root)
 		cli.notice(f'Create directory {output_root}.')
+	catalog = open_catalog(output_root)
 
 	def download_gdas(time):
 		dir_name = f'gdas.{time.format("YYYYMMDD")}/{time.format("HH")}'
-		res = requests.head(f'{root_url}/{dir_name}/')
+		res = requests.head(f'{root_url}/{dir_name}/', timeout=60)
 		if res.status_code != 200 and res.status_code != 302:
+			if not fatal:
+				cli.warning(f'Remote GDAS data at {time} do not exist!')
+				return False
 			cli.error(f'Remote GDAS data at {time} do not exist!')
 		file_name = 'gdas.t{:02d}z.prepbufr.nr'.format(time.hour)
 		url = f'{root_url}/{dir_name}/{file_name}'
@@ -29,26 +34,34 @@ def get_gdas(output_root, start_time, end_time, args):
 			cli.notice(f'Create directory {output_root}/{dir_name}.')
 		cli.notice(f'Downloading {url}.')
 		local_file_path = f'{output_root}/{dir_name}/{file_name}'
-		if is_downloading(local_file_path):
-			cli.warning(f'Skip downloading {local_file_path}.')
-			return
-		if os.path.isfile(local_file_path):
-			if check_file_size(url, local_file_path):
+		part_file_path = f'{local_file_path}.part'
+		with download_lock(local_file_path, wait=False) as locked:
+			if not locked:
+				cli.warning(f'Skip downloading {local_file_path}, which is being downloaded by others.')
+				return False
+			# Files are renamed from .part files after completed, so existing ones are complete.
+			if os.path.isfile(local_file_path):
 				cli.notice(f'File {local_file_path} exists.')
-				return
-			else:
-				# File is not downloaded completely.
-				os.remove(local_file_path)
-		try:
-			subprocess.call(['curl', '-C', '-', '-o', local_file_path, url])
-		except Exception as e:
-			cli.error(f'Encounter exception {e}!')
-		if not check_file_size(url, local_file_path):
-			os.remove(local_file_path)
-			cli.error(f'Failed to download {file_name}!')
+				register_bkg_file(catalog, 'prepbufr', time, 0, None, local_file_path)
+				return True
+			try:
+				subprocess.call(['curl', '-C', '-', '-o', part_file_path, url])
+			except Exception as e:
+				if not fatal:
+					cli.warning(f'Encounter exception {e}!')
+					return False
+				cli.error(f'Encounter exception {e}!')
+			if not os.path.isfile(part_file_path) or not check_file_size(url, part_file_path):
+				if os.path.isfile(part_file_path): os.remove(part_file_path)
+				if not fatal:
+					cli.warning(f'Failed to download {file_name}!')
+					return False
+				cli.error(f'Failed to download {file_name}!')
+			os.replace(part_file_path, local_file_path)
+		register_bkg_file(catalog, 'prepbufr', time, 0, None, local_file_path)
+		return True
 
-	for time in pendulum.period(start_time, end_time).range('hours', 6):
-		download_gdas(time)
+	return [time for time in pendulum.period(start_time, end_time).range('hours', 6) if not download_gdas(time)]
 
 if __name__ == '__main__':
 	parser = argparse.ArgumentParser(description="Get GDAS observation data.\n\nLongrun Weather Inc., NWP operation software.\nCopyright (C) 2018-2019 All Rights Reserved.", formatter_class=argparse.RawTextHelpFormatter)
@@ -2,7 +2,6 @@
 
 root_url = 'https://www.ftp.ncep.noaa.gov/data/nccf/com/gfs/prod/'
 
-import subprocess
 import argparse
 import pendulum
 import re
@@ -10,48 +9,66 @@ import requests
 import os
 import sys
 sys.path.append(f'{os.path.dirname(os.path.realpath(__file__))}/../utils')
-from utils import parse_time, parse_forecast_hours, edit_file, run, cli, check_files, check_file_size, is_downloading
+from utils import parse_time, parse_forecast_hours, cli, http_get_files, idx_selector, vtable_variables, open_catalog, register_bkg_file
 
-def get_gfs(output_root, start_time, forecast_hours, resolution, prefix, args):
+def remote_size_matched(url, local_file_path):
+	# Keep files whose remote ones can not be checked (e.g. removed from server).
+	res = requests.head(url, allow_redirects=True, timeout=60)
+	if res.status_code != 200 or not 'Content-Length' in res.headers: return True
+	return int(res.headers['Content-Length']) == os.path.getsize(local_file_path)
+
+def get_gfs(output_root, start_time, forecast_hours, resolution, prefix, args, fatal=True):
+	# When not fatal, return local paths of files that are not downloaded, or None if remote cycle does not exist.
 	if not os.path.isdir(output_root):
 		os.makedirs(output_root)
 		cli.notice(f'Create directory {output_root}.')
 
-	def download_gfs(start_time, forecast_hour):
-		dir_name = f'{prefix}.{start_time.format("YYYYMMDD")}/{start_time.format("HH")}'
-		file_name = '{}.t{:02d}z.pgrb2.{}.f{:03d}'.format(prefix, start_time.hour, resolution, forecast_hour)
-		url = f'{root_url}/{dir_name}/{file_name}'
-		if not os.path.isdir(f'{output_root}/{dir_name}'):
-			os.makedirs(f'{output_root}/{dir_name}')
-			cli.notice(f'Create directory {output_root}/{dir_name}.')
-		cli.notice(f'Downloading {url}.')
-		local_file_path = f'{output_root}/{dir_name}/{file_name}'
-		if is_downloading(local_file_path):
-			cli.warning(f'Skip downloading {local_file_path}.')
-			return
-		if os.path.isfile(local_file_path):
-			if check_file_size(url, local_file_path):
-				cli.notice(f'File {local_file_path} exists.')
-				return
-			else:
-				# File is not downloaded completely.
-				os.remove(local_file_path)
-		try:
-			subprocess.call(['curl', '-C', '-', '-o', local_file_path, url])
-		except Exception as e:
-			cli.error('Encounter exception {e}!')
-		if not check_file_size(url, local_file_path):
-			os.remove(local_file_path)
-			cli.error(f'Failed to download {file_name}!')
-
-	res = requests.head(f'{root_url}/{prefix}.{start_time.format("YYYYMMDD")}/{start_time.format("HH")}')
+	res = requests.head(f'{root_url}/{prefix}.{start_time.format("YYYYMMDD")}/{start_time.format("HH")}', timeout=60)
 	if res.status_code not in (200, 301):
+		if not fatal: return None
 		print(res.status_code)
 		print(f'{root_url}/{prefix}.{start_time.format("YYYYMMDD")}/{start_time.format("HH")}')
 		cli.error(f'Remote GFS data at {start_time} do not exist!')
 
+	dir_name = f'{prefix}.{start_time.format("YYYYMMDD")}/{start_time.format("HH")}'
+	if not os.path.isdir(f'{output_root}/{dir_name}'):
+		os.makedirs(f'{output_root}/{dir_name}')
+		cli.notice(f'Create directory {output_root}/{dir_name}.')
+	# Downloaded files are registered in catalogue, so that run_wps_ungrib_metgrid does not need to glob them.
+	catalog = open_catalog(output_root)
+	downloads = []
+	forecast_hours_of = {}
 	for forecast_hour in forecast_hours:
-		download_gfs(start_time, forecast_hour)
+		file_name = '{}.t{:02d}z.pgrb2.{}.f{:03d}'.format(prefix, start_time.hour, resolution, forecast_hour)
+		local_file_path = f'{output_root}/{dir_name}/{file_name}'
+		url = f'{root_url}/{dir_name}/{file_name}'
+		# Files are renamed from .part files after completed and leave .lock files, while older
+		# downloaders wrote files directly, so check the size of those.
+		if os.path.isfile(local_file_path) and not os.path.isfile(f'{local_file_path}.lock') and not remote_size_matched(url, local_file_path):
+			cli.warning(f'File {local_file_path} is incomplete, download it again.')
+			os.remove(local_file_path)
+		if os.path.isfile(local_file_path):
+			cli.notice(f'File {local_file_path} exists.')
+			register_bkg_file(catalog, prefix, start_time, forecast_hour, resolution, local_file_path)
+			continue
+		downloads.append((url, local_file_path))
+		forecast_hours_of[local_file_path] = forecast_hour
+	if len(downloads) == 0: return []
+	num_workers = getattr(args, 'num_workers', 4)
+	# Only download records used by ungrib with byte ranges listed in .idx files.
+	variables = None
+	if getattr(args, 'variables', None):
+		variables = args.variables.split(',')
+	elif getattr(args, 'vtable', None):
+		variables = vtable_variables(args.vtable)
+	cli.notice(f'Downloading {len(downloads)} files with {num_workers} connections.')
+	failed = http_get_files(downloads, max_workers=num_workers, select=idx_selector(variables) if variables else None)
+	for url, local_file_path in downloads:
+		if not (url, local_file_path) in failed:
+			register_bkg_file(catalog, prefix, start_time, forecast_hours_of[local_file_path], resolution, local_file_path)
+	if len(failed) > 0 and fatal:
+		cli.error(f'Failed to download {[os.path.basename(local_file_path) for url, local_file_path in failed]}!')
+	return [local_file_path for url, local_file_path in failed]
 
 if __name__ == '__main__':
 	parser = argparse.ArgumentParser(description="Run WRF model and its friends.\n\nLongrun Weather Inc., NWP operation software.\nCopyright (C) 2018 - All Rights Reserved.", formatter_class=argparse.RawTextHelpFormatter)
@@ -60,6 +77,9 @@ if __name__ == '__main__':
 	parser.add_argument('-f', '--forecast-hours', dest='forecast_hours', help='Download forecast hours (HH-HH+XX).', type=parse_forecast_hours)
 	parser.add_argument('-e', '--resolution', help='Set GFS resolution (1p00, 0p50, 0p25).', choices=('1p00', '0p50', '0p25'), default='0p25')
 	parser.add_argument('-g', '--gdas', help='Use GDAS analysis.', action='store_true')
+	parser.add_argument('-n', '--num-workers', dest='num_workers', help='Number of concurrent downloads.', default=4, type=int)
+	parser.add_argument('-v', '--variables', help='Only download records of these NAME:LEVEL regular expressions separated by comma (e.g. TMP:.* mb,UGRD:10 m above ground).')
+	parser.add_argument('-t', '--vtable', help='Only download records used by this WPS Vtable (e.g. WPS/ungrib/Variable_Tables/Vtable.GFS).')
 	args = parser.parse_args()
 
 	if args.gdas:
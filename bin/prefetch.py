@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import pendulum
+import requests
+import sys
+import time
+sys.path.append(f'{os.path.dirname(os.path.realpath(__file__))}/../utils')
+from utils import cli, parse_config, parse_time, get_value, ready_file_path
+from get_gfs import get_gfs, root_url as gfs_root_url
+from get_gdas import get_gdas, root_url as gdas_root_url
+
+parser = argparse.ArgumentParser(description="Prefetch GFS and GDAS data of upcoming cycles.\n\nNWP operation software.\nCopyright (C) 2018-2019 All Rights Reserved.", formatter_class=argparse.RawTextHelpFormatter)
+parser.add_argument('-j', '--config-json', dest='config_json', help='Configuration JSON file of cycles')
+parser.add_argument('-b', '--bkg-root', dest='bkg_root', help='Background root directory')
+parser.add_argument('-p', '--prepbufr-root', dest='prepbufr_root', help='PrepBUFR data root directory')
+parser.add_argument('-s', '--start-time', dest='start_time', help='Start time of first cycle (YYYYMMDDHH), default is current cycle', type=parse_time)
+parser.add_argument('-i', '--cycle-interval', dest='cycle_interval', help='Hours between cycles', default=3, type=int)
+parser.add_argument('-l', '--lookahead', help='Number of cycles to prefetch after current cycle', default=2, type=int)
+parser.add_argument('-e', '--resolution', help='Set GFS resolution (1p00, 0p50, 0p25).', choices=('1p00', '0p50', '0p25'), default='0p25')
+parser.add_argument('-n', '--num-workers', dest='num_workers', help='Number of concurrent downloads.', default=4, type=int)
+parser.add_argument('-v', '--variables', help='Only download records of these NAME:LEVEL regular expressions separated by comma.')
+parser.add_argument('-t', '--vtable', help='Only download records used by this WPS Vtable.')
+parser.add_argument(      '--max-delay', dest='max_delay', help='Maximum seconds between polls of remote data', default=900, type=int)
+parser.add_argument(      '--once', help='Exit after the first cycles are ready', action='store_true')
+args = parser.parse_args()
+
+if not args.bkg_root:
+	if os.getenv('BKG_ROOT'):
+		args.bkg_root = os.getenv('BKG_ROOT')
+	else:
+		cli.error('Option --bkg-root or environment variable BKG_ROOT need to be set!')
+args.bkg_root = os.path.abspath(args.bkg_root)
+if args.prepbufr_root: args.prepbufr_root = os.path.abspath(args.prepbufr_root)
+
+config = parse_config(args.config_json)
+forecast_hours = config['custom']['forecast_hours']
+interval_hours = int(get_value(config['custom'], ['background', 'interval_seconds'], default=10800) / 3600)
+use_prepbufr = args.prepbufr_root and config['wrfvar3']['ob_format'] == 1
+
+def prefetch_gfs(cycle):
+	# Use the latest GFS cycle that has been published, same as run_wps_ungrib_metgrid.
+	latest_bkg_start_time = cycle.subtract(hours=cycle.hour % 6)
+	for bkg_start_time in (latest_bkg_start_time, latest_bkg_start_time.subtract(hours=6)):
+		start_hour = int((cycle - bkg_start_time).in_hours())
+		hours = list(range(start_hour, start_hour + forecast_hours + 1, interval_hours))
+		missing = get_gfs(args.bkg_root, bkg_start_time, hours, args.resolution, 'gfs', args, fatal=False)
+		if missing == None: continue
+		# Once any file of the latest cycle is local, ungrib will use it, so wait for the rest.
+		if len(missing) > 0:
+			cli.notice(f'Wait for {len(missing)} files of GFS {bkg_start_time} to be published.')
+			return None
+		return bkg_start_time
+	return None
+
+def prefetch_prepbufr(cycle):
+	if cycle.hour % 6 != 0: return True
+	file_name = 'gdas.t{:02d}z.prepbufr.nr'.format(cycle.hour)
+	if not os.path.isfile(f'{args.prepbufr_root}/gdas.{cycle.format("YYYYMMDD")}/{cycle.format("HH")}/{file_name}'):
+		res = requests.head(f'{gdas_root_url}/gdas.{cycle.format("YYYYMMDD")}/{cycle.format("HH")}/{file_name}', timeout=60)
+		if res.status_code != 200: return False
+	# File may be skipped when being downloaded by others, so it is ready only when nothing is missing.
+	return len(get_gdas(args.prepbufr_root, cycle, cycle, args, fatal=False)) == 0
+
+def prefetch(cycle):
+	bkg_start_time = prefetch_gfs(cycle)
+	if not bkg_start_time: return False
+	if use_prepbufr and not prefetch_prepbufr(cycle): return False
+	ready_file = ready_file_path(args.bkg_root, cycle)
+	if not os.path.isdir(os.path.dirname(ready_file)): os.makedirs(os.path.dirname(ready_file))
+	with open(f'{ready_file}.tmp', 'w') as f:
+		json.dump({ 'bkg_start_time': bkg_start_time.format('YYYYMMDDHH'), 'time': pendulum.now('UTC').to_iso8601_string() }, f)
+	os.replace(f'{ready_file}.tmp', ready_file)
+	cli.notice(f'Cycle {cycle} is ready.')
+	return True
+
+if args.start_time:
+	cycle = args.start_time
+else:
+	now = pendulum.now('UTC')
+	cycle = pendulum.datetime(now.year, now.month, now.day, now.hour - now.hour % args.cycle_interval)
+
+delay = 60
+while True:
+	progressed = False
+	for i in range(args.lookahead + 1):
+		next_cycle = cycle.add(hours=i * args.cycle_interval)
+		if os.path.isfile(ready_file_path(args.bkg_root, next_cycle)): continue
+		cli.notice(f'Prefetch data for cycle {next_cycle}.')
+		# Network errors should not stop the service, so just try again later.
+		try:
+			if prefetch(next_cycle): progressed = True
+		except requests.exceptions.RequestException as e:
+			cli.warning(f'Failed to prefetch data for cycle {next_cycle} due to {e}!')
+		except Exception as e:
+			cli.warning(f'Encounter exception {e} when prefetching data for cycle {next_cycle}!')
+	# Move on when current cycle is ready.
+	while os.path.isfile(ready_file_path(args.bkg_root, cycle)):
+		if args.once: exit(0)
+		cycle = cycle.add(hours=args.cycle_interval)
+		progressed = True
+	# Back off while remote data are not published.
+	delay = 60 if progressed else min(delay * 2, args.max_delay)
+	cli.notice(f'Sleep {delay} seconds.')
+	time.sleep(delay)
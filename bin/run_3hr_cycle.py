@@ -5,9 +5,10 @@ import pendulum
 import copy
 import os
 import sys
+import time
 sys.path.append(f'{os.path.dirname(os.path.realpath(__file__))}/../utils')
 sys.path.append(f'{os.path.dirname(os.path.realpath(__file__))}/../operators')
-from utils import cli, parse_time, parse_config, run, copy_netcdf_file, wrf_version, Version
+from utils import cli, parse_time, parse_config, run, copy_netcdf_file, wrf_version, Version, add_stage, run_stages, wait_job, record_job, export_telemetry, ready_file_path, open_state, record_start, record_end
 import wrf_operators as wrf
 
 parser = argparse.ArgumentParser(description="Run WRF 3-hour cycle forecast.\n\nNWP operation software.\nCopyright (C) 2018-2019 All Rights Reserved.", formatter_class=argparse.RawTextHelpFormatter)
@@ -27,6 +28,10 @@ parser.add_argument('-n', '--num-proc', dest='np', help='MPI process number to r
 parser.add_argument(      '--ntasks-per-node', dest='ntasks_per_node', help='Override the default setting', default=None, type=int)
 parser.add_argument(      '--slurm', help='Use SLURM job management system to run MPI jobs', action='store_true')
 parser.add_argument(      '--pbs', help='Use PBS job management system variants (e.g. TORQUE) to run MPI jobs.', action='store_true')
+parser.add_argument(      '--chain', dest='use_chain', help='Submit real, DA and WRF jobs of warm cycle at once with job dependencies', action='store_true')
+parser.add_argument(      '--wait-ready', dest='wait_ready', help='Wait for background data of the cycle to be prefetched by prefetch.py', action='store_true')
+parser.add_argument(      '--ready-timeout', dest='ready_timeout', help='Minutes to wait for prefetched background data', default=360, type=int)
+parser.add_argument(      '--max-parallel-stages', dest='max_parallel_stages', help='Maximum number of independent stages to run concurrently', default=None, type=int)
 parser.add_argument('-v', '--verbose', help='Print out work log', action='store_true')
 parser.add_argument('-f', '--force', help='Force to run', action='store_true')
 args = parser.parse_args()
@@ -105,6 +110,9 @@ args.bkg_root = os.path.abspath(args.bkg_root)
 if not os.path.isdir(args.bkg_root):
 	cli.error(f'Directory {args.bkg_root} does not exist!')
 
+if args.use_chain and not args.slurm and not args.pbs:
+	cli.error('Option --chain needs --slurm or --pbs!')
+
 version = wrf_version(args.wrf_root)
 
 config = parse_config(args.config_json)
@@ -140,23 +148,137 @@ datetime_fmt = 'YYYY-MM-DD_HH:mm:ss'
 start_time_str = start_time.format(datetime_fmt)
 end_time_str = end_time.format(datetime_fmt)
 
+if args.wait_ready:
+	ready_file = ready_file_path(args.bkg_root, start_time)
+	wait_start = time.time()
+	if not os.path.isfile(ready_file): cli.notice(f'Wait for {ready_file}.')
+	while not os.path.isfile(ready_file):
+		if time.time() - wait_start > args.ready_timeout * 60:
+			cli.error(f'Background data of {start_time} are not ready after {args.ready_timeout} minutes!')
+		time.sleep(30)
+
 # Change work_root to specific date directory.
 args.work_root += '/' + start_time.format('YYYYMMDDHH')
 
-def wrfda_conv(config, wrf_work_dir=None, tag=None, fg_d01=None, fg_d02=None, wrfbdy=None):
-	# Run conventional data assimilation.
-	if not wrf_work_dir: wrf_work_dir = os.path.dirname(fg_d01) if fg_d01 else None
-	config['custom']['wrfda']['dom'] = 0
-	wrf.config_wrfda(args.work_root, args.wrfda_root, config, args, wrf_work_dir=wrf_work_dir, tag=tag, fg=fg_d01)
-	wrf.run_wrfda_obsproc(args.work_root, args.wrfda_root, args.littler_root, config, args, tag=tag)
-	wrf.run_wrfda_3dvar(args.work_root, args.wrfda_root, config, args, wrf_work_dir=wrf_work_dir, tag=tag, fg=fg_d01)
-	wrf.run_wrfda_update_bc(args.work_root, args.wrfda_root, False, config, args, wrf_work_dir=wrf_work_dir, wrfbdy=wrfbdy, tag=tag)
+# Overlapping cycles share ungrib and metgrid outputs.
+if not 'wps_cache_root' in config['custom']:
+	config['custom']['wps_cache_root'] = f'{os.path.dirname(args.work_root)}/wps_cache'
+
+def met_em_files(config):
+	time_str = config['custom']['start_time'].format(datetime_fmt)
+	return [f'{args.work_root}/wps/met_em.d{i+1:02d}.{time_str}.nc' for i in range(config['domains']['max_dom'])]
+
+def run_wps(config):
+	wrf.config_wps(args.work_root, args.wps_root, args.geog_root, config, args)
+	for i in range(config['domains']['max_dom']):
+		run(f'ln -sf {os.path.dirname(args.work_root)}/wps/geo_em.d{str(i+1).zfill(2)}.nc {args.work_root}/wps/')
+	wrf.run_wps_ungrib_metgrid(args.work_root, args.wps_root, args.bkg_root, config, args)
+
+def run_real(config, tag=None, wrf_config=None):
+	wrf.config_wrf(args.work_root, args.wrf_root, args.wrfda_root, config, args, tag=tag)
+	wrf.run_real(args.work_root, args.work_root + '/wps', args.wrf_root, config, args, tag=tag)
+	# Reconfigure WRF when it runs a shorter period than real.
+	if wrf_config: wrf.config_wrf(args.work_root, args.wrf_root, args.wrfda_root, wrf_config, args, tag=tag)
 
-	if not wrf_work_dir: wrf_work_dir = os.path.dirname(fg_d02) if fg_d02 else None
+def wrfda_conv(config, dom, wrf_work_dir=None, tag=None, fg=None, wrfbdy=None):
+	# Run conventional data assimilation on one domain.
+	config = copy.deepcopy(config)
+	config['custom']['wrfda']['dom'] = dom
+	wrf.config_wrfda(args.work_root, args.wrfda_root, config, args, wrf_work_dir=wrf_work_dir, tag=tag, fg=fg)
+	wrf.run_wrfda_3dvar(args.work_root, args.wrfda_root, config, args, wrf_work_dir=wrf_work_dir, tag=tag, fg=fg)
+	if dom == 0:
+		wrf.run_wrfda_update_bc(args.work_root, args.wrfda_root, False, config, args, wrf_work_dir=wrf_work_dir, wrfbdy=wrfbdy, tag=tag)
+
+def add_wrfda_conv_stages(stages, config, wrf_work_dir=None, tag=None, fg_d01=None, fg_d02=None, wrfbdy=None, depends=None):
+	# The d01 and d02 analyses only share observations, so they can run concurrently.
+	if not wrf_work_dir: wrf_work_dir = os.path.dirname(fg_d01)
+	prefix = f'{tag}_' if tag else ''
+	wrfda_work_dir = f'{args.work_root}/wrfda_{tag}' if tag else f'{args.work_root}/wrfda'
+	time_str = config['custom']['start_time'].format(datetime_fmt)
+	if not wrfbdy: wrfbdy = f'{wrf_work_dir}/wrfbdy_d01_{time_str}'
+	add_stage(stages, f'{prefix}obsproc', wrf.run_wrfda_obsproc, args.work_root, args.wrfda_root, args.littler_root, config, args, tag=tag,
+		outputs=[f'{wrfda_work_dir}/obsproc/obs_gts_{time_str}.3DVAR'],
+		depends=depends)
+	add_stage(stages, f'{prefix}wrfda_d01', wrfda_conv, config, 0, wrf_work_dir=wrf_work_dir, tag=tag, fg=fg_d01, wrfbdy=wrfbdy,
+		inputs=[fg_d01, wrfbdy],
+		outputs=[f'{wrfda_work_dir}/d01/wrfvar_output_{time_str}', f'{wrfda_work_dir}/d01/wrfbdy_d01_{time_str}.lateral_updated'],
+		depends=[f'{prefix}obsproc'])
+	add_stage(stages, f'{prefix}wrfda_d02', wrfda_conv, config, 1, wrf_work_dir=wrf_work_dir, tag=tag, fg=fg_d02,
+		inputs=[fg_d02],
+		outputs=[f'{wrfda_work_dir}/d02/wrfvar_output_{time_str}'],
+		depends=[f'{prefix}obsproc'])
+
+def wrfda_radar(config, wrf_work_dir=None):
+	# Run radar data assimilation.
+	cli.banner('Run radar DA')
+	config = copy.deepcopy(config)
 	config['custom']['wrfda']['dom'] = 1
-	wrf.config_wrfda(args.work_root, args.wrfda_root, config, args, wrf_work_dir=wrf_work_dir, tag=tag, fg=fg_d02)
-	wrf.run_wrfda_obsproc(args.work_root, args.wrfda_root, args.littler_root, config, args, tag=tag)
-	wrf.run_wrfda_3dvar(args.work_root, args.wrfda_root, config, args, wrf_work_dir=wrf_work_dir, tag=tag, fg=fg_d02)
+	if not 'wrfvar4' in config: config['wrfvar4'] = {}
+	config['wrfvar1']['write_increments'] = True
+	config['wrfvar2']['calc_w_increment'] = True
+	config['wrfvar2']['dt_cloud_model'] = False
+	config['wrfvar4']['thin_conv'] = True
+	config['wrfvar4']['thin_rainobs'] = False
+	config['wrfvar4']['thin_mesh_conv'] = 20
+	config['wrfvar4']['use_synopobs'] = False
+	config['wrfvar4']['use_shipsobs'] = False
+	config['wrfvar4']['use_metarobs'] = False
+	config['wrfvar4']['use_soundobs'] = False
+	config['wrfvar4']['use_pilotobs'] = False
+	config['wrfvar4']['use_airepobs'] = False
+	config['wrfvar4']['use_satemobs'] = False
+	config['wrfvar4']['use_geoamvobs'] = False
+	config['wrfvar4']['use_polaramvobs'] = False
+	config['wrfvar4']['use_gpsztdobs'] = False
+	config['wrfvar4']['use_gpspwobs'] = False
+	config['wrfvar4']['use_gpsrefobs'] = False
+	config['wrfvar4']['use_profilerobs'] = False
+	config['wrfvar4']['use_buoyobs'] = False
+	config['wrfvar4']['use_ssmiretrievalobs'] = False
+	config['wrfvar4']['use_ssmitbobs'] = False
+	config['wrfvar4']['use_ssmt1obs'] = False
+	config['wrfvar4']['use_ssmt2obs'] = False
+	config['wrfvar4']['use_qscatobs'] = False
+	config['wrfvar4']['use_bogusobs'] = False
+	config['wrfvar4']['use_airsretobs'] = False
+	config['wrfvar4']['use_radarobs'] = True
+	config['wrfvar4']['use_radar_rv'] = True
+	config['wrfvar4']['use_radar_rf'] = False
+	config['wrfvar4']['use_radar_rqv'] = True
+	config['wrfvar4']['use_radar_rhv'] = True
+	config['wrfvar4']['use_3dvar_phy'] = False
+	config['wrfvar4']['use_obs_errfac'] = False
+	config['wrfvar7']['cv_options'] = 7
+	config['wrfvar7']['cloud_cv_options'] = 3
+	config['wrfvar7']['as1'] = [0.25, 0.75, 1.5]
+	config['wrfvar7']['as2'] = [0.25, 0.75, 1.5]
+	config['wrfvar7']['as3'] = [0.25, 0.75, 1.5]
+	config['wrfvar7']['as4'] = [0.25, 0.75, 1.5]
+	config['wrfvar7']['as5'] = [0.25, 0.75, 1.5]
+	config['wrfvar7']['rf_passes'] = 4
+	config['wrfvar7']['var_scaling1'] = 2.0
+	config['wrfvar7']['var_scaling2'] = 2.0
+	config['wrfvar7']['var_scaling3'] = 2.0
+	config['wrfvar7']['var_scaling4'] = 2.0
+	config['wrfvar7']['var_scaling5'] = 2.0
+	config['wrfvar7']['len_scaling1'] = 0.5
+	config['wrfvar7']['len_scaling2'] = 0.5
+	config['wrfvar7']['len_scaling3'] = 0.5
+	config['wrfvar7']['len_scaling4'] = 0.5
+	config['wrfvar7']['len_scaling5'] = 0.5
+	config['wrfvar7']['je_factor'] = 1.0
+	config['wrfvar12']['balance_type'] = 1
+	fg_d02 = f'{args.work_root}/wrfda/d02/wrfvar_output'
+	wrf.config_wrfda(args.work_root, args.wrfda_root, config, args, wrf_work_dir=wrf_work_dir, tag='radar', fg=fg_d02)
+	wrf.run_wrfda_3dvar(args.work_root, args.wrfda_root, config, args, tag='radar', fg=fg_d02)
+	run(f'ln -sf {args.work_root}/wrfda/d01 {args.work_root}/wrfda_radar/')
+
+def run_wrf(config):
+	cli.banner('Run WRF warm forecast')
+	wrf.config_wrf(args.work_root, args.wrf_root, args.wrfda_root, config, args)
+	wrf.run_wrf(args.work_root, args.wrf_root, config, args, wrfda_work_dir=f'{args.work_root}/wrfda_radar')
+
+stages = {}
 
 if start_time.hour == 0:
 	cli.banner('Run WRF cold run')
@@ -167,112 +289,89 @@ if start_time.hour == 0:
 	coldrun_config['custom']['start_time'] = coldrun_start_time
 
 	# NOTE: Generate more 6hr for next warm run.
-	coldrun_config['custom']['forecast_hours'] = 12
-	coldrun_config['custom']['end_time'] = coldrun_config['custom']['start_time'].add(hours=coldrun_config['custom']['forecast_hours'])
-	wrf.config_wps(args.work_root, args.wps_root, args.geog_root, coldrun_config, args)
-	for i in range(coldrun_config['domains']['max_dom']):
-		run(f'ln -sf {os.path.dirname(args.work_root)}/wps/geo_em.d{str(i+1).zfill(2)}.nc {args.work_root}/wps/')
-	wrf.run_wps_ungrib_metgrid(args.work_root, args.wps_root, args.bkg_root, coldrun_config, args)
-
-	coldrun_config['custom']['end_time'] = coldrun_config['custom']['start_time'].add(hours=coldrun_config['custom']['forecast_hours'])
-	wrf.config_wrf(args.work_root, args.wrf_root, args.wrfda_root, coldrun_config, args, tag='coldrun')
-	wrf.run_real(args.work_root, args.work_root + '/wps', args.wrf_root, coldrun_config, args, tag='coldrun')
+	coldrun_wps_config = copy.deepcopy(coldrun_config)
+	coldrun_wps_config['custom']['forecast_hours'] = 12
+	coldrun_wps_config['custom']['end_time'] = coldrun_wps_config['custom']['start_time'].add(hours=coldrun_wps_config['custom']['forecast_hours'])
 
 	# Reconfigure WRF for cold run.
 	coldrun_config['custom']['forecast_hours'] = 6
 	coldrun_config['custom']['end_time'] = coldrun_config['custom']['start_time'].add(hours=coldrun_config['custom']['forecast_hours'])
-	wrf.config_wrf(args.work_root, args.wrf_root, args.wrfda_root, coldrun_config, args, tag='coldrun')
 
 	fg_d01 = f'{args.work_root}/wrf_coldrun/wrfinput_d01_{coldrun_start_time_str}'
 	fg_d02 = f'{args.work_root}/wrf_coldrun/wrfinput_d02_{coldrun_start_time_str}'
-	wrfbdy = f'{args.work_root}/wrf_coldrun/wrfbdy_d01'
+	wrfbdy = f'{args.work_root}/wrf_coldrun/wrfbdy_d01_{coldrun_start_time_str}'
 
-	wrfda_conv(coldrun_config, tag='coldrun', fg_d01=fg_d01, fg_d02=fg_d02, wrfbdy=wrfbdy)
-
-	# Run WRF for 6 hours.
-	wrf.run_wrf(args.work_root, args.wrf_root, coldrun_config, args, tag='coldrun')
+	add_stage(stages, 'coldrun_wps', run_wps, coldrun_wps_config, outputs=met_em_files(coldrun_wps_config))
+	add_stage(stages, 'coldrun_real', run_real, coldrun_wps_config, tag='coldrun', wrf_config=coldrun_config,
+		outputs=[fg_d01, fg_d02, wrfbdy], depends=['coldrun_wps'])
+	add_wrfda_conv_stages(stages, coldrun_config, tag='coldrun', fg_d01=fg_d01, fg_d02=fg_d02, wrfbdy=wrfbdy, depends=['coldrun_real'])
 
 	fg_d01 = f'{args.work_root}/wrf_coldrun/wrfout_d01_{start_time_str}'
 	fg_d02 = f'{args.work_root}/wrf_coldrun/wrfout_d02_{start_time_str}'
 	wrfbdy = f'{args.work_root}/wrf_coldrun/wrfbdy_d01'
+
+	# Run WRF for 6 hours.
+	add_stage(stages, 'coldrun_wrf', wrf.run_wrf, args.work_root, args.wrf_root, coldrun_config, args, tag='coldrun',
+		outputs=[fg_d01, fg_d02], depends=['coldrun_wrfda_d01', 'coldrun_wrfda_d02'])
+	add_wrfda_conv_stages(stages, config, wrf_work_dir=f'{args.work_root}/wrf', fg_d01=fg_d01, fg_d02=fg_d02, wrfbdy=wrfbdy)
 else:
-	wrf.config_wps(args.work_root, args.wps_root, args.geog_root, config, args)
-	for i in range(config['domains']['max_dom']):
-		run(f'ln -sf {os.path.dirname(args.work_root)}/wps/geo_em.d{str(i+1).zfill(2)}.nc {args.work_root}/wps/')
-	wrf.run_wps_ungrib_metgrid(args.work_root, args.wps_root, args.bkg_root, config, args)
-	wrf.config_wrf(args.work_root, args.wrf_root, args.wrfda_root, config, args)
-	wrf.run_real(args.work_root, args.work_root + '/wps', args.wrf_root, config, args)
 	prev_time = start_time.subtract(hours=3)
 	prev_work_root = os.path.dirname(args.work_root) + '/' + prev_time.format('YYYYMMDDHH')
 	fg_d01 = f'{prev_work_root}/wrf/wrfout_d01_{start_time_str}'
 	fg_d02 = f'{prev_work_root}/wrf/wrfout_d02_{start_time_str}'
-	wrfbdy = None
-
-wrfda_conv(config, wrf_work_dir=f'{args.work_root}/wrf', fg_d01=fg_d01, fg_d02=fg_d02, wrfbdy=wrfbdy)
-
-# Run radar data assimilation.
-cli.banner('Run radar DA')
-config['custom']['wrfda']['dom'] = 1
-if not 'wrfvar4' in config: config['wrfvar4'] = {}
-config['wrfvar1']['write_increments'] = True
-config['wrfvar2']['calc_w_increment'] = True
-config['wrfvar2']['dt_cloud_model'] = False
-config['wrfvar4']['thin_conv'] = True
-config['wrfvar4']['thin_rainobs'] = False
-config['wrfvar4']['thin_mesh_conv'] = 20
-config['wrfvar4']['use_synopobs'] = False
-config['wrfvar4']['use_shipsobs'] = False
-config['wrfvar4']['use_metarobs'] = False
-config['wrfvar4']['use_soundobs'] = False
-config['wrfvar4']['use_pilotobs'] = False
-config['wrfvar4']['use_airepobs'] = False
-config['wrfvar4']['use_satemobs'] = False
-config['wrfvar4']['use_geoamvobs'] = False
-config['wrfvar4']['use_polaramvobs'] = False
-config['wrfvar4']['use_gpsztdobs'] = False
-config['wrfvar4']['use_gpspwobs'] = False
-config['wrfvar4']['use_gpsrefobs'] = False
-config['wrfvar4']['use_profilerobs'] = False
-config['wrfvar4']['use_buoyobs'] = False
-config['wrfvar4']['use_ssmiretrievalobs'] = False
-config['wrfvar4']['use_ssmitbobs'] = False
-config['wrfvar4']['use_ssmt1obs'] = False
-config['wrfvar4']['use_ssmt2obs'] = False
-config['wrfvar4']['use_qscatobs'] = False
-config['wrfvar4']['use_bogusobs'] = False
-config['wrfvar4']['use_airsretobs'] = False
-config['wrfvar4']['use_radarobs'] = True
-config['wrfvar4']['use_radar_rv'] = True
-config['wrfvar4']['use_radar_rf'] = False
-config['wrfvar4']['use_radar_rqv'] = True
-config['wrfvar4']['use_radar_rhv'] = True
-config['wrfvar4']['use_3dvar_phy'] = False
-config['wrfvar4']['use_obs_errfac'] = False
-config['wrfvar7']['cv_options'] = 7
-config['wrfvar7']['cloud_cv_options'] = 3
-config['wrfvar7']['as1'] = [0.25, 0.75, 1.5]
-config['wrfvar7']['as2'] = [0.25, 0.75, 1.5]
-config['wrfvar7']['as3'] = [0.25, 0.75, 1.5]
-config['wrfvar7']['as4'] = [0.25, 0.75, 1.5]
-config['wrfvar7']['as5'] = [0.25, 0.75, 1.5]
-config['wrfvar7']['rf_passes'] = 4
-config['wrfvar7']['var_scaling1'] = 2.0
-config['wrfvar7']['var_scaling2'] = 2.0
-config['wrfvar7']['var_scaling3'] = 2.0
-config['wrfvar7']['var_scaling4'] = 2.0
-config['wrfvar7']['var_scaling5'] = 2.0
-config['wrfvar7']['len_scaling1'] = 0.5
-config['wrfvar7']['len_scaling2'] = 0.5
-config['wrfvar7']['len_scaling3'] = 0.5
-config['wrfvar7']['len_scaling4'] = 0.5
-config['wrfvar7']['len_scaling5'] = 0.5
-config['wrfvar7']['je_factor'] = 1.0
-config['wrfvar12']['balance_type'] = 1
-fg_d02 = f'{args.work_root}/wrfda/d02/wrfvar_output'
-wrf.config_wrfda(args.work_root, args.wrfda_root, config, args, tag='radar', fg=fg_d02)
-wrf.run_wrfda_3dvar(args.work_root, args.wrfda_root, config, args, tag='radar', fg=fg_d02)
-run(f'ln -sf {args.work_root}/wrfda/d01 {args.work_root}/wrfda_radar/')
-
-cli.banner('Run WRF warm forecast')
-wrf.config_wrf(args.work_root, args.wrf_root, args.wrfda_root, config, args)
-wrf.run_wrf(args.work_root, args.wrf_root, config, args, wrfda_work_dir=f'{args.work_root}/wrfda_radar')
+
+	add_stage(stages, 'wps', run_wps, config, outputs=met_em_files(config))
+	add_stage(stages, 'real', run_real, config,
+		outputs=[f'{args.work_root}/wrf/wrfinput_d{i+1:02d}_{start_time_str}' for i in range(config['domains']['max_dom'])] + [f'{args.work_root}/wrf/wrfbdy_d01_{start_time_str}'],
+		depends=['wps'])
+	add_wrfda_conv_stages(stages, config, wrf_work_dir=f'{args.work_root}/wrf', fg_d01=fg_d01, fg_d02=fg_d02, depends=['real'])
+
+add_stage(stages, 'wrfda_radar', wrfda_radar, config,
+	outputs=[f'{args.work_root}/wrfda_radar/d02/wrfvar_output_{start_time_str}'], depends=['wrfda_d02'])
+add_stage(stages, 'wrf', run_wrf, config,
+	outputs=[f'{args.work_root}/wrf/wrfout_d{i+1:02d}_{end_time_str}' for i in range(config['domains']['max_dom'])], depends=['wrfda_d01', 'wrfda_radar'])
+
+def submit_chain(config):
+	# Submit all jobs at once, so that their queue waits overlap with the running upstream jobs.
+	def submit(func, *func_args, depends=None, **kwargs):
+		args.depends = depends
+		args.chain_jobs = []
+		func(*func_args, **kwargs)
+		return args.chain_jobs
+	def tails(*jobs_list):
+		return [jobs[-1] for jobs in jobs_list if len(jobs) > 0]
+	args.chain = True
+	real_jobs = submit(run_real, config)
+	d01_jobs = submit(wrfda_conv, config, 0, wrf_work_dir=f'{args.work_root}/wrf', fg=fg_d01,
+		wrfbdy=f'{args.work_root}/wrf/wrfbdy_d01_{start_time_str}', depends=tails(real_jobs))
+	d02_jobs = submit(wrfda_conv, config, 1, wrf_work_dir=f'{args.work_root}/wrf', fg=fg_d02)
+	# First guess of radar DA does not exist yet, so take domain settings from previous forecast.
+	radar_jobs = submit(wrfda_radar, config, wrf_work_dir=f'{prev_work_root}/wrf', depends=tails(d02_jobs))
+	wrf_jobs = submit(run_wrf, config, depends=tails(real_jobs, d01_jobs, d02_jobs, radar_jobs))
+	args.chain = False
+	if len(wrf_jobs) > 0:
+		cli.notice(f'Wait for the last job {wrf_jobs[-1]}.')
+		wait_job(args, wrf_jobs[-1], f'{args.work_root}/wrf/rsl.out.0000')
+	for name, jobs in (('real', real_jobs), ('wrfda_d01', d01_jobs), ('wrfda_d02', d02_jobs), ('wrfda_radar', radar_jobs), ('wrf', wrf_jobs)):
+		for job_id in jobs: record_job(args, job_id, name)
+	export_telemetry(args.work_root)
+	# Failed jobs cancel their dependents, so find out the first stage that did not finish.
+	# Record chained stages as run_stages does, so that a restarted cycle skips the finished ones.
+	db = open_state(args.work_root)
+	failed = None
+	for name in ('real', 'wrfda_d01', 'wrfda_d02', 'wrfda_radar', 'wrf'):
+		missing = [file for file in stages[name]['outputs'] if not os.path.isfile(file)]
+		record_id = record_start(db, name, stages[name]['inputs'])
+		if len(missing) > 0 and not failed: failed = (name, missing)
+		record_end(db, record_id, 1 if failed else 0, stages[name]['outputs'] if not failed else None)
+	if failed: cli.error(f'Stage {failed[0]} failed to generate {failed[1]}!')
+	cli.notice('Succeeded.')
+
+if args.use_chain and start_time.hour != 0:
+	# Only WPS and obsproc run in the driver before any job is submitted, so obsproc does not wait for real,
+	# and takes domain extent from configuration or wrfinput of previous run, which are not written by real now.
+	run_stages({ 'wps': stages['wps'], 'obsproc': dict(stages['obsproc'], depends=[]) }, max_workers=args.max_parallel_stages, state_dir=args.work_root, force=args.force)
+	submit_chain(config)
+else:
+	# Stage records in cycle_state.db let a restarted cycle skip verified stages.
+	run_stages(stages, max_workers=args.max_parallel_stages, state_dir=args.work_root, force=args.force)
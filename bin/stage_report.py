@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+
+import argparse
+from glob import glob
+import json
+import os
+import sys
+sys.path.append(f'{os.path.dirname(os.path.realpath(__file__))}/../utils')
+from utils import cli, percentile, telemetry_file_name
+
+parser = argparse.ArgumentParser(description='Aggregate stage, operator and job durations recorded by cycles.', formatter_class=argparse.RawTextHelpFormatter)
+parser.add_argument('-w', '--work-root', dest='work_root', help='Root directory containing cycle work directories')
+parser.add_argument('-k', '--kind', help='Only show given kind of records (stage, operator or job)')
+parser.add_argument('-l', '--last', help='Only use last given number of cycles', type=int)
+args = parser.parse_args()
+
+if not args.work_root:
+	if os.getenv('WORK_ROOT'):
+		args.work_root = os.getenv('WORK_ROOT')
+	else:
+		cli.error('Option --work-root or environment variable WORK_ROOT need to be set!')
+args.work_root = os.path.abspath(args.work_root)
+
+telemetry_files = sorted(glob(f'{args.work_root}/{telemetry_file_name}') + glob(f'{args.work_root}/*/{telemetry_file_name}'))
+if args.last: telemetry_files = telemetry_files[-args.last:]
+if len(telemetry_files) == 0: cli.error(f'There is no {telemetry_file_name} in {args.work_root}!')
+
+records = {}
+for telemetry_file in telemetry_files:
+	cycle = os.path.basename(os.path.dirname(telemetry_file))
+	for event in json.load(open(telemetry_file))['events']:
+		if args.kind and event['cat'] != args.kind: continue
+		if event.get('status') == 'failed': continue
+		record = records.setdefault((event['cat'], event['name']), { 'durations': [], 'queue_waits': [], 'max_rss': [], 'last': None })
+		duration = event['end'] - event.get('run_start', event['start'])
+		record['durations'].append(duration)
+		if 'queue_wait' in event: record['queue_waits'].append(event['queue_wait'])
+		if 'max_rss' in event: record['max_rss'].append(event['max_rss'])
+		record['last'] = (cycle, duration)
+
+cli.notice(f'Durations in seconds of {len(telemetry_files)} cycles:')
+print(f'{"kind":<10} {"name":<24} {"runs":>5} {"p50":>10} {"p95":>10} {"queue p50":>10} {"rss p95":>10} {"last":>10}')
+for (cat, name), record in sorted(records.items()):
+	p50 = percentile(record['durations'], 50)
+	p95 = percentile(record['durations'], 95)
+	queue_wait = percentile(record['queue_waits'], 50)
+	max_rss = percentile(record['max_rss'], 95)
+	cycle, last = record['last']
+	line = f'{cat:<10} {name:<24} {len(record["durations"]):>5} {p50:10.1f} {p95:10.1f} ' + \
+		(f'{queue_wait:10.1f} ' if queue_wait != None else f'{"-":>10} ') + \
+		(f'{max_rss / 1024**3:9.2f}G ' if max_rss != None else f'{"-":>10} ') + \
+		f'{last:10.1f}'
+	# Flag stages whose last run is slower than most of previous ones.
+	if len(record['durations']) > 2 and last > percentile(record['durations'][:-1], 95):
+		line = cli.red(line) + f' (regressed in {cycle})'
+	print(line)
@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+sys.path.append(f'{os.path.dirname(os.path.realpath(__file__))}/../utils')
+from utils import cli, write_incr_stats, incr_stats_file_name
+
+parser = argparse.ArgumentParser(description='Compute statistics of WRFDA analysis increments per level.', formatter_class=argparse.RawTextHelpFormatter)
+parser.add_argument('-w', '--wrfda-work-dir', dest='wrfda_work_dir', help='WRFDA work directory containing fg and wrfvar_output', default='.')
+parser.add_argument(      '--fg', help='First guess file (default is fg in work directory)')
+parser.add_argument('-a', '--analysis', help='Analysis file (default is wrfvar_output in work directory)')
+parser.add_argument('-o', '--output', help=f'Output JSON file (default is {incr_stats_file_name} in work directory)')
+parser.add_argument('-v', '--vars', help='Variables separated by comma')
+parser.add_argument('-b', '--num-bins', dest='num_bins', help='Number of histogram bins', default=20, type=int)
+parser.add_argument('-l', '--levels', help='Print statistics of each level', action='store_true')
+args = parser.parse_args()
+
+args.wrfda_work_dir = os.path.abspath(args.wrfda_work_dir)
+if not args.fg: args.fg = f'{args.wrfda_work_dir}/fg'
+if not args.analysis: args.analysis = f'{args.wrfda_work_dir}/wrfvar_output'
+if not args.output: args.output = f'{args.wrfda_work_dir}/{incr_stats_file_name}'
+for file_path in (args.fg, args.analysis):
+	if not os.path.isfile(file_path): cli.error(f'File {file_path} does not exist!')
+
+kwargs = { 'num_bins': args.num_bins }
+if args.vars: kwargs['vars'] = args.vars.split(',')
+stats = write_incr_stats(args.fg, args.analysis, args.output, **kwargs)
+
+if args.levels:
+	for var, x in stats.items():
+		print(f'{var} ({x["units"]})')
+		print(f'{"level":>6}{"mean":>14}{"rms":>14}{"max_abs":>14}')
+		for k, level in enumerate(x['levels']):
+			if not level: continue
+			print(f'{k:>6}{level["mean"]:14.4e}{level["rms"]:14.4e}{level["max_abs"]:14.4e}')
+
+cli.notice(f'Write {args.output}.')
@@ -1,7 +1,6 @@
 #!/usr/bin/env python3
 
 import argparse
-from glob import glob
 import matplotlib
 matplotlib.use('agg')
 import matplotlib.pyplot as plt
@@ -9,111 +8,67 @@ from matplotlib.backends.backend_pdf import PdfPages
 import cartopy.crs as crs
 import numpy as np
 from subprocess import run, PIPE
+try:
+	import pyodc as odc
+except ImportError:
+	odc = None
 
 parser = argparse.ArgumentParser(description="Plot FSO result from ODB files.", formatter_class=argparse.RawTextHelpFormatter)
 parser.add_argument('-i', '--input-prefix', dest='input_prefix', help='Input ODB file prefix')
 args = parser.parse_args()
 
-file_paths = [file_path for file_path in sorted(glob(args.input_prefix + '*')) if not file_path.endswith('.pdf')]
+var_types = ('u', 'v', 't', 'q', 'p')
+columns = ['obs_type', 'sid', 'lon', 'lat', 'p'] + [f'{var}_{x}' for var in var_types for x in ('impact', 'qc')]
 
-cmd = f'odb sql "select *" -T -i {file_paths[1]}'
-res = run(cmd, shell=True, stdout=PIPE, stderr=PIPE)
-if res.returncode != 0:
-	print(f'[Error]: Failed to run {cmd}!')
-	exit(1)
-
-obs_impact = {}
-for line in res.stdout.decode('utf-8').strip().split('\n'):
-	obs_type, impact = line.split()
-	obs_impact[obs_type.replace("'", '')] = float(impact)
-
-cmd = f'odb sql "select *" -T -i {file_paths[2]}'
-res = run(cmd, shell=True, stdout=PIPE, stderr=PIPE)
-if res.returncode != 0:
-	print(f'[Error]: Failed to run {cmd}!')
-	exit(1)
-
-var_impact = {}
-for line in res.stdout.decode('utf-8').strip().split('\n'):
-	var_type, impact = line.split()
-	var_impact[var_type.replace("'", '')] = float(impact)
-
-p = (1000,950,900,850,800,750,700,650,600,550,500,400,300,200,100)
-sound_lev_impact = { 'u': {}, 'v': {}, 't': {}, 'q': {} }
-for k in range(len(p)):
-	for var in ('u', 'v', 't', 'q'):
-		sound_lev_impact[var][p[k]] = []
-	p1 = p[k] - 0.5 * (p[k] - (p[k+1] if k != len(p) - 1 else p[-1] - 50))
-	p2 = p[k] + 0.5 * ((p[k-1] if k != 0 else p[0] + 50) - p[k])
-	cmd = f'''
-odb sql \'select u_impact, u_qc, v_impact, v_qc, t_impact, t_qc, q_impact, q_qc
-where obs_type="sound" and p>={p1*100} and p<={p2*100}\' -T -i {file_paths[0]}
-'''
+def read_odb(file_path, table, columns, string_columns=('obs_type', 'var_type', 'sid')):
+	# Read needed columns of all records once, missing values are NaN.
+	if odc:
+		df = odc.read_odb(file_path, single=True, columns=[f'{column}@{table}' for column in columns])
+		return { column: df[f'{column}@{table}'].to_numpy() if column in string_columns else
+			df[f'{column}@{table}'].to_numpy(dtype=float, na_value=np.nan) for column in columns }
+	cmd = f'odb sql \'select {",".join(columns)}\' -T -i {file_path}'
 	res = run(cmd, shell=True, stdout=PIPE, stderr=PIPE)
 	if res.returncode != 0:
 		print(f'[Error]: Failed to run {cmd}!')
 		exit(1)
-	for line in res.stdout.decode('utf-8').strip().split('\n'):
-		lev = {}
-		columns = line.split()
-		if len(columns) == 0:
-			print(f'[Warning]: Empty record at {p[k]} pressure level!')
-			continue
-		u_impact = columns[0]; u_qc = columns[1]
-		if u_impact != 'NULL' and u_qc in ('0', '2'): sound_lev_impact['u'][p[k]].append(float(u_impact))
-		v_impact = columns[2]; v_qc = columns[3]
-		if v_impact != 'NULL' and v_qc in ('0', '2'): sound_lev_impact['v'][p[k]].append(float(v_impact))
-		t_impact = columns[4]; t_qc = columns[5]
-		if t_impact != 'NULL' and t_qc in ('0', '2'): sound_lev_impact['t'][p[k]].append(float(t_impact))
-		q_impact = columns[6]; q_qc = columns[7]
-		if q_impact != 'NULL' and q_qc in ('0', '2'): sound_lev_impact['q'][p[k]].append(float(q_impact))
-
-# p = (1000,950,900,850,800,750,700,650,600,550,500,400,300,200,100)
-# profiler_lev_impact = { 'u': {}, 'v': {} }
-# for k in range(len(p)):
-# 	for var in ('u', 'v'):
-# 		profiler_lev_impact[var][p[k]] = []
-# 	p1 = p[k] - 0.5 * (p[k] - (p[k+1] if k != len(p) - 1 else p[-1] - 50))
-# 	p2 = p[k] + 0.5 * ((p[k-1] if k != 0 else p[0] + 50) - p[k])
-# 	cmd = f'''
-# odb sql \'select u_impact, u_qc, v_impact, v_qc
-# where obs_type="profiler" and p>={p1*100} and p<={p2*100}\' -T -i {file_paths[0]}
-# '''
-# 	res = run(cmd, shell=True, stdout=PIPE, stderr=PIPE)
-# 	if res.returncode != 0:
-# 		print(f'[Error]: Failed to run {cmd}!')
-# 		exit(1)
-# 	for line in res.stdout.decode('utf-8').strip().split('\n'):
-# 		lev = {}
-# 		columns = line.split()
-# 		if len(columns) == 0:
-# 			print(f'[Warning]: Empty record at {p[k]} pressure level!')
-# 			continue
-# 		u_impact = columns[0]; u_qc = columns[1]
-# 		if u_impact != 'NULL' and u_qc in ('0', '2'): profiler_lev_impact['u'][p[k]].append(float(u_impact))
-# 		v_impact = columns[2]; v_qc = columns[3]
-# 		if v_impact != 'NULL' and v_qc in ('0', '2'): profiler_lev_impact['v'][p[k]].append(float(v_impact))
-
-synop_impact = { 'u': {}, 'v': {}, 't': {}, 'q': {} }
+	rows = np.array([line.split() for line in res.stdout.decode('utf-8').strip().split('\n') if len(line.split()) == len(columns)], dtype=str).reshape(-1, len(columns))
+	data = {}
+	for i, column in enumerate(columns):
+		if column in string_columns:
+			data[column] = np.char.strip(rows[:,i], "'")
+		else:
+			data[column] = np.where(rows[:,i] == 'NULL', 'nan', rows[:,i]).astype(float)
+	return data
+
+data = read_odb(f'{args.input_prefix}.detail_impact', 'detail_impact', columns)
+
+# Only count observations that passed quality control.
+valid = { var: ~np.isnan(data[f'{var}_impact']) & np.isin(data[f'{var}_qc'], (0, 2)) for var in var_types }
+
+# Total impacts per observation and variable types are summed by write_fso_odb.py.
+table = read_odb(f'{args.input_prefix}.obs_impact', 'fso_obs_impact', ['obs_type', 'obs_impact'])
+obs_impact = dict(zip(table['obs_type'], table['obs_impact']))
+table = read_odb(f'{args.input_prefix}.var_impact', 'fso_var_impact', ['var_type', 'var_impact'])
+var_impact = dict(zip(table['var_type'], table['var_impact']))
+
+# Sum sounding impacts in pressure bands around levels.
+p = (1000,950,900,850,800,750,700,650,600,550,500,400,300,200,100)
+edges = [p[-1] - 25] + [0.5 * (p[k] + p[k+1]) for k in reversed(range(len(p) - 1))] + [p[0] + 25]
+sound = data['obs_type'] == 'sound'
+level_index = len(p) - np.digitize(data['p'] / 100, edges)
+in_band = sound & (level_index >= 0) & (level_index < len(p))
+sound_lev_impact = {}
 for var in ('u', 'v', 't', 'q'):
-	cmd = f'''
-odb sql \'select sid, lon, lat, {var}_impact, {var}_qc
-where obs_type="synop"\' -T -i {file_paths[0]}
-'''
-	res = run(cmd, shell=True, stdout=PIPE, stderr=PIPE)
-	if res.returncode != 0:
-		print(f'[Error]: Failed to run {cmd}!')
-	for line in res.stdout.decode('utf-8').strip().split('\n'):
-		columns = line.split()
-		if len(columns) == 0:
-			print(f'[Warning]: Empty record!')
-			continue
-		if columns[3] != 'NULL' and columns[4] in ('0', '2'):
-			synop_impact[var][columns[0]] = {
-				'lon': float(columns[1]),
-				'lat': float(columns[2]),
-				'impact': float(columns[3])
-			}
+	mask = in_band & valid[var]
+	sound_lev_impact[var] = dict(zip(p, np.bincount(level_index[mask], weights=data[f'{var}_impact'][mask], minlength=len(p))))
+for k in np.where(np.bincount(level_index[in_band], minlength=len(p)) == 0)[0]:
+	print(f'[Warning]: Empty record at {p[k]} pressure level!')
+
+synop = data['obs_type'] == 'synop'
+synop_impact = {}
+for var in ('u', 'v', 't', 'q'):
+	mask = synop & valid[var]
+	synop_impact[var] = { 'lon': data['lon'][mask], 'lat': data['lat'][mask], 'impact': data[f'{var}_impact'][mask] }
 
 pdf = PdfPages(f'{args.input_prefix}.pdf')
 
@@ -136,11 +91,8 @@ plt.ticklabel_format(axis='x', style='sci', scilimits=(-2,2))
 pdf.savefig()
 
 for var_type, levels in sound_lev_impact.items():
-	impact = []
-	for _, var_impact in levels.items():
-		impact.append(sum(var_impact))
 	fig = plt.figure(figsize=(6, 4))
-	plt.barh(list(levels.keys()), impact, color='blue', height=20, zorder=2)
+	plt.barh(list(levels.keys()), list(levels.values()), color='blue', height=20, zorder=2)
 	plt.gca().set_xlabel(f'Impact of {var_type}@sound')
 	plt.gca().set_ylabel('Pressure Levels')
 	plt.gca().yaxis.tick_right()
@@ -149,30 +101,16 @@ for var_type, levels in sound_lev_impact.items():
 	plt.ticklabel_format(axis='x', style='sci', scilimits=(-2,2))
 	pdf.savefig()
 
-# for var_type, levels in profiler_lev_impact.items():
-# 	impact = []
-# 	for _, var_impact in levels.items():
-# 		impact.append(sum(var_impact))
-# 	fig = plt.figure(figsize=(6, 4))
-# 	plt.barh(list(levels.keys()), impact, color='blue', height=20, zorder=2)
-# 	plt.gca().set_xlabel(f'Impact of {var_type}@profiler')
-# 	plt.gca().set_ylabel('Pressure Levels')
-# 	plt.gca().yaxis.tick_right()
-# 	plt.gca().invert_yaxis()
-# 	plt.grid(True, color='gray', zorder=1)
-#		plt.ticklabel_format(axis='x', style='sci', scilimits=(-2,2))
-# 	pdf.savefig()
-
 proj = crs.PlateCarree()
 
 for var in ('u', 'v', 't', 'q'):
 	fig = plt.figure(figsize=(6, 4))
 	ax = fig.add_subplot(1, 1, 1, projection=proj)
 	ax.set_title(f'Variable: {var}')
-	lon = [x['lon'] for _, x in synop_impact[var].items()]
-	lat = [x['lat'] for _, x in synop_impact[var].items()]
-	impact = [x['impact'] for _, x in synop_impact[var].items()]
-	impact_lim = max((abs(min(impact)), abs(max(impact))))
+	lon = synop_impact[var]['lon']
+	lat = synop_impact[var]['lat']
+	impact = synop_impact[var]['impact']
+	impact_lim = np.abs(impact).max() if len(impact) > 0 else 1
 	im = ax.scatter(lon, lat, c=impact, cmap='bwr', vmin=-impact_lim, vmax=impact_lim)
 	pdf.savefig()
 
@@ -7,7 +7,7 @@ from pprint import pprint
 import os
 import sys
 sys.path.append(f'{os.path.dirname(os.path.realpath(__file__))}/../utils')
-from utils import cli, parse_config, has_key, get_value, run, copy_netcdf_file, wrf_version, Version
+from utils import cli, parse_config, has_key, get_value, run, copy_netcdf_file, wrf_version, Version, add_stage, run_stages
 sys.path.append(f'{os.path.dirname(os.path.realpath(__file__))}/../operators')
 import wrf_operators as wrf
 
@@ -28,6 +28,7 @@ parser.add_argument('-n', '--num-proc', dest='np', help='MPI process number to r
 parser.add_argument(      '--ntasks-per-node', dest='ntasks_per_node', help='Override the default setting.', default=None, type=int)
 parser.add_argument(      '--slurm', help='Use SLURM job management system to run MPI jobs.', action='store_true')
 parser.add_argument(      '--pbs', help='Use PBS job management system variants (e.g. TORQUE) to run MPI jobs.', action='store_true')
+parser.add_argument(      '--max-parallel-stages', dest='max_parallel_stages', help='Maximum number of stages running concurrently.', type=int)
 parser.add_argument('-v', '--verbose', help='Print out work log', action='store_true')
 parser.add_argument('-f', '--force', help='Force to run', action='store_true')
 args = parser.parse_args()
@@ -142,45 +143,26 @@ end_time_str = end_time.format(datetime_fmt)
 if not os.path.isdir(args.work_root + '/fb'):  os.mkdir(args.work_root + '/fb')
 if not os.path.isdir(args.work_root + '/fa'):  os.mkdir(args.work_root + '/fa')
 if not os.path.isdir(args.work_root + '/ref'): os.mkdir(args.work_root + '/ref')
+if not os.path.isdir(args.work_root + '/fa/wrf'): os.mkdir(args.work_root + '/fa/wrf')
+if not os.path.isdir(args.work_root + '/fa/wrfplus'): os.mkdir(args.work_root + '/fa/wrfplus')
+if not os.path.isdir(args.work_root + '/fb/wrfplus'): os.mkdir(args.work_root + '/fb/wrfplus')
+if not os.path.isdir(args.work_root + '/sens'): os.mkdir(args.work_root + '/sens')
 
 if not has_key(config, ('wrfvar7', 'cv_options')):
 	cli.error('cv_options in wrfvar7 is not set!')
 
-wrf.config_wps(args.work_root, args.wps_root, args.geog_root, config, args)
-wrf.run_wps_geogrid(args.work_root, args.wps_root, config, args)
-
 # Spin up 6 hours.
 spinup_hours = get_value(config['custom'], 'spinup_hours', 6)
 spinup_config = copy.deepcopy(config)
 spinup_config['custom']['start_time'] = config['custom']['start_time'].subtract(hours=spinup_hours)
 spinup_config['custom']['forecast_hours'] += spinup_hours
-wrf.config_wps(args.work_root, args.wps_root, args.geog_root, spinup_config, args)
+spinup_start_time_str = spinup_config['custom']['start_time'].format(datetime_fmt)
 
-# Run forecast with xb as initial condition.
-cli.banner('                   Run forecast with xb as initial condition')
-wrf.run_wps_ungrib_metgrid(args.work_root, args.wps_root, args.bkg_root, spinup_config, args)
-wrf.config_wrf(args.work_root + '/fb', args.wrf_root, args.wrfda_root, spinup_config, args)
-wrf.run_real(args.work_root + '/fb', args.work_root + '/wps', args.wrf_root, spinup_config, args)
-wrf.run_wrf(args.work_root + '/fb', args.wrf_root, spinup_config, args)
+fa_config = copy.deepcopy(config)
+fa_config['wrfvar6']['orthonorm_gradient'] = True
+fa_config['wrfvar6']['use_lanczos'] = True
+fa_config['wrfvar6']['write_lanczos'] = True
 
-# Run forecast with xa as initial condition.
-cli.banner('                   Run forecast with xa as initial condition')
-if not os.path.isdir(args.work_root + '/fa/wrf'): os.mkdir(args.work_root + '/fa/wrf')
-fg = f'{args.work_root}/fb/wrf/wrfout_d01_{start_time_str}'
-run(f'cp --remove-destination {args.work_root}/fb/wrf/wrfbdy_d01 {args.work_root}/fa/wrf/wrfbdy_d01')
-config['wrfvar6']['orthonorm_gradient'] = True
-config['wrfvar6']['use_lanczos'] = True
-config['wrfvar6']['write_lanczos'] = True
-wrf.config_wrfda(args.work_root + '/fa', args.wrfda_root, config, args, fg=fg)
-if config['wrfvar3']['ob_format'] == 2:
-	wrf.run_wrfda_obsproc(args.work_root + '/fa', args.wrfda_root, args.littler_root, config, args)
-wrf.run_wrfda_3dvar(args.work_root + '/fa', args.wrfda_root, config, args, fg=fg)
-wrf.run_wrfda_update_bc(args.work_root + '/fa', args.wrfda_root, False, config, args)
-wrf.config_wrf(args.work_root + '/fa', args.wrf_root, args.wrfda_root, config, args)
-wrf.run_wrf(args.work_root + '/fa', args.wrf_root, config, args)
-
-# Interpolate reference at valid time.
-cli.banner('                   Interpolate reference at valid time')
 ref_config = copy.deepcopy(config)
 ref_config['custom']['start_time'] = config['custom']['end_time']
 if not args.ref_root:
@@ -192,20 +174,49 @@ else:
 		'file_pattern': 'gdas.t{{ bkg_start_time.format("HH") }}z.pgrb2.*.f{{ "%03d" % bkg_forecast_hour }}',
 		'dir_pattern': 'gdas.{{ bkg_start_time.format("YYYYMMDD") }}/{{ bkg_start_time.format("HH") }}'
 	}
-wrf.config_wps(args.work_root + '/ref', args.wps_root, args.geog_root, ref_config, args)
-run(f'ln -sf {args.work_root}/wps/geo_em.d01.nc {args.work_root}/ref/wps')
-wrf.run_wps_ungrib_metgrid(args.work_root + '/ref', args.wps_root, args.ref_root, ref_config, args)
-wrf.config_wrf(args.work_root + '/ref', args.wrf_root, args.wrfda_root, ref_config, args)
-wrf.run_real(args.work_root + '/ref', args.work_root + '/ref/wps', args.wrf_root, ref_config, args)
- 
-# Calculate forecast error measures.
-cli.banner('                   Calculate forecast error measures')
-if not os.path.isdir(args.work_root + '/fa/wrfplus'): os.mkdir(args.work_root + '/fa/wrfplus')
-if not os.path.isdir(args.work_root + '/fb/wrfplus'): os.mkdir(args.work_root + '/fb/wrfplus')
 
-xt  = Dataset(f'{args.work_root}/ref/wrf/wrfinput_d01_{end_time_str}', 'r')
-xaf = Dataset(f'{args.work_root}/fa/wrf/wrfout_d01_{end_time_str}',    'r')
-xbf = Dataset(f'{args.work_root}/fb/wrf/wrfout_d01_{end_time_str}',    'r')
+sens_config = copy.deepcopy(fa_config)
+sens_config['wrfvar6']['write_lanczos'] = False
+sens_config['wrfvar6']['read_lanczos'] = True
+sens_config['wrfvar17']['adj_sens'] = True
+sens_config['wrfvar17']['sensitivity_option'] = 0
+sens_config['wrfvar17']['analysis_type'] = 'QC-OBS'
+sens_config['time_control']['io_form_auxinput17'] = 2
+sens_config['time_control']['auxinput17_inname'] = './gr01'
+sens_config['time_control']['iofields_filename'] = f'{args.wrfda_root}/var/run/fso.io_config'
+
+def run_geogrid(config):
+	wrf.config_wps(args.work_root, args.wps_root, args.geog_root, config, args)
+	wrf.run_wps_geogrid(args.work_root, args.wps_root, config, args)
+
+def run_fb_wps(config):
+	cli.banner('                   Run forecast with xb as initial condition')
+	wrf.config_wps(args.work_root, args.wps_root, args.geog_root, config, args)
+	wrf.run_wps_ungrib_metgrid(args.work_root, args.wps_root, args.bkg_root, config, args)
+
+def run_real(work_root, wps_work_dir, config):
+	wrf.config_wrf(work_root, args.wrf_root, args.wrfda_root, config, args)
+	wrf.run_real(work_root, wps_work_dir, args.wrf_root, config, args)
+
+def run_wrf(work_root, config):
+	wrf.config_wrf(work_root, args.wrf_root, args.wrfda_root, config, args)
+	wrf.run_wrf(work_root, args.wrf_root, config, args)
+
+def run_fa_wrfda(config, fg, wrfbdy):
+	cli.banner('                   Run forecast with xa as initial condition')
+	run(f'cp --remove-destination {wrfbdy} {args.work_root}/fa/wrf/wrfbdy_d01')
+	wrf.config_wrfda(args.work_root + '/fa', args.wrfda_root, config, args, fg=fg)
+	if config['wrfvar3']['ob_format'] == 2:
+		wrf.run_wrfda_obsproc(args.work_root + '/fa', args.wrfda_root, args.littler_root, config, args)
+	wrf.run_wrfda_3dvar(args.work_root + '/fa', args.wrfda_root, config, args, fg=fg)
+	wrf.run_wrfda_update_bc(args.work_root + '/fa', args.wrfda_root, False, config, args)
+
+def run_ref(config):
+	cli.banner('                   Interpolate reference at valid time')
+	wrf.config_wps(args.work_root + '/ref', args.wps_root, args.geog_root, config, args)
+	run(f'ln -sf {args.work_root}/wps/geo_em.d01.nc {args.work_root}/ref/wps')
+	wrf.run_wps_ungrib_metgrid(args.work_root + '/ref', args.wps_root, args.ref_root, config, args)
+	run_real(args.work_root + '/ref', args.work_root + '/ref/wps', config)
 
 def calc_final_sens(a, b, c):
 	for var_name in ('U', 'V', 'T', 'P'):
@@ -221,52 +232,27 @@ def calc_final_sens(a, b, c):
 		elif var_name == 'P':
 			xc[:] = xc[:] * (1.0 / 300.0)**2
 
-if not os.path.isfile(f'{args.work_root}/fa/wrfplus/final_sens_d01') or args.force:
-	cli.notice(f'Calculate final sensitivity {args.work_root}/fa/wrfplus/final_sens_d01.')
-	run(f'cp {args.work_root}/fa/wrf/wrfout_d01_{end_time_str} {args.work_root}/fa/wrfplus/final_sens_d01')
-	saf = Dataset(f'{args.work_root}/fa/wrfplus/final_sens_d01', 'r+')
-	calc_final_sens(xaf, xt, saf)
-	saf.close()
-else:
-	run(f'ls -l {args.work_root}/fa/wrfplus/final_sens_d01')
-
-if not os.path.isfile(f'{args.work_root}/fb/wrfplus/final_sens_d01'):
-	cli.notice(f'Calculate final sensitivity {args.work_root}/fb/wrfplus/final_sens_d01.')
-	run(f'cp {args.work_root}/fb/wrf/wrfout_d01_{end_time_str} {args.work_root}/fb/wrfplus/final_sens_d01')
-	sbf = Dataset(f'{args.work_root}/fb/wrfplus/final_sens_d01', 'r+')
-	calc_final_sens(xbf, xt, sbf)
-	sbf.close()
-else:
-	run(f'ls -l {args.work_root}/fb/wrfplus/final_sens_d01')
-
-xt.close()
-xaf.close()
-xbf.close()
-
-# Run adjoint model with forecast error.
-cli.banner('                   Run adjoint for forecast from background')
-wrf.config_wrfplus(args.work_root + '/fb', args.wrfplus_root, config, args)
-wrf.run_wrfplus_ad(args.work_root + '/fb', args.wrfplus_root, config, args)
-wrf.config_wrfplus(args.work_root + '/fa', args.wrfplus_root, config, args)
-wrf.run_wrfplus_ad(args.work_root + '/fa', args.wrfplus_root, config, args)
-
-# Calculate forecast sensitivity.
-cli.banner('                   Calculate forecast sensitivity')
-
-if not os.path.isdir(f'{args.work_root}/sens'): os.mkdir(args.work_root + '/sens')
-
-config['wrfvar6']['write_lanczos'] = False
-config['wrfvar6']['read_lanczos'] = True
-config['wrfvar17']['adj_sens'] = True
-config['wrfvar17']['sensitivity_option'] = 0
-config['wrfvar17']['analysis_type'] = 'QC-OBS'
-config['time_control']['io_form_auxinput17'] = 2
-config['time_control']['auxinput17_inname'] = './gr01'
-config['time_control']['iofields_filename'] = f'{args.wrfda_root}/var/run/fso.io_config'
-wrf.config_wrfda(args.work_root + '/sens', args.wrfda_root, config, args, args.work_root + '/fa/wrf')
+def run_final_sens(xt_file, xf_files, sens_files):
+	cli.banner('                   Calculate forecast error measures')
+	xt = Dataset(xt_file, 'r')
+	for xf_file, sens_file in zip(xf_files, sens_files):
+		if not os.path.isfile(sens_file) or args.force:
+			cli.notice(f'Calculate final sensitivity {sens_file}.')
+			run(f'cp {xf_file} {sens_file}')
+			xf = Dataset(xf_file, 'r')
+			sf = Dataset(sens_file, 'r+')
+			calc_final_sens(xf, xt, sf)
+			sf.close()
+			xf.close()
+		else:
+			run(f'ls -l {sens_file}')
+	xt.close()
 
-cli.notice('Add two init_sens_d01 data.')
-os.chdir(args.work_root + '/sens/wrfda')
+def run_wrfplus(work_roots, config):
+	cli.banner('                   Run adjoint for forecasts from background and analysis')
+	for work_root in work_roots:
+		wrf.config_wrfplus(work_root, args.wrfplus_root, config, args)
+	wrf.run_wrfplus_ad_array(work_roots, args.wrfplus_root, config, args)
 
 def add_init_sens(a, b, c):
 	for var_name in ('A_U', 'A_V', 'A_T', 'A_W', 'A_PH', 'A_MU', 'A_QVAPOR'):
@@ -275,18 +261,48 @@ def add_init_sens(a, b, c):
 		xc = c.variables[var_name]
 		xc[:] = xa[:] + xb[:]
 
-run(f'cp {args.work_root}/fa/wrfplus/init_sens_d01_{start_time_str} ad_d01_{start_time_str}')
-sa = Dataset(f'{args.work_root}/fa/wrfplus/init_sens_d01_{start_time_str}', 'r')
-sb = Dataset(f'{args.work_root}/fb/wrfplus/init_sens_d01_{start_time_str}', 'r')
-ad = Dataset(f'ad_d01_{start_time_str}', 'r+')
-add_init_sens(sa, sb, ad)
-sa.close()
-sb.close()
-ad.close()
-run(f'ln -sf ad_d01_{start_time_str} gr01')
-if config['wrfvar3']['ob_format'] == 2:
-	if not os.path.isdir('obsproc'): os.makedirs('obsproc')
-	run(f'ln -sf {args.work_root}/fa/wrfda/obsproc/obs_gts_{start_time_str}.3DVAR obsproc')
-run(f'ln -sf {args.work_root}/fa/lanczos_eigenpairs.* ..')
-
-wrf.run_wrfda_3dvar(args.work_root + '/sens', args.wrfda_root, config, args, args.work_root + '/fa/wrf')
+def run_sens(config, sa_file, sb_file):
+	cli.banner('                   Calculate forecast sensitivity')
+	wrf.config_wrfda(args.work_root + '/sens', args.wrfda_root, config, args, args.work_root + '/fa/wrf')
+
+	cli.notice('Add two init_sens_d01 data.')
+	os.chdir(args.work_root + '/sens/wrfda')
+	run(f'cp {sa_file} ad_d01_{start_time_str}')
+	sa = Dataset(sa_file, 'r')
+	sb = Dataset(sb_file, 'r')
+	ad = Dataset(f'ad_d01_{start_time_str}', 'r+')
+	add_init_sens(sa, sb, ad)
+	sa.close()
+	sb.close()
+	ad.close()
+	run(f'ln -sf ad_d01_{start_time_str} gr01')
+	if config['wrfvar3']['ob_format'] == 2:
+		if not os.path.isdir('obsproc'): os.makedirs('obsproc')
+		run(f'ln -sf {args.work_root}/fa/wrfda/obsproc/obs_gts_{start_time_str}.3DVAR obsproc')
+	run(f'ln -sf {args.work_root}/fa/lanczos_eigenpairs.* ..')
+
+	wrf.run_wrfda_3dvar(args.work_root + '/sens', args.wrfda_root, config, args, args.work_root + '/fa/wrf')
+
+stages = {}
+fg = f'{args.work_root}/fb/wrf/wrfout_d01_{start_time_str}'
+fb_wrfbdy = f'{args.work_root}/fb/wrf/wrfbdy_d01_{spinup_start_time_str}'
+xt_file = f'{args.work_root}/ref/wrf/wrfinput_d01_{end_time_str}'
+xf_files = [f'{args.work_root}/fa/wrf/wrfout_d01_{end_time_str}', f'{args.work_root}/fb/wrf/wrfout_d01_{end_time_str}']
+final_sens_files = [f'{args.work_root}/fa/wrfplus/final_sens_d01', f'{args.work_root}/fb/wrfplus/final_sens_d01']
+init_sens_files = [f'{args.work_root}/fa/wrfplus/init_sens_d01_{start_time_str}', f'{args.work_root}/fb/wrfplus/init_sens_d01_{start_time_str}']
+
+add_stage(stages, 'geogrid', run_geogrid, config, outputs=[f'{args.work_root}/wps/geo_em.d01.nc'])
+add_stage(stages, 'fb_wps', run_fb_wps, spinup_config, outputs=[f'{args.work_root}/wps/met_em.d01.{spinup_start_time_str}.nc'], depends=['geogrid'])
+add_stage(stages, 'fb_real', run_real, args.work_root + '/fb', args.work_root + '/wps', spinup_config,
+	outputs=[f'{args.work_root}/fb/wrf/wrfinput_d01_{spinup_start_time_str}', fb_wrfbdy], depends=['fb_wps'])
+add_stage(stages, 'fb_wrf', run_wrf, args.work_root + '/fb', spinup_config, outputs=[fg, xf_files[1]], depends=['fb_real'])
+add_stage(stages, 'fa_wrfda', run_fa_wrfda, fa_config, fg, fb_wrfbdy, inputs=[fg, fb_wrfbdy],
+	outputs=[f'{args.work_root}/fa/wrfda/wrfvar_output_{start_time_str}', f'{args.work_root}/fa/wrfda/wrfbdy_d01_{start_time_str}.lateral_updated'])
+add_stage(stages, 'fa_wrf', run_wrf, args.work_root + '/fa', fa_config, outputs=[xf_files[0]], depends=['fa_wrfda'])
+add_stage(stages, 'ref', run_ref, ref_config, outputs=[xt_file], depends=['geogrid'])
+add_stage(stages, 'final_sens', run_final_sens, xt_file, xf_files, final_sens_files, inputs=[xt_file] + xf_files, outputs=final_sens_files)
+# Both adjoint runs only differ by work directory, so they are submitted as one job array.
+add_stage(stages, 'wrfplus', run_wrfplus, [args.work_root + '/fa', args.work_root + '/fb'], fa_config, inputs=final_sens_files, outputs=init_sens_files)
+add_stage(stages, 'sens', run_sens, sens_config, *init_sens_files, inputs=init_sens_files)
+
+run_stages(stages, max_workers=args.max_parallel_stages, state_dir=args.work_root, force=args.force)
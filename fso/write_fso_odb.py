@@ -1,16 +1,18 @@
 #!/usr/bin/env python3
 
 import argparse
+import numpy as np
 import pendulum
 import os
-import re
 import tempfile
 import sys
+try:
+	import pandas as pd
+	import pyodc as odc
+except ImportError:
+	odc = None
 sys.path.append(f'{os.path.dirname(os.path.realpath(__file__))}/../utils')
-from utils import cli, parse_time, run
-
-real_missing_value = -888888.0
-int_missing_value = -88
+from utils import cli, parse_time, run, read_gts_omb_oma
 
 parser = argparse.ArgumentParser(description='Write FSO results to ODB file.', formatter_class=argparse.RawTextHelpFormatter)
 parser.add_argument('-w', '--work-root', dest='work_root', help='Work root directory')
@@ -21,226 +23,105 @@ args = parser.parse_args()
 if not args.output_prefix:
 	args.output_prefix = f'{args.work_root}/sens/wrfda/fso_result.odb'
 
-obs_type_impact = {
-	'synop'   : 0,
-	'metar'   : 0,
-	'ships'   : 0,
-	'buoy'    : 0,
-	'sondesfc': 0,
-	'sound'   : 0,
-	'profiler': 0,
-	'airep'   : 0,
-	'pilot'   : 0,
-	'qscat'   : 0
-}
-var_type_impact = {
-	'u': 0,
-	'v': 0,
-	't': 0,
-	'q': 0,
-	'p': 0
+obs_types = ('synop', 'metar', 'ships', 'buoy', 'sondesfc', 'sound', 'profiler', 'airep', 'pilot', 'qscat')
+var_types = ('u', 'v', 't', 'q', 'p')
+
+# Variables whose impacts are accumulated for each observation type.
+impact_vars = {
+	'synop'   : ('u', 'v', 't', 'q', 'p'),
+	'metar'   : ('u', 'v', 't', 'q', 'p'),
+	'ships'   : ('u', 'v', 't', 'q', 'p'),
+	'buoy'    : ('u', 'v', 't', 'q', 'p'),
+	'sondesfc': ('u', 'v', 't', 'q', 'p'),
+	'sound'   : ('u', 'v', 't', 'q'),
+	'airep'   : ('u', 'v', 't', 'q'),
+	'profiler': ('u', 'v'),
+	'pilot'   : ('u', 'v'),
+	'qscat'   : ('u', 'v')
 }
 
-gts_omb_oma_01 = open(f'{args.work_root}/sens/wrfda/gts_omb_oma_01', 'r')
-
-header = ''
-header += 'obs_type@detail_impact:STRING\t'
-header += 'sid@detail_impact:STRING\t'
-header += 'lon@detail_impact:REAL\t'
-header += 'lat@detail_impact:REAL\t'
-header += 'date@detail_impact:INTEGER\t'
-header += 'time@detail_impact:INTEGER\t'
-header += 'u@detail_impact:REAL\t'
-header += 'u_impact@detail_impact:REAL\t'
-header += 'u_qc@detail_impact:INTEGER\t'
-header += 'u_obserr@detail_impact:REAL\t'
-header += 'u_incr@detail_impact:REAL\t'
-header += 'v@detail_impact:REAL\t'
-header += 'v_impact@detail_impact:REAL\t'
-header += 'v_qc@detail_impact:INTEGER\t'
-header += 'v_obserr@detail_impact:REAL\t'
-header += 'v_incr@detail_impact:REAL\t'
-header += 't@detail_impact:REAL\t'
-header += 't_impact@detail_impact:REAL\t'
-header += 't_qc@detail_impact:INTEGER\t'
-header += 't_obserr@detail_impact:REAL\t'
-header += 't_incr@detail_impact:REAL\t'
-header += 'p@detail_impact:REAL\t'
-header += 'p_impact@detail_impact:REAL\t'
-header += 'p_qc@detail_impact:INTEGER\t'
-header += 'p_obserr@detail_impact:REAL\t'
-header += 'p_incr@detail_impact:REAL\t'
-header += 'q@detail_impact:REAL\t'
-header += 'q_impact@detail_impact:REAL\t'
-header += 'q_qc@detail_impact:INTEGER\t'
-header += 'q_obserr@detail_impact:REAL\t'
-header += 'q_incr@detail_impact:REAL\n'
-
-output = tempfile.NamedTemporaryFile(mode='w')
-output.write(header)
-
-def handle_real_missing_value(x):
-	if x.strip() == '' or float(x) == real_missing_value: x = 'NULL'
-	return x
-
-def handle_int_missing_value(x):
-	if x.strip() == '' or int(x) == int_missing_value: x = 'NULL'
-	return x
-
-while True:
-	line = gts_omb_oma_01.readline()
-	if re.match('^\s*\w+\s+\d+$', line):
-		obs_type, num_platform = [x.strip() for x in line.split()]
-		if obs_type == 'sonde_sfc': obs_type = 'sondesfc'
-		num_platform = int(num_platform)
-		print(obs_type, num_platform)
-		for i in range(num_platform):
-			pos = gts_omb_oma_01.tell()
-			line = gts_omb_oma_01.readline()
-			try:
-				n = int(line.strip())
-			except:
-				gts_omb_oma_01.seek(pos)
-				break
-			for j in range(n):
-				pos = gts_omb_oma_01.tell()
-				line = gts_omb_oma_01.readline()
-				if len(line) < 10:
-					gts_omb_oma_01.seek(pos)
-					break
-				k = 16
-				try:
-					sid      =                           line[k:k+6 ] ; k += 6
-					lat      = handle_real_missing_value(line[k:k+9 ]); k += 9
-					lon      = handle_real_missing_value(line[k:k+9 ]); k += 9
-					p        = handle_real_missing_value(line[k:k+17]); k += 17
-					u        = handle_real_missing_value(line[k:k+17]); k += 17
-					u_impact = handle_real_missing_value(line[k:k+17]); k += 17
-					u_qc     = handle_int_missing_value (line[k:k+8 ]); k += 8
-					u_obserr = handle_real_missing_value(line[k:k+17]); k += 17
-					u_incr   = handle_real_missing_value(line[k:k+17]); k += 17
-					v        = handle_real_missing_value(line[k:k+17]); k += 17
-					v_impact = handle_real_missing_value(line[k:k+17]); k += 17
-					v_qc     = handle_int_missing_value (line[k:k+8 ]); k += 8
-					v_obserr = handle_real_missing_value(line[k:k+17]); k += 17
-					v_incr   = handle_real_missing_value(line[k:k+17]); k += 17
-					t        = handle_real_missing_value(line[k:k+17]); k += 17
-					t_impact = handle_real_missing_value(line[k:k+17]); k += 17
-					t_qc     = handle_int_missing_value (line[k:k+8 ]); k += 8
-					t_obserr = handle_real_missing_value(line[k:k+17]); k += 17
-					t_incr   = handle_real_missing_value(line[k:k+17]); k += 17
-					if obs_type in ('synop', 'metar', 'ships', 'buoy', 'sondesfc'):
-						p        = handle_real_missing_value(line[k:k+17]); k += 17
-						p_impact = handle_real_missing_value(line[k:k+17]); k += 17
-						p_qc     = handle_int_missing_value (line[k:k+8 ]); k += 8
-						p_obserr = handle_real_missing_value(line[k:k+17]); k += 17
-						p_incr   = handle_real_missing_value(line[k:k+17]); k += 17
-					elif obs_type in ('sound', 'airep', 'profiler', 'pilot', 'qscat'):
-						p_impact = 'NULL'
-						p_qc     = 'NULL'
-						p_obserr = 'NULL'
-						p_incr   = 'NULL'
-					else:
-						cli.error(f'Unsupported obs_type {obs_type}!')
-					q        = handle_real_missing_value(line[k:k+17]); k += 17 
-					q_impact = handle_real_missing_value(line[k:k+17]); k += 17
-					q_qc     = handle_int_missing_value (line[k:k+8 ]); k += 8
-					q_obserr = handle_real_missing_value(line[k:k+17]); k += 17
-					q_incr   = handle_real_missing_value(line[k:k+17]); k += 17
-				except Exception as e:
-					print(line)
-					print(e)
-					cli.error('Failed to parse line!')
-
-				# Accumulate impacts of different observation and variable types.
-				if obs_type in ('synop', 'metar', 'ships', 'buoy', 'sondesfc'):
-					obs_type_impact[obs_type] = obs_type_impact[obs_type] + float(u_impact) + float(v_impact) + float(t_impact) + float(q_impact) + float(p_impact)
-					var_type_impact['u'] = var_type_impact['u'] + float(u_impact)
-					var_type_impact['v'] = var_type_impact['v'] + float(v_impact)
-					var_type_impact['t'] = var_type_impact['t'] + float(t_impact)
-					var_type_impact['q'] = var_type_impact['q'] + float(q_impact)
-					var_type_impact['p'] = var_type_impact['p'] + float(p_impact)
-				elif obs_type in ('sound', 'airep'):
-					obs_type_impact[obs_type] = obs_type_impact[obs_type] + float(u_impact) + float(v_impact) + float(t_impact) + float(q_impact)
-					var_type_impact['u'] = var_type_impact['u'] + float(u_impact)
-					var_type_impact['v'] = var_type_impact['v'] + float(v_impact)
-					var_type_impact['t'] = var_type_impact['t'] + float(t_impact)
-					var_type_impact['q'] = var_type_impact['q'] + float(q_impact)
-				elif obs_type in ('profiler', 'pilot', 'qscat'):
-					obs_type_impact[obs_type] = obs_type_impact[obs_type] + float(u_impact) + float(v_impact)
-					var_type_impact['u'] = var_type_impact['u'] + float(u_impact)
-					var_type_impact['v'] = var_type_impact['v'] + float(v_impact)
-
-				# Write output to tempfile.
-				output.write(obs_type + '\t')
-				output.write(sid      + '\t')
-				output.write(lon      + '\t')
-				output.write(lat      + '\t')
-				if args.datetime:
-					output.write(args.datetime.format('YYYYMMDD') + '\t')
-					output.write(args.datetime.format('HHmmss') + '\t')
-				else:
-					output.write('NULL\t')
-					output.write('NULL\t')
-				output.write(u        + '\t')
-				output.write(u_impact + '\t')
-				output.write(u_qc     + '\t')
-				output.write(u_obserr + '\t')
-				output.write(u_incr   + '\t')
-				output.write(v        + '\t')
-				output.write(v_impact + '\t')
-				output.write(v_qc     + '\t')
-				output.write(v_obserr + '\t')
-				output.write(v_incr   + '\t')
-				output.write(t        + '\t')
-				output.write(t_impact + '\t')
-				output.write(t_qc     + '\t')
-				output.write(t_obserr + '\t')
-				output.write(t_incr   + '\t')
-				output.write(p        + '\t')
-				output.write(p_impact + '\t')
-				output.write(p_qc     + '\t')
-				output.write(p_obserr + '\t')
-				output.write(p_incr   + '\t')
-				output.write(q        + '\t')
-				output.write(q_impact + '\t')
-				output.write(q_qc     + '\t')
-				output.write(q_obserr + '\t')
-				output.write(q_incr   + '\t')
+detail_columns = [('obs_type', 'STRING'), ('sid', 'STRING'), ('lon', 'REAL'), ('lat', 'REAL'), ('date', 'INTEGER'), ('time', 'INTEGER')]
+for var in ('u', 'v', 't', 'p', 'q'):
+	detail_columns += [(var, 'REAL'), (f'{var}_impact', 'REAL'), (f'{var}_qc', 'INTEGER'), (f'{var}_obserr', 'REAL'), (f'{var}_incr', 'REAL')]
+
+def open_odb(file_path, table, columns):
+	# Encode frames directly with pyodc if available, otherwise import TAB text by odb command.
+	if odc: return open(file_path, 'wb')
+	output = tempfile.NamedTemporaryFile(mode='w')
+	output.write('\t'.join(f'{name}@{table}:{type}' for name, type in columns) + '\n')
+	return output
+
+def write_odb(output, table, columns, data, size):
+	# Columns not in data are missing, and missing values are masked.
+	values = {}
+	for name, type in columns:
+		column = data.get(name)
+		if column is None: column = np.ma.masked_all(size)
+		if odc:
+			values[name] = column if type == 'STRING' else np.ma.filled(np.ma.asarray(column).astype(float), np.nan)
+		else:
+			values[name] = np.where(np.ma.getmaskarray(column), 'NULL', np.ma.getdata(column).astype(str))
+	if odc:
+		# pyodc has no codec for integer columns without any value, so encode them as missing reals.
+		types = { name: 'REAL' if type == 'INTEGER' and np.isnan(values[name]).all() else type for name, type in columns }
+		odc.encode_odb(pd.DataFrame({ f'{name}@{table}': values[name] for name, type in columns }), output,
+			types={ f'{name}@{table}': getattr(odc, types[name]) for name, type in columns })
 	else:
-		break
-
-output.flush()
-cli.notice(f'Write {args.output_prefix}.detail_impact.')
-run(f'odb import -d TAB {output.name} {args.output_prefix}.detail_impact', stdout=True)
+		np.savetxt(output, np.column_stack([values[name] for name, type in columns]), fmt='%s', delimiter='\t')
+
+def close_odb(output, file_path):
+	output.flush()
+	cli.notice(f'Write {file_path}.')
+	if not odc: run(f'odb import -d TAB {output.name} {file_path}', stdout=True)
+	output.close()
+
+output = open_odb(f'{args.output_prefix}.detail_impact', 'detail_impact', detail_columns)
+
+impact_obs_type = []
+impact_var_type = []
+impact = []
+for obs_type, data in read_gts_omb_oma(f'{args.work_root}/sens/wrfda/gts_omb_oma_01', ('impact', 'qc', 'obserr', 'incr')).items():
+	if obs_type == 'sonde_sfc': obs_type = 'sondesfc'
+	size = len(data['sid'])
+	print(obs_type, size)
+	if not obs_type in impact_vars: cli.error(f'Unsupported obs_type {obs_type}!')
+
+	# Collect impacts to be summed by observation and variable types.
+	for var in impact_vars[obs_type]:
+		impact_obs_type.append(np.full(size, obs_types.index(obs_type)))
+		impact_var_type.append(np.full(size, var_types.index(var)))
+		impact.append(np.ma.filled(data[f'{var}_impact'], 0))
+
+	data['obs_type'] = np.full(size, obs_type)
+	if args.datetime:
+		data['date'] = np.full(size, int(args.datetime.format('YYYYMMDD')))
+		data['time'] = np.full(size, int(args.datetime.format('HHmmss')))
+	write_odb(output, 'detail_impact', detail_columns, data, size)
+
+close_odb(output, f'{args.output_prefix}.detail_impact')
+
+if len(impact) > 0:
+	impact_obs_type = np.concatenate(impact_obs_type)
+	impact_var_type = np.concatenate(impact_var_type)
+	impact = np.concatenate(impact)
+else:
+	impact_obs_type = impact_var_type = np.array([], dtype=int)
+	impact = np.array([])
 
 # Impacts per observation types
-header = ''
-header += 'obs_type@fso_obs_impact:STRING\t'
-header += 'obs_impact@fso_obs_impact:REAL\n'
-
-output = tempfile.NamedTemporaryFile(mode='w')
-output.write(header)
-
-for obs_type, impact in obs_type_impact.items():
-	output.write(f'{obs_type}\t{impact}\n')
-
-output.flush()
-cli.notice(f'Write {args.output_prefix}.obs_impact.')
-run(f'odb import -d TAB {output.name} {args.output_prefix}.obs_impact', stdout=True)
+columns = [('obs_type', 'STRING'), ('obs_impact', 'REAL')]
+output = open_odb(f'{args.output_prefix}.obs_impact', 'fso_obs_impact', columns)
+write_odb(output, 'fso_obs_impact', columns, {
+	'obs_type': np.array(obs_types),
+	'obs_impact': np.bincount(impact_obs_type, weights=impact, minlength=len(obs_types))
+}, len(obs_types))
+close_odb(output, f'{args.output_prefix}.obs_impact')
 
 # Impacts per variable types.
-header = ''
-header += 'var_type@fso_var_impact:STRING\t'
-header += 'var_impact@fso_var_impact:REAL\n'
-
-output = tempfile.NamedTemporaryFile(mode='w')
-output.write(header)
-
-for var_type, impact in var_type_impact.items():
-	output.write(f'{var_type}\t{impact}\n')
-
-output.flush()
-cli.notice(f'Write {args.output_prefix}.var_impact.')
-run(f'odb import -d TAB {output.name} {args.output_prefix}.var_impact', stdout=True)
-
+columns = [('var_type', 'STRING'), ('var_impact', 'REAL')]
+output = open_odb(f'{args.output_prefix}.var_impact', 'fso_var_impact', columns)
+write_odb(output, 'fso_var_impact', columns, {
+	'var_type': np.array(var_types),
+	'var_impact': np.bincount(impact_var_type, weights=impact, minlength=len(var_types))
+}, len(var_types))
+close_odb(output, f'{args.output_prefix}.var_impact')
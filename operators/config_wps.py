@@ -12,8 +12,9 @@ from pprint import pprint
 import sys
 script_root = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(f'{script_root}/../utils')
-from utils import cli, parse_config, wrf_version, Version, run, has_key
+from utils import cli, parse_config, wrf_version, Version, run, has_key, timed
 
+@timed('operator')
 def config_wps(work_root, wps_root, geog_root, config, args):
 	if has_key(config, ('custom', 'start_time')):
 		start_time = config['custom']['start_time']
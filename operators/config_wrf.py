@@ -10,7 +10,7 @@ import re
 from shutil import copy
 import sys
 sys.path.append(f'{os.path.dirname(os.path.realpath(__file__))}/../utils')
-from utils import cli, parse_config, wrf_version, Version
+from utils import cli, parse_config, wrf_version, Version, timed
 
 def get_num_land_cat(wrfinput):
 	wrfinput = Dataset(wrfinput)
@@ -18,6 +18,7 @@ def get_num_land_cat(wrfinput):
 	wrfinput.close()
 	return num_land_cat
 
+@timed('operator')
 def config_wrf(work_root, wrf_root, wrfda_root, config, args, tag=None):
 	phys_config = config['physics'] if 'physics' in config else {}
 
@@ -11,8 +11,9 @@ from shutil import copyfile
 import sys
 script_root = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(f'{script_root}/../utils')
-from utils import cli, parse_config, wrf_version, Version, has_key, get_value
+from utils import cli, parse_config, wrf_version, Version, has_key, get_value, timed
 
+@timed('operator')
 def config_wrfda(work_root, wrfda_root, config, args, wrf_work_dir=None, tag=None, fg=None):
 	start_time = config['custom']['start_time']
 	end_time = config['custom']['end_time']
@@ -11,8 +11,9 @@ from shutil import copyfile
 import sys
 script_root = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(f'{script_root}/../utils')
-from utils import cli, parse_config, wrf_version, Version
+from utils import cli, parse_config, wrf_version, Version, timed
 
+@timed('operator')
 def config_wrfda_sens(work_root, wrfda_root, config, args, wrf_work_dir=None):
 	if not 'wrfda' in config:
 		cli.error('There is no "wrfda" in configuration file!')
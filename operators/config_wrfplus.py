@@ -8,8 +8,9 @@ import re
 from shutil import copy
 import sys
 sys.path.append(f'{os.path.dirname(os.path.realpath(__file__))}/../utils')
-from utils import cli, parse_config, wrf_version, Version
+from utils import cli, parse_config, wrf_version, Version, timed
 
+@timed('operator')
 def config_wrfplus(work_root, wrfplus_root, config, args):
 	start_time = config['custom']['start_time']
 	end_time = config['custom']['end_time']
@@ -7,8 +7,9 @@ import os
 import sys
 script_root = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(f'{script_root}/../utils')
-from utils import cli, parse_config, edit_file, check_files, run
+from utils import cli, parse_config, edit_file, check_files, run, timed
 
+@timed('operator')
 def run_met(work_root, met_root, config, args):
 	start_time = config['custom']['start_time']
 	end_time = config['custom']['end_time']
@@ -10,8 +10,9 @@ import re
 from shutil import copyfile
 import sys
 sys.path.append(f'{os.path.dirname(os.path.realpath(__file__))}/../utils')
-from utils import cli, check_files, search_files, run, submit_job, parse_config
+from utils import cli, check_files, search_files, run, submit_job, parse_config, timed
 
+@timed('operator')
 def run_real(work_root, wps_work_dir, wrf_root, config, args, tag=None):
 	start_time = config['custom']['start_time']
 	datetime_fmt = 'YYYY-MM-DD_HH:mm:ss'
@@ -28,9 +29,9 @@ def run_real(work_root, wps_work_dir, wrf_root, config, args, tag=None):
 
 	cli.stage(f'Run real.exe at {wrf_work_dir} ...')
 	expected_files = ['wrfinput_d{:02d}_{}'.format(i + 1, start_time_str) for i in range(max_dom)]
-	expected_files.append('wrfbdy_d01')
+	expected_files.append(f'wrfbdy_d01_{start_time_str}')
 	if not check_files(expected_files) or args.force:
-		run('rm -f wrfinput_* met_em.*.nc')
+		run('rm -f wrfinput_* wrfbdy_* met_em.*.nc')
 		run(f'ln -sf {wps_work_dir}/met_em.*.nc .')
 		try:
 			dataset = Dataset(glob('met_em.*.nc')[0])
@@ -49,6 +50,17 @@ def run_real(work_root, wps_work_dir, wrf_root, config, args, tag=None):
 			namelist_input['domains']['num_metgrid_soil_levels'] = 0
 		dataset.close()
 		namelist_input.write('./namelist.input', force=True)
+		# Keep real.exe output under time-stamped name, since run_wrf will relink wrfinput_d* to analysis.
+		post_cmds = []
+		for i in range(max_dom):
+			post_cmds.append('mv wrfinput_d{0:02d} wrfinput_d{0:02d}_{1}'.format(i + 1, start_time_str))
+			post_cmds.append('ln -sf wrfinput_d{0:02d}_{1} wrfinput_d{0:02d}'.format(i + 1, start_time_str))
+		post_cmds.append(f'mv wrfbdy_d01 wrfbdy_d01_{start_time_str}')
+		post_cmds.append(f'ln -sf wrfbdy_d01_{start_time_str} wrfbdy_d01')
+		if getattr(args, 'chain', False):
+			expected_files = ['wrfinput_d{:02d}'.format(i + 1) for i in range(max_dom)] + ['wrfbdy_d01']
+			submit_job(f'{wrf_root}/run/real.exe', args.np, config, args, expected_files=expected_files, post_cmds=post_cmds)
+			return
 		submit_job(f'{wrf_root}/run/real.exe', args.np, config, args, wait=True)
 		for i in range(max_dom):
 			if not os.path.isfile('wrfinput_d{0:02d}'.format(i + 1)):
@@ -57,9 +69,7 @@ def run_real(work_root, wps_work_dir, wrf_root, config, args, tag=None):
 				submit_job(f'{wrf_root}/run/real.exe', 1, config, args, wait=True)
 				if not os.path.isfile('wrfinput_d{0:02d}'.format(i + 1)):
 					cli.error(f'Still failed to generate wrfinput_d{0:02d}! See {wrf_work_dir}/rsl.error.0000.'.format(i + 1))
-			run('ln -sf wrfinput_d{0:02d} wrfinput_d{0:02d}_{1}'.format(i + 1, start_time_str))
-		if os.path.isfile('wrfbdy_d01'):
-			run(f'ln -sf wrfbdy_d01 wrfbdy_d01_{start_time_str}')
+		for cmd in post_cmds: run(cmd)
 		cli.notice('Succeeded.')
 	else:
 		run('ls -l wrfinput_* wrfbdy_*')
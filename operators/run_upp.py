@@ -5,8 +5,9 @@ import os
 import sys
 script_root = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(f'{script_root}/../utils')
-from utils import cli, parse_config, edit_file, run
+from utils import cli, parse_config, edit_file, run, timed
 
+@timed('operator')
 def run_upp(work_root, upp_root, config, args):
 	start_time = config['custom']['start_time']
 	end_time = config['custom']['end_time']
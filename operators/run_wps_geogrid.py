@@ -10,8 +10,9 @@ from shutil import copy
 import sys
 script_root = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(f'{script_root}/../utils')
-from utils import cli, check_files, edit_file, run, parse_config, submit_job
+from utils import cli, check_files, edit_file, run, parse_config, submit_job, timed
 
+@timed('operator')
 def run_wps_geogrid(work_root, wps_root, config, args):
 	wps_work_dir = os.path.abspath(work_root) + '/wps'
 	if not os.path.isdir(wps_work_dir): os.mkdir(wps_work_dir)
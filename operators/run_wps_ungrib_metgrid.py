@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 
 import argparse
+from copy import deepcopy
+import f90nml
 from glob import glob
 import os
 import pendulum
@@ -9,13 +11,27 @@ import re
 from shutil import copy
 import sys
 sys.path.append(f'{os.path.dirname(os.path.realpath(__file__))}/../utils')
-from utils import cli, check_files, wrf_version, Version, run, submit_job, parse_config, has_key, get_value
+from utils import cli, check_files, wrf_version, Version, run, submit_job, parse_config, has_key, get_value, add_stage, run_stages, file_checksum, file_identity, cache_key, cache_get, cache_put, cache_prune, timed, has_catalog, open_catalog, find_bkg_file, find_bkg_resolution
 
+def run_ungrib_slice(slice_dir, wps_root, grib_files, config, args):
+	os.chdir(slice_dir)
+	run('rm -f GRIBFILE.* FILE:* PFILE:*')
+	run(f'ln -sf ../Vtable Vtable')
+	run(f'{wps_root}/link_grib.csh ' + ' '.join(grib_files))
+	submit_job(f'{wps_root}/ungrib/src/ungrib.exe', 1, config, args, logfile='ungrib.log', wait=True)
+
+@timed('operator')
 def run_wps_ungrib_metgrid(work_root, wps_root, bkg_root, config, args):
 	start_time = config['custom']['start_time']
 
 	bkg_type = get_value(config['custom'], ['background', 'type'], default='gfs')
 	if not has_key(config['custom'], 'background'): config['custom']['background'] = {}
+	# Files in default GFS layout can be looked up in catalogue registered by get_gfs.py instead of globbing.
+	catalog = None
+	if bkg_type == 'gfs' and not has_key(config['custom'], ['background', 'file_pattern']) and \
+	   not has_key(config['custom'], ['background', 'dir_pattern']) and has_catalog(bkg_root):
+		catalog = open_catalog(bkg_root)
+	bkg_resolution = None
 	if bkg_type == 'gfs' and not has_key(config['custom'], ['background', 'file_pattern']):
 		config['custom']['background']['file_pattern'] = 'gfs.t{{ bkg_start_time.format("HH") }}z.pgrb2.*.f{{ "%03d" % bkg_forecast_hour }}'
 
@@ -48,6 +64,14 @@ def run_wps_ungrib_metgrid(work_root, wps_root, bkg_root, config, args):
 
 	# Find out suitable background data that cover forecast time period.
 	def is_bkg_exist(bkg_start_time):
+		nonlocal bkg_resolution
+		if catalog:
+			# Resolve resolution once, so that all forecast hours use the same one.
+			resolution = get_value(config['custom'], ['background', 'resolution'])
+			if resolution is None: resolution = find_bkg_resolution(catalog, 'gfs', bkg_start_time)
+			if resolution is not None and find_bkg_file(catalog, 'gfs', bkg_start_time, 0, resolution):
+				bkg_resolution = resolution
+				return True
 		bkg_dir = eval_bkg_dir(bkg_start_time, bkg_start_time)
 		if has_key(config['custom'], ['background', 'file_pattern']):
 			if type(config['custom']['background']['file_pattern']) == list:
@@ -79,39 +103,99 @@ def run_wps_ungrib_metgrid(work_root, wps_root, bkg_root, config, args):
 		bkg_time = bkg_time.add(seconds=interval_seconds)
 	if len(bkg_times) == 0: cli.error('Failed to set background times, check start_time and forecast_hours.')
 
-	expected_files = [f'FILE:{time.format("YYYY-MM-DD_HH")}' for time in bkg_times]
-	if not check_files(expected_files) or args.force:
-		run('rm -f GRIBFILE.* FILE:*')
+	def find_bkg_files(bkg_time):
+		if not has_key(config['custom'], ['background', 'file_pattern']): return None
+		if catalog and bkg_resolution is not None:
+			bkg_file = find_bkg_file(catalog, 'gfs', bkg_start_time, (bkg_time-bkg_start_time).in_hours(), bkg_resolution)
+			if bkg_file: return [bkg_file]
+		bkg_dir = eval_bkg_dir(bkg_start_time, bkg_time)
+		if type(config['custom']['background']['file_pattern']) == list:
+			file_patterns = config['custom']['background']['file_pattern']
+		else:
+			file_patterns = [config['custom']['background']['file_pattern']]
+		bkg_files = []
+		for file_pattern in file_patterns:
+			rendered_file_pattern = Template(file_pattern).render(bkg_start_time=bkg_start_time, bkg_time=bkg_time, bkg_forecast_hour=(bkg_time-bkg_start_time).in_hours())
+			files = glob(bkg_dir + '/' + rendered_file_pattern)
+			if len(files) == 0: cli.error(f'Failed to find background file {bkg_dir}/{rendered_file_pattern}!')
+			bkg_files.append(files[0])
+		return bkg_files
+
+	max_dom = config['domains']['max_dom']
+	datetime_fmt = 'YYYY-MM-DD_HH:mm:ss'
+	namelist_wps = f90nml.read('./namelist.wps')
+	copy(f'{wps_root}/metgrid/METGRID.TBL.ARW', 'METGRID.TBL')
+	ungrib_files = { time: [f'FILE:{time.format("YYYY-MM-DD_HH")}'] for time in bkg_times }
+	# Only the first time is needed for nested domains.
+	metgrid_files = { time: [f'met_em.d{i+1:02d}.{time.format(datetime_fmt)}.nc' for i in range(max_dom if time == start_time else 1)] for time in bkg_times }
+
+	# Cache ungrib and metgrid outputs by their inputs, so that overlapping cycles can share them.
+	cache_root = get_value(config['custom'], 'wps_cache_root')
+	ungrib_keys = {}
+	metgrid_keys = {}
+	if cache_root:
+		vtable_checksum = file_checksum('Vtable')
+		metgrid_tbl_checksum = file_checksum('METGRID.TBL')
+		share = { key: value for key, value in namelist_wps['share'].items() if not key in ('start_date', 'end_date', 'max_dom') }
+		for time in bkg_times:
+			bkg_files = find_bkg_files(time)
+			if not bkg_files:
+				cache_root = None
+				break
+			ungrib_keys[time] = cache_key('ungrib', [file_identity(file) for file in bkg_files],
+				get_value(config['custom'], ['background', 'file_processes']), vtable_checksum, namelist_wps['ungrib'])
+			metgrid_keys[time] = cache_key('metgrid', ungrib_keys[time], metgrid_tbl_checksum, share,
+				namelist_wps['geogrid'], namelist_wps['metgrid'],
+				[file_identity(f'geo_em.d{i+1:02d}.nc') for i in range(max_dom if time == start_time else 1)])
+
+	def is_done(time, files, keys):
+		if args.force: return False
+		return check_files(files[time]) or (cache_root and cache_get(cache_root, keys[time], files[time], wps_work_dir))
+
+	def write_namelist(times, file_path='./namelist.wps'):
+		# Let ungrib.exe and metgrid.exe only process given times.
+		namelist = deepcopy(namelist_wps)
+		dom_count = max_dom if times[0] == start_time else 1
+		namelist['share']['max_dom'] = dom_count
+		namelist['share']['start_date'] = [times[0].format(datetime_fmt) for i in range(dom_count)]
+		namelist['share']['end_date'] = [times[-1].format(datetime_fmt) if i == 0 else times[0].format(datetime_fmt) for i in range(dom_count)]
+		namelist.write(file_path, force=True)
+
+	metgrid_times = [time for time in bkg_times if not is_done(time, metgrid_files, metgrid_keys)]
+	if len(metgrid_times) < len(bkg_times):
+		cli.notice(f'Reuse met_em files of {len(bkg_times) - len(metgrid_times)} times.')
+	if len(metgrid_times) > 0:
+		metgrid_times = [time for time in bkg_times if metgrid_times[0] <= time <= metgrid_times[-1]]
+
+	cli.stage(f'Run ungrib.exe at {wps_work_dir} ...')
+	ungrib_times = [time for time in metgrid_times if not is_done(time, ungrib_files, ungrib_keys)]
+	if len(ungrib_times) > 0:
+		ungrib_times = [time for time in bkg_times if ungrib_times[0] <= time <= ungrib_times[-1]]
+		expected_files = sum([ungrib_files[time] for time in ungrib_times], [])
+		run('rm -f GRIBFILE.* ' + ' '.join(expected_files))
+		grib_files = {}
 		if 'background' in config['custom']:
 			if not os.path.isdir(f'{wps_work_dir}/background'): os.mkdir(f'{wps_work_dir}/background')
 			os.chdir(f'{wps_work_dir}/background')
-			for bkg_time in bkg_times:
-				try:
-					bkg_dir = eval_bkg_dir(bkg_start_time, bkg_time)
-					if type(config['custom']['background']['file_pattern']) == list:
-						file_patterns = config['custom']['background']['file_pattern']
-					else:
-						file_patterns = [config['custom']['background']['file_pattern']]
-					for file_pattern in file_patterns:
-						rendered_file_pattern = Template(file_pattern).render(bkg_start_time=bkg_start_time, bkg_time=bkg_time, bkg_forecast_hour=(bkg_time-bkg_start_time).in_hours())
-						bkg_file = glob(bkg_dir + '/' + rendered_file_pattern)[0]
-						bkg_file_basename = os.path.basename(bkg_file)
-						# Process background file when there is file_processes in config.
-						if 'file_processes' in config['custom']['background']:
-							for file_process in config['custom']['background']['file_processes']:
-								run(Template(file_process).render(
-									bkg_file=bkg_file,
-									bkg_file_basename=bkg_file_basename,
-									bkg_start_time=bkg_start_time,
-									bkg_time=bkg_time
-								))
-						run(f'ln -sf {bkg_file} {bkg_time.format("YYYYMMDDHH")}_{bkg_file_basename}')
-				except Exception as e:
-					print(e)
-					print(bkg_dir + '/' + rendered_file_pattern)
-					cli.error(f'Failed to link background file!')
+			run('rm -f *')
+			for bkg_time in ungrib_times:
+				bkg_files = find_bkg_files(bkg_time)
+				if not bkg_files: cli.error(f'Failed to link background file!')
+				for bkg_file in bkg_files:
+					bkg_file_basename = os.path.basename(bkg_file)
+					# Process background file when there is file_processes in config.
+					if 'file_processes' in config['custom']['background']:
+						for file_process in config['custom']['background']['file_processes']:
+							run(Template(file_process).render(
+								bkg_file=bkg_file,
+								bkg_file_basename=bkg_file_basename,
+								bkg_start_time=bkg_start_time,
+								bkg_time=bkg_time
+							))
+					grib_file = f'{wps_work_dir}/background/{bkg_time.format("YYYYMMDDHH")}_{bkg_file_basename}'
+					run(f'ln -sf {bkg_file} {grib_file}')
+					grib_files.setdefault(bkg_time, []).append(grib_file)
 			os.chdir(wps_work_dir)
-			run(f'{wps_root}/link_grib.csh {wps_work_dir}/background/*')
 		else:
 			bkg_dir = eval_bkg_dir(bkg_start_time, bkg_start_time)
 			if len(glob(f'{bkg_dir}/*.0p25.*')) > 0:
@@ -122,30 +206,58 @@ def run_wps_ungrib_metgrid(work_root, wps_root, bkg_root, config, args):
 				res = '1p00'
 			else:
 				cli.error(f'There is no GFS data in {bkg_dir}!')
-			run(f'{wps_root}/link_grib.csh {bkg_dir}/*.{res}.*')
-		# When the surface and vertical levels are separated, we can only use 1 process to run ungrib.exe.
-		submit_job(f'{wps_root}/ungrib/src/ungrib.exe', 1, config, args, logfile='ungrib.log', wait=True)
+			# ungrib.exe will pick out the times it needs.
+			for bkg_time in ungrib_times: grib_files[bkg_time] = [f'{bkg_dir}/*.{res}.*']
+		# When the surface and vertical levels are separated, we can only use 1 process to run ungrib.exe,
+		# but different times can be decoded by separate ungrib.exe in their own directories.
+		num_slice = min(get_value(config['custom'], 'ungrib_slices', 1), len(ungrib_times))
+		if num_slice > 1:
+			stages = {}
+			for i in range(num_slice):
+				slice_times = ungrib_times[i*len(ungrib_times)//num_slice:(i+1)*len(ungrib_times)//num_slice]
+				slice_dir = f'{wps_work_dir}/ungrib_slice_{i:02d}'
+				if not os.path.isdir(slice_dir): os.mkdir(slice_dir)
+				write_namelist(slice_times, f'{slice_dir}/namelist.wps')
+				slice_grib_files = sorted(set(sum([grib_files[time] for time in slice_times], [])))
+				add_stage(stages, f'ungrib_slice_{i:02d}', run_ungrib_slice, slice_dir, wps_root, slice_grib_files, config, args,
+					outputs=[f'{slice_dir}/{file_name}' for time in slice_times for file_name in ungrib_files[time]])
+			run_stages(stages, max_workers=num_slice)
+			for stage in stages.values():
+				for file_path in stage['outputs']: os.rename(file_path, f'{wps_work_dir}/{os.path.basename(file_path)}')
+		else:
+			run(f'{wps_root}/link_grib.csh ' + ' '.join(sorted(set(sum([grib_files[time] for time in ungrib_times], [])))))
+			write_namelist(ungrib_times)
+			submit_job(f'{wps_root}/ungrib/src/ungrib.exe', 1, config, args, logfile='ungrib.log', wait=True)
+			namelist_wps.write('./namelist.wps', force=True)
 		if not check_files(expected_files):
-			cli.error(f'Failed! Check output {wps_work_dir}/ungrib.out.')
+			cli.error(f'Failed! Check output {wps_work_dir}/ungrib.log.')
+		if cache_root:
+			for time in ungrib_times: cache_put(cache_root, ungrib_keys[time], ungrib_files[time], wps_work_dir)
 		cli.notice('Succeeded.')
 	else:
 		cli.notice('File FILE:* already exist.')
 	run('ls -l FILE:*')
 
 	cli.stage(f'Run metgrid.exe at {wps_work_dir} ...')
-	copy(f'{wps_root}/metgrid/METGRID.TBL.ARW', 'METGRID.TBL')
-	expected_files = ['met_em.d01.{}.nc'.format(time.format('YYYY-MM-DD_HH:mm:ss')) for time in bkg_times]
-	if not check_files(expected_files) or args.force:
-		# Remove possible existing met_em files.
-		run('rm -f met_em.*')
+	if len(metgrid_times) > 0:
+		expected_files = sum([metgrid_files[time] for time in metgrid_times], [])
+		# Remove possible existing met_em files, which may be linked to cache.
+		run('rm -f ' + ' '.join(expected_files))
+		write_namelist(metgrid_times)
 		submit_job(f'{wps_root}/metgrid/src/metgrid.exe', min(20, args.np), config, args, logfile='metgrid.log.0000', wait=True)
+		namelist_wps.write('./namelist.wps', force=True)
 		if not check_files(expected_files):
 			cli.error(f'Failed! Check output {wps_work_dir}/metgrid.log.0000.')
+		if cache_root:
+			for time in metgrid_times: cache_put(cache_root, metgrid_keys[time], metgrid_files[time], wps_work_dir)
 		cli.notice('Succeeded.')
 	else:
 		cli.notice('File met_em.* already exist.')
 	run('ls -l met_em.*')
 
+	if cache_root: cache_prune(cache_root, get_value(config['custom'], 'wps_cache_keep_days', 3))
+
+@timed('operator')
 def run_wps_metgrid(work_root, wps_root, bkg_root, config, args):
 	start_time = config['custom']['start_time']
 
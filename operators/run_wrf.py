@@ -11,14 +11,15 @@ from shutil import copyfile
 from netCDF4 import Dataset
 import sys
 sys.path.append(f'{os.path.dirname(os.path.realpath(__file__))}/../utils')
-from utils import cli, check_files, run, submit_job, parse_config
+from utils import cli, check_files, run, submit_job, parse_config, timed
 
-def copy_wrfda_output(dom_str, start_time_str, wrfda_work_dir):
+def copy_wrfda_output(dom_str, start_time_str, wrfda_work_dir, chain=False):
 	if os.path.isdir(wrfda_work_dir + '/' + dom_str):
 		work_dir = wrfda_work_dir + '/' + dom_str
 	else:
 		work_dir = wrfda_work_dir
-	if os.path.isfile(f'{work_dir}/wrfvar_output_{start_time_str}'):
+	# In chain mode, analysis will be generated by the jobs we depend on.
+	if os.path.isfile(f'{work_dir}/wrfvar_output_{start_time_str}') or (chain and os.path.isfile(f'{work_dir}/namelist.input')):
 		cli.notice(f'Use assimilated input for domain {dom_str}.')
 	else:
 		return False
@@ -27,6 +28,7 @@ def copy_wrfda_output(dom_str, start_time_str, wrfda_work_dir):
 		run(f'ln -sf {work_dir}/wrfbdy_d01_{start_time_str}.lateral_updated wrfbdy_d01')
 	return True
 
+@timed('operator')
 def run_wrf(work_root, wrf_root, config, args, wrfda_work_dir=None, tag=None):
 	start_time = config['custom']['start_time']
 	end_time = config['custom']['end_time']
@@ -50,17 +52,18 @@ def run_wrf(work_root, wrf_root, config, args, wrfda_work_dir=None, tag=None):
 	if not os.path.isdir(wrf_work_dir): cli.error(f'run_wrf: {wrf_work_dir} does not exist!')
 	os.chdir(wrf_work_dir)
 
+	chain = getattr(args, 'chain', False)
 	all_wrfda_ok = True
 	for dom_idx in range(max_dom):
 		dom_str = 'd' + str(dom_idx + 1).zfill(2)
-		if not copy_wrfda_output(dom_str, start_time_str, wrfda_work_dir):
+		if not copy_wrfda_output(dom_str, start_time_str, wrfda_work_dir, chain):
 			all_wrfda_ok = False
 			break
 	if not all_wrfda_ok:
 		cli.warning('Do not use data assimilation.')
 		expected_files = ['wrfinput_d{:02d}_{}'.format(i + 1, start_time_str) for i in range(max_dom)]
 		expected_files.append(f'wrfbdy_d01_{start_time_str}')
-		if not check_files(expected_files):
+		if not chain and not check_files(expected_files):
 			cli.error('real.exe wasn\'t executed successfully!')
 		for i in range(max_dom):
 			run('ln -sf wrfinput_d{0:02d}_{1} wrfinput_d{0:02d}'.format(i + 1, start_time_str))
@@ -80,6 +83,9 @@ def run_wrf(work_root, wrf_root, config, args, wrfda_work_dir=None, tag=None):
 		run(f'ln -sf {wrf_root}/run/VEGPARM.TBL .')
 		run(f'ln -sf {wrf_root}/run/SOILPARM.TBL .')
 		run(f'ln -sf {wrf_root}/run/GENPARM.TBL .')
+		if chain:
+			submit_job(f'{wrf_root}/run/wrf.exe', args.np, config, args, expected_files=expected_files)
+			return
 		retries = 0
 		while True:
 			submit_job(f'{wrf_root}/run/wrf.exe', args.np, config, args, wait=True)
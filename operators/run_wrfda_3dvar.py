@@ -9,10 +9,11 @@ import re
 import sys
 import config_wrfda
 sys.path.append(f'{os.path.dirname(os.path.realpath(__file__))}/../utils')
-from utils import cli, check_files, search_files, run, submit_job, parse_config
+from utils import cli, check_files, search_files, run, submit_job, parse_config, timed, write_incr_stats, incr_stats_file_name
 
 scripts_root = os.path.dirname(os.path.realpath(__file__))
 
+@timed('operator')
 def run_wrfda_3dvar(work_root, wrfda_root, config, args, wrf_work_dir=None, force=False, tag=None, fg=None):
 	start_time = config['custom']['start_time']
 	datetime_fmt = 'YYYY-MM-DD_HH:mm:ss'
@@ -128,6 +129,17 @@ def run_wrfda_3dvar(work_root, wrfda_root, config, args, wrf_work_dir=None, forc
 		cli.notice(f'{wrfda_work_dir}/wrfvar_output_{start_time_str} already exists.')
 		return
 
+	# Remove link made by update_bc of previous runs, otherwise da_wrfvar.exe writes through it.
+	run('rm -f wrfvar_output')
+
+	if getattr(args, 'chain', False):
+		submit_job(f'{wrfda_root}/var/build/da_wrfvar.exe', min(20, args.np), config, args,
+			expected_files=['wrfvar_output', 'statistics'], post_cmds=[
+				f'[[ -L wrfvar_output ]] || cp wrfvar_output wrfvar_output_{start_time_str}',
+				f'{scripts_root}/../bin/wrfda_incr_stats.py -w {wrfda_work_dir} || echo "Failed to compute increment statistics!"'
+			])
+		return
+
 	submit_job(f'{wrfda_root}/var/build/da_wrfvar.exe', min(20, args.np), config, args, wait=True)
 
 	expected_files = [f'wrfvar_output', 'statistics']
@@ -143,6 +155,10 @@ def run_wrfda_3dvar(work_root, wrfda_root, config, args, wrf_work_dir=None, forc
 	else:
 		print(open('statistics').read())
 		run(f'ncl -Q {scripts_root}/../plots/plot_cost_grad_fn.ncl')
+		try:
+			write_incr_stats(f'{wrfda_work_dir}/fg', f'{wrfda_work_dir}/wrfvar_output', f'{wrfda_work_dir}/{incr_stats_file_name}', domain=dom_str)
+		except Exception as e:
+			cli.warning(f'Failed to compute increment statistics: {e}')
 		run(f'cp wrfvar_output wrfvar_output_{start_time_str}')
 		cli.notice('Succeeded.')
 
@@ -11,8 +11,9 @@ import f90nml
 import sys
 script_root = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(f'{script_root}/../utils')
-from utils import cli, check_files, run, parse_config, submit_job, has_key, get_value
+from utils import cli, check_files, run, parse_config, submit_job, has_key, get_value, timed
 
+@timed('operator')
 def run_wrfda_obsproc(work_root, wrfda_root, littler_root, config, args, wrf_work_dir=None, tag=None):
 	start_time = config['custom']['start_time']
 	datetime_fmt = 'YYYY-MM-DD_HH:mm:ss'
@@ -28,7 +29,7 @@ def run_wrfda_obsproc(work_root, wrfda_root, littler_root, config, args, wrf_wor
 		wrfda_work_dir = f'{work_root}/wrfda_{tag}/obsproc'
 	else:
 		wrfda_work_dir = f'{work_root}/wrfda/obsproc'
-	if not os.path.isdir(wrfda_work_dir): os.mkdir(wrfda_work_dir)
+	if not os.path.isdir(wrfda_work_dir): os.makedirs(wrfda_work_dir)
 	os.chdir(wrfda_work_dir)
 
 	cli.notice('Use builtin obserr.')
@@ -6,8 +6,9 @@ import os
 import f90nml
 import sys
 sys.path.append(f'{os.path.dirname(os.path.realpath(__file__))}/../utils')
-from utils import cli, check_files, run, parse_config, submit_job
+from utils import cli, check_files, run, parse_config, submit_job, timed
 
+@timed('operator')
 def run_wrfda_update_bc(work_root, wrfda_root, update_lowbc, config, args, wrf_work_dir=None, wrfbdy=None, tag=None):
 	start_time = config['custom']['start_time']
 	datetime_fmt = 'YYYY-MM-DD_HH:mm:ss'
@@ -39,12 +40,14 @@ def run_wrfda_update_bc(work_root, wrfda_root, update_lowbc, config, args, wrf_w
 
 	cli.stage(f'Run WRFDA update_bc at {wrfda_work_dir} ...')
 
+	chain = getattr(args, 'chain', False)
 	expected_files = [wrfbdy, f'wrfvar_output_{start_time_str}', 'fg']
-	if not check_files(expected_files):
+	# In chain mode, these files are generated by the jobs we depend on.
+	if not chain and not check_files(expected_files):
 		print(expected_files)
 		cli.error('run_wrfda_update_bc: da_wrfvar.exe or real.exe wasn\'t executed successfully!')
-	run(f'ln -sf {wrfbdy} wrfbdy_{dom_str}')
-	run(f'ln -sf wrfvar_output_{start_time_str} wrfvar_output')
+	# In chain mode, the analysis does not exist until the DA job runs, so link it in the job.
+	if not chain: run(f'ln -sf wrfvar_output_{start_time_str} wrfvar_output')
 
 	parame_in = f90nml.read(f'{wrfda_root}/var/test/update_bc/parame.in')
 	parame_in['control_param']['wrf_input'] = './fg'
@@ -57,7 +60,14 @@ def run_wrfda_update_bc(work_root, wrfda_root, update_lowbc, config, args, wrf_w
 		expected_file = f'wrfbdy_{dom_str}_{start_time_str}.low_updated'
 	else:
 		expected_file = f'wrfbdy_{dom_str}_{start_time_str}.lateral_updated'
+	if chain:
+		submit_job(f'{wrfda_root}/var/build/da_update_bc.exe', 1, config, args,
+			pre_cmds=[f'ln -sf wrfvar_output_{start_time_str} wrfvar_output', f'cp --remove-destination {wrfbdy} wrfbdy_{dom_str}'],
+			expected_files=[f'wrfbdy_{dom_str}'], post_cmds=[f'cp wrfbdy_{dom_str} {expected_file}'])
+		return
 	if not check_files(expected_file) or args.force:
+		# Copy boundary file, since da_update_bc.exe modifies it in place.
+		run(f'cp --remove-destination {wrfbdy} wrfbdy_{dom_str}')
 		submit_job(f'{wrfda_root}/var/build/da_update_bc.exe', 1, config, args, wait=True)
 		run(f'cp wrfbdy_{dom_str} {expected_file}')
 	else:
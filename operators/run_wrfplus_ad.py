@@ -11,11 +11,10 @@ from shutil import copyfile
 from netCDF4 import Dataset
 import sys
 sys.path.append(f'{os.path.dirname(os.path.realpath(__file__))}/../utils')
-from utils import cli, check_files, run, submit_job, parse_config, wrf_version, Version
+from utils import cli, check_files, run, submit_job, parse_config, wrf_version, Version, timed
 
-def run_wrfplus_ad(work_root, wrfplus_root, config, args):
+def prepare_wrfplus_ad(work_root, wrfplus_root, config, args):
 	start_time = config['custom']['start_time']
-	end_time = config['custom']['end_time']
 	datetime_fmt = 'YYYY-MM-DD_HH:mm:ss'
 	start_time_str = start_time.format(datetime_fmt)
 	max_dom = config['domains']['max_dom']
@@ -42,35 +41,64 @@ def run_wrfplus_ad(work_root, wrfplus_root, config, args):
 	cli.stage(f'Run WRFPLUS at {wrfplus_work_dir} ...')
 	expected_files = ['wrfout_d{:02d}_{}'.format(i + 1, start_time_str) for i in range(max_dom)]
 	expected_files.append(f'init_sens_d01_{start_time_str}')
-	if not check_files(expected_files) or args.force:
-		run('rm -f wrfout_*')
-		run(f'ln -sf {wrfplus_root}/run/LANDUSE.TBL .')
-		run(f'ln -sf {wrfplus_root}/run/VEGPARM.TBL .')
-		run(f'ln -sf {wrfplus_root}/run/SOILPARM.TBL .')
-		run(f'ln -sf {wrfplus_root}/run/GENPARM.TBL .')
-		run(f'ln -sf {wrfplus_root}/run/RRTM_DATA_DBL RRTM_DATA')
-		run(f'ln -sf {wrfplus_root}/run/ETAMPNEW_DATA_DBL ETAMPNEW_DATA')
-		if version >= Version('4.0'):
-			cmd = f'{wrfplus_root}/run/wrfplus.exe'
-		else:
-			cmd = f'{wrfplus_root}/run/wrf.exe'
-		retries = 0
+	if check_files(expected_files) and not args.force:
+		cli.notice('File wrfout_* already exist.')
+		return None
+	run('rm -f wrfout_*')
+	run(f'ln -sf {wrfplus_root}/run/LANDUSE.TBL .')
+	run(f'ln -sf {wrfplus_root}/run/VEGPARM.TBL .')
+	run(f'ln -sf {wrfplus_root}/run/SOILPARM.TBL .')
+	run(f'ln -sf {wrfplus_root}/run/GENPARM.TBL .')
+	run(f'ln -sf {wrfplus_root}/run/RRTM_DATA_DBL RRTM_DATA')
+	run(f'ln -sf {wrfplus_root}/run/ETAMPNEW_DATA_DBL ETAMPNEW_DATA')
+	if version >= Version('4.0'):
+		return f'{wrfplus_root}/run/wrfplus.exe'
+	else:
+		return f'{wrfplus_root}/run/wrf.exe'
+
+def check_wrfplus_ad(work_root, config):
+	start_time_str = config['custom']['start_time'].format('YYYY-MM-DD_HH:mm:ss')
+	wrfplus_work_dir = os.path.abspath(work_root) + '/wrfplus'
+	os.chdir(wrfplus_work_dir)
+	if os.path.isfile(f'gradient_wrfplus_d01_{start_time_str}'):
+		run(f'mv gradient_wrfplus_d01_{start_time_str} init_sens_d01_{start_time_str}')
+	expected_files = ['wrfout_d{:02d}_{}'.format(i + 1, start_time_str) for i in range(config['domains']['max_dom'])]
+	expected_files.append(f'init_sens_d01_{start_time_str}')
+	return check_files(expected_files)
+
+@timed('operator')
+def run_wrfplus_ad(work_root, wrfplus_root, config, args, retries=0):
+	cmd = prepare_wrfplus_ad(work_root, wrfplus_root, config, args)
+	wrfplus_work_dir = os.path.abspath(work_root) + '/wrfplus'
+	if cmd:
 		while True:
 			submit_job(cmd, args.np, config, args, wait=True)
-			if os.path.isfile(f'gradient_wrfplus_d01_{start_time_str}'):
-				run(f'mv gradient_wrfplus_d01_{start_time_str} init_sens_d01_{start_time_str}')
-			if not check_files(expected_files):
+			if not check_wrfplus_ad(work_root, config):
 				if retries == 10:
-					cli.error(f'Failed! Check output {os.path.abspath(wrfplus_work_dir)}/rsl.error.0000.')
+					cli.error(f'Failed! Check output {wrfplus_work_dir}/rsl.error.0000.')
 				retries = retries + 1
 				cli.warning('Failed to run wrfplus, retry it!')
 			else:
 				break
 		cli.notice('Succeeded.')
-	else:
-		cli.notice('File wrfout_* already exist.')
 	run(f'ls -l {wrfplus_work_dir}/wrfout_*')
 
+@timed('operator')
+def run_wrfplus_ad_array(work_roots, wrfplus_root, config, args):
+	# Run adjoint models in several work roots as one job array.
+	cmds = { work_root: prepare_wrfplus_ad(work_root, wrfplus_root, config, args) for work_root in work_roots }
+	work_roots = [work_root for work_root in work_roots if cmds[work_root]]
+	if len(work_roots) == 0: return
+	os.chdir(os.path.commonpath([os.path.abspath(work_root) for work_root in work_roots]))
+	submit_job(cmds[work_roots[0]], args.np, config, args, wait=True,
+		work_dirs=[os.path.abspath(work_root) + '/wrfplus' for work_root in work_roots])
+	for work_root in work_roots:
+		if check_wrfplus_ad(work_root, config):
+			cli.notice(f'Succeeded in {work_root}.')
+		else:
+			cli.warning(f'Failed to run wrfplus in {work_root}, retry it!')
+			run_wrfplus_ad(work_root, wrfplus_root, config, args, retries=1)
+
 if __name__ == '__main__':
 	parser = argparse.ArgumentParser(description="Run WRFPLUS tangent and adjoint models.\n\nLongrun Weather Inc., NWP operation software.\nCopyright (C) 2018-2019 All Rights Reserved.", formatter_class=argparse.RawTextHelpFormatter)
 	parser.add_argument('-c', '--codes', help='Root directory of all codes (e.g. WRF, WPS)')
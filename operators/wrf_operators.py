@@ -10,4 +10,4 @@ from run_wrfda_obsproc import run_wrfda_obsproc
 from run_wrfda_3dvar import run_wrfda_3dvar
 from run_wrfda_update_bc import run_wrfda_update_bc
 from run_wrf import run_wrf
-from run_wrfplus_ad import run_wrfplus_ad
+from run_wrfplus_ad import run_wrfplus_ad, run_wrfplus_ad_array
@@ -1,6 +1,8 @@
 import re
 import os
 import sys
+import hashlib
+import pickle
 import xarray as xr
 import numpy as np
 import matplotlib as mpl
@@ -9,9 +11,59 @@ import matplotlib.pyplot as plt
 import cartopy.crs as ccrs
 from cartopy.io.shapereader import Reader as ShapeReader
 from cartopy.feature import ShapelyFeature, COASTLINE
+from shapely.geometry import box, GeometryCollection
 
 fig = plt.figure(figsize=(12, 8))
 
+china_shapefile = '/opt/china-shapefiles/shapefiles/china.shp'
+if not os.path.isfile(china_shapefile):
+	print('You can run the following command to get China official shapefiles.')
+	print('# cd /opt')
+	print('# git clone https://github.com/dongli/china-shapefiles')
+
+# Projected geometries keyed by layer, projection and extent.
+geometry_cache = {}
+
+def get_geometries(layer, proj, extent):
+	key = (layer, proj.proj4_init, tuple(extent))
+	if key in geometry_cache: return geometry_cache[key]
+	# Also persist geometries next to shapefile, so that later runs skip parsing and projecting.
+	cache_file = None
+	if layer == 'china':
+		cache_file = f'{os.path.splitext(china_shapefile)[0]}.{hashlib.md5(repr(key).encode()).hexdigest()[:16]}.pickle'
+		if os.path.isfile(cache_file) and os.path.getmtime(cache_file) >= os.path.getmtime(china_shapefile):
+			try:
+				with open(cache_file, 'rb') as f:
+					geometry_cache[key] = pickle.load(f)
+				return geometry_cache[key]
+			except Exception:
+				pass
+		geometries = ShapeReader(china_shapefile).geometries()
+	else:
+		geometries = COASTLINE.with_scale('50m').geometries()
+	# Clip to extent with some margin, and simplify below the resolution of plots.
+	src_proj = ccrs.PlateCarree()
+	clip = box(extent[0] - 5, extent[2] - 5, extent[1] + 5, extent[3] + 5)
+	res = []
+	for geometry in geometries:
+		if not geometry.intersects(clip): continue
+		geometry = proj.project_geometry(geometry.intersection(clip), src_proj)
+		if geometry.is_empty: continue
+		res.append(geometry)
+	if len(res) > 0:
+		min_x, min_y, max_x, max_y = GeometryCollection(res).bounds
+		tolerance = 1.0e-4 * max(max_x - min_x, max_y - min_y)
+		res = [geometry.simplify(tolerance) for geometry in res]
+	geometry_cache[key] = res
+	if cache_file:
+		try:
+			with open(f'{cache_file}.{os.getpid()}', 'wb') as f:
+				pickle.dump(res, f)
+			os.replace(f'{cache_file}.{os.getpid()}', cache_file)
+		except OSError:
+			pass
+	return res
+
 def get_china_ax(fig=None, subplot=111, min_lon=73, max_lon=135, min_lat=15, max_lat=55, proj=None):
 	if proj == None: proj = ccrs.PlateCarree()
 	if fig:
@@ -23,19 +75,16 @@ def get_china_ax(fig=None, subplot=111, min_lon=73, max_lon=135, min_lat=15, max
 	gl.right_labels = False
 	gl.top_labels = False
 
-	if os.path.isfile('/opt/china-shapefiles/shapefiles/china.shp'):
+	extent = (min_lon, max_lon, min_lat, max_lat)
+	if os.path.isfile(china_shapefile):
 		china = ShapelyFeature(
-			ShapeReader('/opt/china-shapefiles/shapefiles/china.shp').geometries(),
+			get_geometries('china', proj, extent),
 			proj,
 			linewidth=0.1,
 			edgecolor='grey',
 			facecolor='none'
 		)
 		ax.add_feature(china)
-	else:
-		print('You can run the following command to get China official shapefiles.')
-		print('# cd /opt')
-		print('# git clone https://github.com/dongli/china-shapefiles')
-	ax.add_feature(COASTLINE.with_scale('50m'), linewidth=0.5)
+	ax.add_feature(ShapelyFeature(get_geometries('coastline', proj, extent), proj, edgecolor='black', facecolor='none'), linewidth=0.5)
 
 	return ax
@@ -1,37 +1,92 @@
 #!/usr/bin/env python3
 
+import argparse
+import dask
 from plot_common import *
 
-k = int(sys.argv[1]) if len(sys.argv) > 1 else 0
+def parse_levels(levels):
+	# Level indices are separated by comma, and ranges are given as begin-end.
+	res = []
+	for item in levels.split(','):
+		if '-' in item:
+			begin, end = item.split('-')
+			res.extend(range(int(begin), int(end) + 1))
+		else:
+			res.append(int(item))
+	return res
 
-ds_fg = xr.open_dataset('fg')
+parser = argparse.ArgumentParser(description='Plot WRFDA analysis increments.', formatter_class=argparse.RawTextHelpFormatter)
+parser.add_argument('levels', nargs='?', help='Level indices (e.g. 0, 0,5,10 or 0-20)', default=[0], type=parse_levels)
+parser.add_argument('-f', '--first-guess', dest='first_guess', help='First guess file', default='fg')
+parser.add_argument('-a', '--analysis', help='Analysis file', default='wrfvar_output')
+parser.add_argument('-o', '--output', help='Output PDF file (batch mode)')
+parser.add_argument('-s', '--stats', help='Plot increment statistics of all levels', action='store_true')
+parser.add_argument('-n', '--num-workers', dest='num_workers', help='Number of threads to compute increments', default=1, type=int)
+args = parser.parse_args()
 
-ds_wrfvar_output = xr.open_dataset('wrfvar_output')
+# Open files lazily with one level per chunk, so that only needed levels are read.
+ds_fg = xr.open_dataset(args.first_guess, chunks={ 'bottom_top': 1 })
+ds_wrfvar_output = xr.open_dataset(args.analysis, chunks={ 'bottom_top': 1 })
 
-lon_u = ds_fg.XLONG_U[0,:,:]
-lat_u = ds_fg.XLAT_U[0,:,:]
-lon_v = ds_fg.XLONG_V[0,:,:]
-lat_v = ds_fg.XLAT_V[0,:,:]
-lon   = ds_fg.XLONG[0,:,:]
-lat   = ds_fg.XLAT[0,:,:]
+lon_u = ds_fg.XLONG_U[0,:,:].values
+lat_u = ds_fg.XLAT_U[0,:,:].values
+lon_v = ds_fg.XLONG_V[0,:,:].values
+lat_v = ds_fg.XLAT_V[0,:,:].values
+lon   = ds_fg.XLONG[0,:,:].values
+lat   = ds_fg.XLAT[0,:,:].values
 
-fig.suptitle(f'Level index {k}')
+coords = { 'U': (lon_u, lat_u), 'V': (lon_v, lat_v), 'T': (lon, lat), 'P': (lon, lat) }
 
-ax1 = get_china_ax(fig, 221)
-plt.colorbar(ax1.contourf(lon_u, lat_u, ds_wrfvar_output.U[0,k,:,:] - ds_fg.U[0,k,:,:]))
-ax1.set_title('U increment')
+incr = { var: ds_wrfvar_output[var][0] - ds_fg[var][0] for var in coords }
 
-ax2 = get_china_ax(fig, 222)
-plt.colorbar(ax2.contourf(lon_v, lat_v, ds_wrfvar_output.V[0,k,:,:] - ds_fg.V[0,k,:,:]))
-ax2.set_title('V increment')
+# Compute increments of selected levels and statistics in one pass over files.
+fields = { var: incr[var].isel(bottom_top=args.levels) for var in coords }
+stats = {}
+if args.stats:
+	for var in coords:
+		dims = incr[var].dims[1:]
+		stats[var] = {
+			'mean'   : incr[var].mean(dims),
+			'rms'    : np.sqrt((incr[var]**2).mean(dims)),
+			'max_abs': abs(incr[var]).max(dims)
+		}
+fields, stats = dask.compute(fields, stats, num_workers=args.num_workers)
 
-ax3 = get_china_ax(fig, 223)
-plt.colorbar(ax3.contourf(lon, lat, ds_wrfvar_output.T[0,k,:,:] - ds_fg.T[0,k,:,:]))
-ax3.set_title('T increment')
+def plot_level(fig, i):
+	fig.suptitle(f'Level index {args.levels[i]}')
+	for j, var in enumerate(coords):
+		ax = get_china_ax(fig, 221 + j)
+		fig.colorbar(ax.contourf(*coords[var], fields[var][i,:,:]), ax=ax)
+		ax.set_title(f'{var} increment')
 
-ax4 = get_china_ax(fig, 224)
-plt.colorbar(ax4.contourf(lon, lat, ds_wrfvar_output.P[0,k,:,:] - ds_fg.P[0,k,:,:]))
-ax4.set_title('P increment')
+def plot_stats(fig):
+	fig.suptitle('Increment statistics')
+	for j, var in enumerate(coords):
+		ax = fig.add_subplot(221 + j)
+		for name, values in stats[var].items():
+			ax.plot(values, np.arange(len(values)), label=name)
+		ax.axvline(0, color='gray', linewidth=0.5)
+		ax.set_xlabel(f'{var} increment')
+		ax.set_ylabel('Level index')
+		ax.legend()
 
-plt.show()
-plt.close()
+if not args.output and len(args.levels) == 1 and not args.stats:
+	plot_level(fig, 0)
+	plt.show()
+	plt.close()
+	exit(0)
+
+if not args.output: args.output = 'wrfda_incr.pdf'
+plt.close(fig)
+with PdfPages(args.output) as pdf:
+	for i in range(len(args.levels)):
+		fig = plt.figure(figsize=(12, 8))
+		plot_level(fig, i)
+		pdf.savefig(fig)
+		plt.close(fig)
+	if args.stats:
+		fig = plt.figure(figsize=(12, 8))
+		plot_stats(fig)
+		pdf.savefig(fig)
+		plt.close(fig)
+print(f'Write {args.output}.')
@@ -0,0 +1,52 @@
+import os
+import sqlite3
+
+catalog_file_name = 'bkg_catalog.db'
+
+def open_catalog(bkg_root):
+	if not os.path.isdir(bkg_root): os.makedirs(bkg_root)
+	db = sqlite3.connect(f'{bkg_root}/{catalog_file_name}', timeout=60)
+	db.execute('''
+create table if not exists files (
+	source        text not null,
+	cycle         text not null,
+	forecast_hour integer not null,
+	resolution    text not null,
+	path          text not null,
+	primary key (source, cycle, forecast_hour, resolution)
+)''')
+	db.commit()
+	return db
+
+def has_catalog(bkg_root):
+	return os.path.isfile(f'{bkg_root}/{catalog_file_name}')
+
+def register_bkg_file(db, source, cycle, forecast_hour, resolution, path):
+	# Cycle is a pendulum datetime of the background forecast start time.
+	db.execute('insert or replace into files values (?, ?, ?, ?, ?)',
+		(source, cycle.format('YYYYMMDDHH'), forecast_hour, resolution or '', os.path.abspath(path)))
+	db.commit()
+
+def find_bkg_file(db, source, cycle, forecast_hour, resolution=None):
+	if resolution is not None:
+		rows = db.execute('select path from files where source = ? and cycle = ? and forecast_hour = ? and resolution = ?',
+			(source, cycle.format('YYYYMMDDHH'), forecast_hour, resolution)).fetchall()
+	else:
+		rows = db.execute('select path from files where source = ? and cycle = ? and forecast_hour = ? order by resolution',
+			(source, cycle.format('YYYYMMDDHH'), forecast_hour)).fetchall()
+	# Files may have been removed from disk after registered.
+	for row in rows:
+		if os.path.isfile(row[0]): return row[0]
+	return None
+
+def find_bkg_resolution(db, source, cycle, forecast_hour=0):
+	# Resolution of the first file on disk, so that all forecast hours of one cycle can use the same one.
+	rows = db.execute('select resolution, path from files where source = ? and cycle = ? and forecast_hour = ? order by resolution',
+		(source, cycle.format('YYYYMMDDHH'), forecast_hour)).fetchall()
+	for row in rows:
+		if os.path.isfile(row[1]): return row[0]
+	return None
+
+def ready_file_path(bkg_root, cycle):
+	# Written by prefetch.py when all background files of the cycle are downloaded.
+	return f'{bkg_root}/ready/{cycle.format("YYYYMMDDHH")}'
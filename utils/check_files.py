@@ -1,6 +1,7 @@
 import cli
+import contextlib
+import fcntl
 import os
-import psutil
 import subprocess
 
 def check_files(expected_files, fatal=False):
@@ -18,10 +19,19 @@ def check_file_size(url, local_file_path):
 	res = subprocess.run(['curl', '-I', url], stdout=subprocess.PIPE)
 	return f'Content-Length: {os.path.getsize(local_file_path)}' in res.stdout.decode('utf-8')
 
-def is_downloading(local_file_path):
-	for pid in psutil.pids():
-		p = psutil.Process(pid)
-		if local_file_path in p.cmdline():
-			return True
-		else:
-			return False
+@contextlib.contextmanager
+def download_lock(local_file_path, wait=True):
+	# Downloaders hold an advisory lock on <file>.lock while writing <file>.part, and
+	# yield False when not waiting for the lock held by another process.
+	lock = open(f'{local_file_path}.lock', 'w')
+	try:
+		fcntl.flock(lock, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+	except BlockingIOError:
+		lock.close()
+		yield False
+		return
+	try:
+		yield True
+	finally:
+		fcntl.flock(lock, fcntl.LOCK_UN)
+		lock.close()
@@ -1,12 +1,52 @@
 import cli
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import os
+import threading
 from netCDF4 import Dataset
 
-def copy_netcdf_file(src_file_path, dst_file_path, time_index=None, force=True):
+# Maximum bytes of one variable held in memory when copying.
+max_chunk_bytes = 256 * 1024 * 1024
+
+def variable_settings(var, data_model, zlib=None, complevel=None):
+	settings = {}
+	if '_FillValue' in var.ncattrs(): settings['fill_value'] = var.getncattr('_FillValue')
+	if not data_model.startswith('NETCDF4'): return settings
+	filters = var.filters() or {}
+	settings['zlib'] = filters.get('zlib', False) if zlib == None else zlib
+	settings['complevel'] = filters.get('complevel', 4) if complevel == None else complevel
+	settings['shuffle'] = filters.get('shuffle', True)
+	settings['fletcher32'] = filters.get('fletcher32', False)
+	chunking = var.chunking()
+	if chunking == 'contiguous':
+		# Compressed variables need to be chunked.
+		if not settings['zlib']: settings['contiguous'] = True
+	elif chunking:
+		settings['chunksizes'] = chunking
+	return settings
+
+def copy_slabs(src_var, dst_var, src_index, dst_index, write_lock):
+	# Copy along slowest dimension after given indices, so that memory is bounded by max_chunk_bytes.
+	shape = src_var.shape[len(src_index):]
+	if len(shape) == 0:
+		data = src_var[src_index]
+		with write_lock: dst_var[dst_index] = data
+		return
+	row_bytes = src_var.dtype.itemsize * int(np.prod(shape[1:])) if src_var.dtype != str else 1
+	step = max(1, max_chunk_bytes // max(row_bytes, 1))
+	for i in range(0, shape[0], step):
+		data = src_var[src_index + (slice(i, min(i + step, shape[0])),)]
+		with write_lock: dst_var[dst_index + (slice(i, min(i + step, shape[0])),)] = data
+
+def copy_netcdf_file(src_file_path, dst_file_path, time_index=None, force=True, zlib=None, complevel=None, threads=1):
+	# Chunking and compression of variables are preserved unless zlib and complevel are given.
+	# Only use threads > 1 with a thread-safe HDF5 build, since variables are read concurrently.
 	if force and os.path.isfile(dst_file_path): os.remove(dst_file_path)
 
 	src_file = Dataset(src_file_path, 'r')
-	dst_file = Dataset(dst_file_path, 'w')
+	dst_file = Dataset(dst_file_path, 'w', format=src_file.data_model)
+	# Copy raw values without masking and scaling.
+	src_file.set_auto_maskandscale(False)
 
 	if time_index == 'last': time_index = src_file.dimensions['Time'].size - 1
 
@@ -18,16 +58,31 @@ def copy_netcdf_file(src_file_path, dst_file_path, time_index=None, force=True):
 		else:
 			dst_file.createDimension(name, 1)
 
+	# Create all variables first, since defining variables between writes is slow for classic formats.
 	for name, var in src_file.variables.items():
-		dst_file.createVariable(name, var.datatype, var.dimensions)
-		if time_index == None:
-			dst_file.variables[name][:] = src_file.variables[name][:]
+		settings = variable_settings(var, dst_file.data_model, zlib, complevel)
+		if 'chunksizes' in settings:
+			settings['chunksizes'] = [min(size, len(dst_file.dimensions[dim]) or size) for size, dim in zip(settings['chunksizes'], var.dimensions)]
+		dst_var = dst_file.createVariable(name, var.datatype, var.dimensions, **settings)
+		dst_var.setncatts({ key: var.getncattr(key) for key in var.ncattrs() if key != '_FillValue' })
+		dst_var.set_auto_maskandscale(False)
+
+	write_lock = threading.Lock()
+	def copy_variable(name):
+		src_var = src_file.variables[name]
+		dst_var = dst_file.variables[name]
+		if time_index != None and len(src_var.dimensions) > 0 and src_var.dimensions[0] == 'Time':
+			# Only read the hyperslab of given time level.
+			copy_slabs(src_var, dst_var, (time_index,), (0,), write_lock)
 		else:
-			if var.dimensions[0] == 'Time' and len(var.dimensions) > 1:
-				dst_file.variables[name][:] = src_file.variables[name][time_index,:]
-			elif var.dimensions[0] == 'Time':
-				dst_file.variables[name][:] = src_file.variables[name][time_index]
-		dst_file.variables[name].setncatts(src_file.variables[name].__dict__)
+			copy_slabs(src_var, dst_var, (), (), write_lock)
+
+	if threads > 1:
+		with ThreadPoolExecutor(threads) as executor:
+			list(executor.map(copy_variable, src_file.variables.keys()))
+	else:
+		for name in src_file.variables.keys():
+			copy_variable(name)
 
 	if time_index == None:
 		cli.notice(f'Copy {src_file_path} to {dst_file_path}.')
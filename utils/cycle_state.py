@@ -0,0 +1,85 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+state_file_name = 'cycle_state.db'
+
+def open_state(work_dir):
+	if not os.path.isdir(work_dir): os.makedirs(work_dir)
+	db = sqlite3.connect(f'{work_dir}/{state_file_name}', timeout=60)
+	db.execute('''
+create table if not exists stages (
+	id        integer primary key autoincrement,
+	stage     text not null,
+	start     real not null,
+	end       real,
+	status    text not null,
+	exit_code integer,
+	inputs    text,
+	outputs   text
+)''')
+	db.commit()
+	return db
+
+def file_checksum(file_path):
+	sha1 = hashlib.sha1()
+	with open(file_path, 'rb') as f:
+		while True:
+			data = f.read(4 * 1024 * 1024)
+			if not data: break
+			sha1.update(data)
+	return sha1.hexdigest()
+
+def file_fingerprints(file_paths, checksum=False):
+	res = {}
+	for file_path in file_paths:
+		if not os.path.isfile(file_path):
+			res[file_path] = None
+			continue
+		stat = os.stat(file_path)
+		res[file_path] = { 'size': stat.st_size, 'mtime': stat.st_mtime }
+		if checksum: res[file_path]['checksum'] = file_checksum(file_path)
+	return res
+
+def last_record(db, stage):
+	row = db.execute('select id, start, end, status, exit_code, inputs, outputs from stages where stage = ? order by id desc limit 1', (stage,)).fetchone()
+	if not row: return None
+	return {
+		'id': row[0],
+		'start': row[1],
+		'end': row[2],
+		'status': row[3],
+		'exit_code': row[4],
+		'inputs': json.loads(row[5]) if row[5] else {},
+		'outputs': json.loads(row[6]) if row[6] else {}
+	}
+
+def output_verified(file_path, fingerprint):
+	if not fingerprint or not os.path.isfile(file_path): return False
+	stat = os.stat(file_path)
+	if stat.st_size != fingerprint['size']: return False
+	# Only read the whole file again when it has been touched after the record.
+	if stat.st_mtime == fingerprint['mtime']: return True
+	return file_checksum(file_path) == fingerprint['checksum']
+
+def stage_verified(db, stage, inputs, outputs):
+	record = last_record(db, stage)
+	if not record or record['status'] != 'succeeded': return False
+	if file_fingerprints(inputs) != record['inputs']: return False
+	for file_path in outputs:
+		if not output_verified(file_path, record['outputs'].get(file_path)): return False
+	return True
+
+def record_start(db, stage, inputs):
+	cursor = db.execute('insert into stages (stage, start, status, inputs) values (?, ?, ?, ?)',
+		(stage, time.time(), 'running', json.dumps(file_fingerprints(inputs))))
+	db.commit()
+	return cursor.lastrowid
+
+def record_end(db, record_id, exit_code, outputs=None):
+	db.execute('update stages set end = ?, status = ?, exit_code = ?, outputs = ? where id = ?',
+		(time.time(), 'succeeded' if exit_code == 0 else 'failed', exit_code,
+		json.dumps(file_fingerprints(outputs, checksum=True)) if outputs else None, record_id))
+	db.commit()
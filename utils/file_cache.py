@@ -0,0 +1,56 @@
+import cli
+import hashlib
+import json
+import os
+import shutil
+import time
+
+def file_identity(file_path):
+	file_path = os.path.realpath(file_path)
+	stat = os.stat(file_path)
+	return [file_path, stat.st_size, stat.st_mtime]
+
+def cache_key(*items):
+	return hashlib.sha1(json.dumps(items, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+def cache_entry(cache_root, key):
+	return f'{cache_root}/{key[:2]}/{key}'
+
+def link_file(src_file_path, dst_file_path):
+	if os.path.lexists(dst_file_path): os.remove(dst_file_path)
+	try:
+		os.link(src_file_path, dst_file_path)
+	except OSError:
+		# Cache may be on another file system.
+		shutil.copy2(src_file_path, dst_file_path)
+
+def cache_get(cache_root, key, file_names, work_dir):
+	entry = cache_entry(cache_root, key)
+	if not all(os.path.isfile(f'{entry}/{file_name}') for file_name in file_names): return False
+	for file_name in file_names:
+		link_file(f'{entry}/{file_name}', f'{work_dir}/{file_name}')
+	os.utime(entry)
+	return True
+
+def cache_put(cache_root, key, file_names, work_dir):
+	entry = cache_entry(cache_root, key)
+	if os.path.isdir(entry): return
+	tmp_entry = f'{entry}.{os.getpid()}.tmp'
+	os.makedirs(tmp_entry, exist_ok=True)
+	for file_name in file_names:
+		link_file(f'{work_dir}/{file_name}', f'{tmp_entry}/{file_name}')
+	# Rename is atomic, so other cycles never see a partial entry.
+	try:
+		os.rename(tmp_entry, entry)
+	except OSError:
+		shutil.rmtree(tmp_entry)
+
+def cache_prune(cache_root, keep_days):
+	if not os.path.isdir(cache_root): return
+	expire_time = time.time() - keep_days * 86400
+	for prefix in os.listdir(cache_root):
+		for key in os.listdir(f'{cache_root}/{prefix}'):
+			entry = f'{cache_root}/{prefix}/{key}'
+			if os.path.getmtime(entry) < expire_time:
+				cli.notice(f'Remove expired cache {entry}.')
+				shutil.rmtree(entry, ignore_errors=True)
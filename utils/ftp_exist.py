@@ -1,18 +1,10 @@
-import ftplib
 import os
-import re
+from ftp_list import ftp_listing, compile_pattern
 
 def ftp_exist(ftp, file_path_pattern, connect):
 	remote_dir = os.path.dirname(file_path_pattern)
-	pattern = os.path.basename(file_path_pattern)
-	try:
-		for file_name in ftp.nlst(remote_dir):
-			if re.search(pattern, file_name):
-				return remote_dir + '/' + os.path.basename(file_name)
-	except ftplib.all_errors as e:
-		if e.args[0][:3] == '550':
-			return False
-		else:
-			ftp = connect()
-			return ftp_exist(ftp, file_path_pattern, connect)
+	pattern = compile_pattern(os.path.basename(file_path_pattern))
+	for file_name in ftp_listing(ftp, remote_dir, connect):
+		if pattern.search(file_name):
+			return remote_dir + '/' + file_name
 	return False
@@ -1,62 +1,143 @@
+from concurrent.futures import ThreadPoolExecutor
 import ftplib
+import json
 import os
+import queue
 import threading
+from check_files import download_lock
+
+max_block_size = 16 * 1024 * 1024
+max_retries = 3
+
+class FtpPool:
+	# Logged-in connections are reused by threads instead of connecting for each block.
+	def __init__(self, connect):
+		self.connect = connect
+		self.idle = queue.Queue()
+
+	def get(self):
+		try:
+			return self.idle.get_nowait()
+		except queue.Empty:
+			ftp = self.connect()
+			ftp.voidcmd('TYPE I')
+			return ftp
+
+	def put(self, ftp):
+		self.idle.put(ftp)
+
+	def discard(self, ftp):
+		try:
+			ftp.close()
+		except ftplib.all_errors:
+			pass
+
+	def close(self):
+		while not self.idle.empty():
+			ftp = self.idle.get_nowait()
+			try:
+				ftp.quit()
+			except ftplib.all_errors:
+				pass
+
+def read_ranges(ranges_file_path, remote_size):
+	try:
+		ranges = json.load(open(ranges_file_path))
+		if ranges['size'] == remote_size: return ranges
+	except (OSError, ValueError, KeyError):
+		pass
+	return None
+
+def write_ranges(ranges_file_path, ranges):
+	with open(f'{ranges_file_path}.tmp', 'w') as f:
+		json.dump(ranges, f)
+	os.replace(f'{ranges_file_path}.tmp', ranges_file_path)
 
 def ftp_get(ftp, remote_file_path, local_dir, connect, thread_size=0, force=False, fatal=True):
-	# Ensure connection is good.
-	ftp = connect()
 	if not os.path.isdir(local_dir): os.makedirs(local_dir)
 	local_file_path = local_dir + '/' + os.path.basename(remote_file_path)
+	# Wait for other processes downloading the same file, and then check it again.
+	with download_lock(local_file_path):
+		ftp_get_file(ftp, remote_file_path, local_file_path, connect, thread_size, force, fatal)
+
+def ftp_get_file(ftp, remote_file_path, local_file_path, connect, thread_size, force, fatal):
+	# Data are written into .part file, which is renamed after completed.
+	part_file_path = f'{local_file_path}.part'
+	# Completion bitmap of blocks in part file.
+	ranges_file_path = f'{local_file_path}.ranges'
+	pool = FtpPool(connect)
 	try:
+		# Query size right before transfer instead of using cached listing, since remote file may be growing.
+		ftp = pool.get()
 		remote_size = ftp.size(remote_file_path)
+		pool.put(ftp)
 		if os.path.isfile(local_file_path):
 			local_size = os.path.getsize(local_file_path)
 			if remote_size == local_size:
 				print(f'[Warning]: File {local_file_path} exists!')
+				pool.close()
 				return
 			# Redownload from start!
 			if force:
 				os.remove(local_file_path)
 			else:
 				print(f'[Error]: File {local_file_path} exists, but is not complete!')
+				pool.close()
 				if fatal: exit(1)
-		if thread_size > 0:
-			block_size = int(remote_size / thread_size - 1)
-			last_block_size = block_size + int(remote_size - block_size * thread_size)
-			print(f'[Notice]: Download in {thread_size} threads.')
-			threads = []
-			for i in range(thread_size - 1):
-				begin_pos = block_size * i
-				thread = threading.Thread(target=ftp_get_thread, args=(i, remote_file_path, local_file_path, connect, force, fatal, begin_pos, block_size))
-				threads.append(thread)
-			begin_pos = block_size * (thread_size - 1)
-			thread = threading.Thread(target=ftp_get_thread, args=(thread_size - 1, remote_file_path, local_file_path, connect, force, fatal, begin_pos, last_block_size))
-			threads.append(thread)
+				return
+		ranges = read_ranges(ranges_file_path, remote_size) if thread_size > 0 and os.path.isfile(part_file_path) else None
+		if ranges:
+			print(f'[Notice]: Resume {ranges["bitmap"].count("0")} of {len(ranges["bitmap"])} blocks of {local_file_path}.')
 	except ftplib.all_errors as e:
 		print(e)
 		if e.args[0][:3] == '550':
 			print(f'[Error]: {remote_file_path} is missing!')
 		else:
 			print(f'[Error]: Failed to check file size of {remote_file_path}! {e}')
+		pool.close()
 		if fatal: exit(1)
+		return
 	print(f'[Notice]: Get {remote_file_path} ...')
 	if thread_size > 0:
-		for i in range(thread_size):
-			threads[i].start()
-		for i in range(thread_size):
-			threads[i].join()
-		# Merge part files into one.
-		file = open(local_file_path, 'ab')
-		for i in range(thread_size):
-			part_file_path = f'{local_file_path}.part.{i}'
-			file.write(open(part_file_path, 'rb').read())
-			os.remove(part_file_path)
+		if not ranges:
+			block_size = min(max(-(-remote_size // thread_size), 1), max_block_size)
+			ranges = { 'size': remote_size, 'block_size': block_size, 'bitmap': '0' * -(-remote_size // block_size) }
+			write_ranges(ranges_file_path, ranges)
+		print(f'[Notice]: Download in {thread_size} threads.')
+		fd = os.open(part_file_path, os.O_RDWR | os.O_CREAT, 0o644)
+		os.ftruncate(fd, remote_size)
+		lock = threading.Lock()
+		def get_block(i):
+			begin_pos = ranges['block_size'] * i
+			block_size = min(ranges['block_size'], remote_size - begin_pos)
+			for retry in range(max_retries):
+				if ftp_get_block(pool, remote_file_path, fd, begin_pos, block_size):
+					with lock:
+						ranges['bitmap'] = ranges['bitmap'][:i] + '1' + ranges['bitmap'][i+1:]
+						write_ranges(ranges_file_path, ranges)
+					return True
+				print(f'[Warning]: Failed to download {begin_pos}:{begin_pos + block_size}, retry it.')
+			return False
+		with ThreadPoolExecutor(thread_size) as executor:
+			res = list(executor.map(get_block, [i for i, done in enumerate(ranges['bitmap']) if done == '0']))
+		os.close(fd)
+		pool.close()
+		if not all(res):
+			print(f'[Error]: Failed to get {remote_file_path}! Run again to resume failed blocks.')
+			if fatal: exit(1)
+			return
+		os.replace(part_file_path, local_file_path)
+		os.remove(ranges_file_path)
 	else:
 		try:
-			# Ensure connection is good.
-			ftp = connect()
-			ftp.retrbinary(f'RETR {remote_file_path}', open(local_file_path, 'wb').write)
+			ftp = pool.get()
+			with open(part_file_path, 'wb') as f:
+				ftp.retrbinary(f'RETR {remote_file_path}', f.write)
+			pool.put(ftp)
+			pool.close()
+			os.replace(part_file_path, local_file_path)
 		except ftplib.all_errors as e:
+			pool.close()
 			print('retrbinary ', e)
 			if e.args[0][:3] == '550':
 				print(f'[Error]: {remote_file_path} does not exist!')
@@ -64,25 +145,32 @@ def ftp_get(ftp, remote_file_path, local_dir, connect, thread_size=0, force=Fals
 				print(f'[Error]: Failed to get {remote_file_path}! {e}')
 			if fatal: exit(1)
 
-def ftp_get_thread(thread_id, remote_file_path, local_file_path, connect, force, fatal, begin_pos, block_size):
-	print(f'==> Thread {thread_id} is downloading {begin_pos}:{begin_pos + block_size} ...')
-	ftp = connect()
-	ftp.voidcmd('TYPE I')
-
-	local_dir = os.path.dirname(local_file_path)
-	part_file = open(f'{local_file_path}.part.{thread_id}', 'wb')
-
-	stream = ftp.transfercmd(f'RETR {remote_file_path}', rest=begin_pos)
-	remained_size = block_size
-	while True:
-		data = stream.recv(remained_size)
-		if not data: break
-		part_file.write(data)
-		remained_size = remained_size - len(data)
-		if remained_size == 0: break
-	stream.close()
+def ftp_get_block(pool, remote_file_path, fd, begin_pos, block_size):
 	try:
-		ftp.quit()
-	except ftplib.all_errors as e:
-		#print(f'Failed to quit ftp {thread_id} due to {e}!')
-		pass
+		ftp = pool.get()
+	except ftplib.all_errors:
+		return False
+	try:
+		stream = ftp.transfercmd(f'RETR {remote_file_path}', rest=begin_pos)
+		pos = begin_pos
+		remained_size = block_size
+		while remained_size > 0:
+			data = stream.recv(min(remained_size, 1024 * 1024))
+			if not data: break
+			# Write into block offset of destination file directly without part files.
+			os.pwrite(fd, data, pos)
+			pos += len(data)
+			remained_size -= len(data)
+		stream.close()
+	except (ftplib.all_errors, OSError):
+		pool.discard(ftp)
+		return False
+	try:
+		# Server replies 426 or 226 after the data connection is closed before the end of file.
+		ftp.voidresp()
+		pool.put(ftp)
+	except ftplib.error_temp:
+		pool.put(ftp)
+	except ftplib.all_errors:
+		pool.discard(ftp)
+	return remained_size == 0
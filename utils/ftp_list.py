@@ -1,20 +1,46 @@
 import ftplib
+import functools
 import os
 import re
+import time
 
-def ftp_list(ftp, file_path_pattern, connect):
-	remote_dir = os.path.dirname(file_path_pattern)
-	pattern = os.path.basename(file_path_pattern)
+# Listings of remote directories are reused by existence checks for a while.
+listing_ttl = 60
+listings = {}
+use_mlsd = True
+
+@functools.lru_cache(maxsize=None)
+def compile_pattern(pattern):
+	return re.compile(pattern)
+
+def ftp_listing(ftp, remote_dir, connect):
+	global use_mlsd
+	if remote_dir in listings and time.time() - listings[remote_dir][0] < listing_ttl:
+		return listings[remote_dir][1]
 	try:
-		res = []
-		for file_name in ftp.nlst(remote_dir):
-			if re.search(pattern, file_name):
-				res.append(remote_dir + '/' + os.path.basename(file_name))
-		return res
+		listing = None
+		if use_mlsd:
+			try:
+				# MLSD returns sizes along with names in one command.
+				listing = { os.path.basename(name): int(facts['size']) if 'size' in facts else None
+					for name, facts in ftp.mlsd(remote_dir, facts=['type', 'size']) if facts.get('type') not in ('dir', 'cdir', 'pdir') }
+			except ftplib.error_perm as e:
+				# Servers without MLSD reply 500 or 502.
+				if not str(e)[:3] in ('500', '502'): raise
+				use_mlsd = False
+		if listing == None:
+			listing = { os.path.basename(name): None for name in ftp.nlst(remote_dir) }
 	except ftplib.all_errors as e:
-		if type(e.args[0]) == str and e.args[0][:3] == '550':
-			return []
+		# Missing directory is replied with 550 (or 501 by some servers).
+		if isinstance(e, ftplib.error_perm):
+			listing = {}
 		else:
 			ftp = connect()
-			return ftp_list(ftp, file_path_pattern, connect)
-	return []
+			return ftp_listing(ftp, remote_dir, connect)
+	listings[remote_dir] = (time.time(), listing)
+	return listing
+
+def ftp_list(ftp, file_path_pattern, connect):
+	remote_dir = os.path.dirname(file_path_pattern)
+	pattern = compile_pattern(os.path.basename(file_path_pattern))
+	return [remote_dir + '/' + file_name for file_name in ftp_listing(ftp, remote_dir, connect) if pattern.search(file_name)]
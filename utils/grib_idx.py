@@ -0,0 +1,104 @@
+import cli
+import re
+
+# wgrib2 names of GRIB2 (discipline, category, parameter) codes used by WPS Vtables.
+grib2_names = {
+	(0, 0, 0): ('TMP', 'TSOIL'),
+	(0, 0, 4): ('TMAX',),
+	(0, 0, 5): ('TMIN',),
+	(0, 0, 6): ('DPT',),
+	(0, 1, 0): ('SPFH',),
+	(0, 1, 1): ('RH',),
+	(0, 1, 8): ('APCP',),
+	(0, 1, 11): ('SNOD',),
+	(0, 1, 13): ('WEASD',),
+	(0, 1, 22): ('CLWMR',),
+	(0, 1, 23): ('ICMR',),
+	(0, 1, 24): ('RWMR',),
+	(0, 1, 25): ('SNMR',),
+	(0, 1, 32): ('GRLE',),
+	(0, 2, 2): ('UGRD',),
+	(0, 2, 3): ('VGRD',),
+	(0, 2, 8): ('VVEL',),
+	(0, 3, 0): ('PRES',),
+	(0, 3, 1): ('PRMSL',),
+	(0, 3, 5): ('HGT',),
+	(0, 3, 192): ('MSLET',),
+	(0, 19, 0): ('VIS',),
+	(2, 0, 0): ('LAND',),
+	(2, 0, 192): ('SOILW',),
+	(2, 3, 18): ('TSOIL',),
+	(2, 3, 192): ('SOILL',),
+	(10, 2, 0): ('ICEC',)
+}
+
+# Patterns of .idx level strings for GRIB2 level types.
+grib2_levels = {
+	1: r'surface',
+	4: r'0C isotherm',
+	6: r'max wind',
+	7: r'tropopause',
+	100: r'[\d.]+ mb',
+	101: r'mean sea level',
+	102: r'[\d.]+ m above mean sea level',
+	103: r'[\d.]+ m above ground',
+	106: r'[\d.]+-[\d.]+ m below ground'
+}
+
+def parse_idx(text):
+	# Each line is like "1:0:d=2020010100:HGT:1 mb:anl:".
+	records = []
+	for line in text.splitlines():
+		fields = line.split(':')
+		if len(fields) < 6: continue
+		records.append({ 'offset': int(fields[1]), 'name': fields[3], 'level': fields[4] })
+	for i, record in enumerate(records):
+		record['end'] = records[i + 1]['offset'] - 1 if i < len(records) - 1 else None
+	return records
+
+def compile_patterns(variables):
+	# Variables are given as NAME:LEVEL regular expressions (e.g. TMP:.* mb).
+	res = []
+	for variable in variables:
+		name, level = variable.split(':', 1) if ':' in variable else (variable, '.*')
+		res.append((re.compile(f'^(?:{name})$'), re.compile(f'^(?:{level})$')))
+	return res
+
+def vtable_variables(vtable_path):
+	variables = []
+	for line in open(vtable_path):
+		fields = [field.strip() for field in line.split('|')]
+		if len(fields) < 11 or not all(field.isdigit() for field in fields[7:11]): continue
+		code = tuple(int(field) for field in fields[7:10])
+		level_type = int(fields[10])
+		if not code in grib2_names or not level_type in grib2_levels:
+			cli.warning(f'Unknown GRIB2 code {code} or level {level_type} in {vtable_path}, download whole files.')
+			return None
+		for name in grib2_names[code]:
+			variables.append(f'{name}:{grib2_levels[level_type]}')
+	return sorted(set(variables))
+
+def select_ranges(records, patterns):
+	ranges = []
+	for record in records:
+		if not any(name.match(record['name']) and level.match(record['level']) for name, level in patterns): continue
+		# Coalesce adjacent records into one range.
+		if len(ranges) > 0 and ranges[-1][1] != None and ranges[-1][1] + 1 == record['offset']:
+			ranges[-1] = (ranges[-1][0], record['end'])
+		else:
+			ranges.append((record['offset'], record['end']))
+	return ranges
+
+def idx_selector(variables):
+	patterns = compile_patterns(variables)
+	def select(session, url):
+		res = session.get(f'{url}.idx', timeout=60)
+		if res.status_code != 200:
+			cli.warning(f'There is no {url}.idx, download whole file.')
+			return None
+		ranges = select_ranges(parse_idx(res.text), patterns)
+		if len(ranges) == 0:
+			cli.warning(f'No record in {url} matches variables, download whole file.')
+			return None
+		return ranges
+	return select
@@ -0,0 +1,84 @@
+import numpy as np
+import re
+
+real_missing_value = -888888.0
+int_missing_value = -88
+
+# Rows are written by WRFDA as (2i8, a<sid>, 2f9.2, f17.7, n(2f17.7, i8, 2f17.7)).
+prefix_width = 16
+location_width = 9 + 9 + 17
+group_widths = (17, 17, 8, 17, 17)
+group_width = sum(group_widths)
+
+# Variables of field groups by number of groups in rows.
+group_vars = {
+	5: ('u', 'v', 't', 'p', 'q'),
+	4: ('u', 'v', 't', 'q'),
+	2: ('u', 'v'),
+	1: ('u',)
+}
+
+header_pattern = re.compile(rb'^\s*(\w+)\s+(\d+)\s*$')
+
+def parse_column(rows, begin, width, dtype, missing_value):
+	field = np.ascontiguousarray(rows[:, begin:begin+width]).view(f'S{width}').ravel()
+	blank = np.char.strip(field) == b''
+	values = np.where(blank, str(missing_value).encode(), field).astype(dtype)
+	return np.ma.masked_where(blank | (values == missing_value), values)
+
+def parse_rows(rows, field_names):
+	# Pad rows to same length, and view them as a 2D byte array to slice columns.
+	row_size = max(len(row) for row in rows)
+	rows = np.frombuffer(b''.join(row.ljust(row_size) for row in rows), dtype='u1').reshape(len(rows), row_size)
+	# Station id width is the only unknown, since field groups have fixed width.
+	sid_width = (row_size - prefix_width - location_width) % group_width
+	num_group = (row_size - prefix_width - location_width - sid_width) // group_width
+	vars = group_vars.get(num_group, tuple(f'var{i}' for i in range(num_group)))
+	k = prefix_width
+	data = {}
+	data['sid'] = np.char.strip(np.ascontiguousarray(rows[:, k:k+sid_width]).view(f'S{sid_width}').ravel()).astype(str); k += sid_width
+	data['lat'] = parse_column(rows, k, 9, float, real_missing_value); k += 9
+	data['lon'] = parse_column(rows, k, 9, float, real_missing_value); k += 9
+	data['level'] = parse_column(rows, k, 17, float, real_missing_value); k += 17
+	for var in vars:
+		for name, width in zip((var,) + field_names, group_widths):
+			column = var if name == var else f'{var}_{name}'
+			if width == 8:
+				data[column] = parse_column(rows, k, width, int, int_missing_value)
+			else:
+				data[column] = parse_column(rows, k, width, float, real_missing_value)
+			k += width
+	# Level of upper-air observations is pressure.
+	if not 'p' in data: data['p'] = data['level']
+	return data
+
+def read_gts_omb_oma(file_path, field_names=('omb', 'qc', 'err', 'oma')):
+	# Return columns of each observation type as masked arrays, whose fields in each
+	# variable group are named by field_names (e.g. impact, qc, obserr, incr for FSO).
+	lines = open(file_path, 'rb').read().splitlines()
+	res = {}
+	i = 0
+	while i < len(lines):
+		match = header_pattern.match(lines[i])
+		if not match: break
+		obs_type = match[1].decode()
+		num_platform = int(match[2])
+		i += 1
+		rows = []
+		for j in range(num_platform):
+			try:
+				n = int(lines[i])
+			except (IndexError, ValueError):
+				break
+			i += 1
+			block = lines[i:i+n]
+			# Stop at short lines as truncated block.
+			if len(block) < n or any(len(row) < 10 for row in block):
+				block = block[:next((k for k, row in enumerate(block) if len(row) < 10), len(block))]
+				i += len(block)
+				rows.extend(block)
+				break
+			i += n
+			rows.extend(block)
+		if len(rows) > 0: res[obs_type] = parse_rows(rows, field_names)
+	return res
@@ -0,0 +1,106 @@
+import asyncio
+import cli
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import requests
+from requests.adapters import HTTPAdapter
+from check_files import download_lock
+from run_async import run_async
+
+chunk_size = 1024 * 1024
+
+def http_session(pool_size):
+	# Keep-alive connections are reused by all downloads of the same host.
+	session = requests.Session()
+	adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+	session.mount('http://', adapter)
+	session.mount('https://', adapter)
+	return session
+
+def http_get_ranges(session, url, part_file_path, ranges, timeout):
+	# Ranges are appended to part file in order, so its size tells where to resume.
+	with open(part_file_path, 'ab') as f:
+		pos = 0
+		for start, end in ranges:
+			size = end - start + 1 if end != None else None
+			done = f.tell() - pos
+			if size == None or done < size:
+				with session.get(url, headers={ 'Range': f'bytes={start + done}-{end if end != None else ""}' }, stream=True, timeout=timeout) as res:
+					# Last range has been downloaded completely.
+					if res.status_code == 416 and size == None: break
+					res.raise_for_status()
+					if res.status_code != 206: raise IOError('Server does not support byte ranges!')
+					for chunk in res.iter_content(chunk_size):
+						f.write(chunk)
+				if size != None and f.tell() - pos != size:
+					raise IOError(f'Range {start}-{end} is not downloaded completely!')
+			if size != None: pos += size
+
+def http_get(session, url, local_file_path, select=None, timeout=60):
+	# Wait for other processes downloading the same file, and skip it if they have completed it.
+	with download_lock(local_file_path):
+		if os.path.isfile(local_file_path): return
+		http_get_part(session, url, local_file_path, select, timeout)
+
+def http_get_part(session, url, local_file_path, select, timeout):
+	part_file_path = f'{local_file_path}.part'
+	ranges_file_path = f'{local_file_path}.ranges'
+	ranges = select(session, url) if select else None
+	# Part file can only be resumed with the same selected ranges (or none for whole file) recorded in .ranges file.
+	selection = [list(x) for x in ranges] if ranges else None
+	if os.path.isfile(part_file_path):
+		recorded = json.load(open(ranges_file_path))['ranges'] if os.path.isfile(ranges_file_path) else None
+		if recorded != selection: os.remove(part_file_path)
+	if ranges:
+		if not os.path.isfile(part_file_path):
+			with open(ranges_file_path, 'w') as f:
+				json.dump({ 'ranges': selection }, f)
+		http_get_ranges(session, url, part_file_path, ranges, timeout)
+		os.replace(part_file_path, local_file_path)
+		os.remove(ranges_file_path)
+		return
+	if os.path.isfile(ranges_file_path): os.remove(ranges_file_path)
+	offset = os.path.getsize(part_file_path) if os.path.isfile(part_file_path) else 0
+	headers = { 'Range': f'bytes={offset}-' } if offset > 0 else {}
+	with session.get(url, headers=headers, stream=True, timeout=timeout) as res:
+		if res.status_code == 416:
+			# Part file is larger than remote file, so it is stale.
+			os.remove(part_file_path)
+			return http_get_part(session, url, local_file_path, None, timeout)
+		res.raise_for_status()
+		if res.status_code != 206: offset = 0
+		# Size is taken from the same response, so no extra request is needed to check it.
+		size = offset + int(res.headers['Content-Length']) if 'Content-Length' in res.headers else None
+		with open(part_file_path, 'ab' if offset > 0 else 'wb') as f:
+			for chunk in res.iter_content(chunk_size):
+				f.write(chunk)
+	if size != None and os.path.getsize(part_file_path) != size:
+		raise IOError(f'Only {os.path.getsize(part_file_path)} of {size} bytes are downloaded!')
+	os.replace(part_file_path, local_file_path)
+
+async def http_get_async(session, executor, url, local_file_path, select, retries):
+	loop = asyncio.get_event_loop()
+	for i in range(retries + 1):
+		try:
+			await loop.run_in_executor(executor, http_get, session, url, local_file_path, select)
+			cli.notice(f'Downloaded {local_file_path}.')
+			return True
+		except (requests.exceptions.RequestException, IOError) as e:
+			# Part file is kept, so next try resumes from where it stopped.
+			cli.warning(f'Failed to download {url}: {e}' + (', retry it.' if i < retries else '!'))
+			await asyncio.sleep(2**i)
+	return False
+
+async def http_get_all(downloads, max_workers, select, retries):
+	session = http_session(max_workers)
+	with ThreadPoolExecutor(max_workers) as executor:
+		res = await asyncio.gather(*[http_get_async(session, executor, url, local_file_path, select, retries) for url, local_file_path in downloads])
+	session.close()
+	return res
+
+def http_get_files(downloads, max_workers=4, select=None, retries=3):
+	# Download (url, local_file_path) pairs concurrently and return the failed ones.
+	# When select is given, it returns byte ranges of each url to download.
+	res = run_async(http_get_all(downloads, max_workers, select, retries))
+	return [download for download, succeeded in zip(downloads, res) if not succeeded]
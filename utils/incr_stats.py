@@ -0,0 +1,68 @@
+import json
+import numpy as np
+from netCDF4 import Dataset
+import cli
+
+# Analysis variables whose increments are checked, missing ones are skipped.
+incr_vars = ('U', 'V', 'W', 'T', 'P', 'PH', 'QVAPOR', 'MU', 'PSFC', 'T2', 'Q2', 'U10', 'V10')
+stats_file_name = 'incr_stats.json'
+
+def level_stats(incr, num_bins):
+	incr = np.ma.masked_invalid(incr).compressed().astype(np.float64)
+	if incr.size == 0: return None
+	max_abs = float(np.abs(incr).max())
+	# Histogram bins are evenly spaced in [-max_abs, max_abs] of each level, which is written as hist_range.
+	hist_range = (-max_abs, max_abs) if max_abs > 0 else (-1.0, 1.0)
+	counts, _ = np.histogram(incr, bins=num_bins, range=hist_range)
+	return {
+		'count'      : int(incr.size),
+		'sum'        : float(incr.sum()),
+		'sum_sq'     : float(np.square(incr).sum()),
+		'mean'       : float(incr.mean()),
+		'rms'        : float(np.sqrt(np.square(incr).mean())),
+		'max_abs'    : max_abs,
+		'hist'       : counts.tolist(),
+		'hist_range' : list(hist_range)
+	}
+
+def incr_stats(fg_file_path, an_file_path, vars=incr_vars, time_index=0, num_bins=20):
+	# Read one level of each variable at a time, so memory is bounded by a 2D slab.
+	fg = Dataset(fg_file_path, 'r')
+	an = Dataset(an_file_path, 'r')
+	res = {}
+	for var in vars:
+		if not var in fg.variables or not var in an.variables: continue
+		fg_var = fg.variables[var]
+		an_var = an.variables[var]
+		if fg_var.shape != an_var.shape:
+			cli.warning(f'Shape of {var} in {fg_file_path} and {an_file_path} are different!')
+			continue
+		index = (time_index,) if len(fg_var.dimensions) > 0 and fg_var.dimensions[0] == 'Time' else ()
+		shape = fg_var.shape[len(index):]
+		if len(shape) < 2: continue
+		levels = range(shape[0]) if len(shape) == 3 else (None,)
+		stats = []
+		for k in levels:
+			slab = index + ((k,) if k != None else ())
+			stats.append(level_stats(an_var[slab] - fg_var[slab], num_bins))
+		valid = [x for x in stats if x]
+		if len(valid) == 0: continue
+		count = sum(x['count'] for x in valid)
+		res[var] = {
+			'units'  : getattr(fg_var, 'units', ''),
+			'mean'   : sum(x['sum'] for x in valid) / count,
+			'rms'    : float(np.sqrt(sum(x['sum_sq'] for x in valid) / count)),
+			'max_abs': max(x['max_abs'] for x in valid),
+			'levels' : [{ key: value for key, value in x.items() if not key in ('sum', 'sum_sq') } if x else None for x in stats]
+		}
+	fg.close()
+	an.close()
+	return res
+
+def write_incr_stats(fg_file_path, an_file_path, output_file_path, domain=None, **kwargs):
+	stats = incr_stats(fg_file_path, an_file_path, **kwargs)
+	with open(output_file_path, 'w') as f:
+		json.dump({ 'domain': domain, 'fg': fg_file_path, 'analysis': an_file_path, 'vars': stats }, f, separators=(',', ':'))
+	for var, x in stats.items():
+		cli.notice(f'Increment of {var:<6}: mean {x["mean"]:12.4e} rms {x["rms"]:12.4e} max_abs {x["max_abs"]:12.4e} {x["units"]}')
+	return stats
@@ -0,0 +1,163 @@
+import asyncio
+import cli
+import fcntl
+import getpass
+import json
+import os
+import re
+import subprocess
+import tempfile
+import time
+from local_scheduler import local_job_running
+from log_follower import LogFollower
+from telemetry import sample_usage, env_name as telemetry_env_name
+from run_async import run_async
+
+log_interval = 10
+max_query_interval = 120
+
+# Job states of all user's jobs are shared by processes via this file, so that
+# concurrent stages do not query the scheduler controller on their own.
+states_file = f'{tempfile.gettempdir()}/wrf_scripts_job_states_{os.getuid()}.json'
+
+def query_states(args):
+	states = {}
+	if args.slurm:
+		res = subprocess.run(['squeue', '-h', '-u', getpass.getuser(), '-o', '%i %T'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+		for line in res.stdout.decode('utf-8').splitlines():
+			job_id, state = line.split()
+			# Elements of job array are listed as <job_id>_<index>.
+			job_id = job_id.split('_')[0]
+			if state in ('PENDING', 'CONFIGURING'):
+				states.setdefault(job_id, 'PENDING')
+			elif state in ('RUNNING', 'COMPLETING'):
+				states[job_id] = 'RUNNING'
+	elif args.pbs:
+		res = subprocess.run(['qstat', '-u', getpass.getuser()], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+		for line in res.stdout.decode('utf-8').splitlines():
+			match = re.match(r'^(\d+)\S*\s.*\s([QHWREB])\s+\S+\s*$', line)
+			if not match: continue
+			states[match[1]] = 'PENDING' if match[2] in ('Q', 'H', 'W') else 'RUNNING'
+	else:
+		return None
+	if res.returncode != 0: return None
+	return states
+
+def shared_states(args, newer_than):
+	with open(f'{states_file}.lock', 'w') as lock:
+		fcntl.flock(lock, fcntl.LOCK_EX)
+		if os.path.isfile(states_file) and os.path.getmtime(states_file) > newer_than:
+			try:
+				return json.load(open(states_file))
+			except ValueError:
+				pass
+		states = query_states(args)
+		if states == None: return None
+		with open(f'{states_file}.tmp', 'w') as f:
+			json.dump(states, f)
+		os.replace(f'{states_file}.tmp', states_file)
+		return states
+
+class JobFailed(Exception):
+	pass
+
+class Job:
+	def __init__(self, job_id, logfile=None, proc=None, end_time=None):
+		self.id = job_id
+		# Scheduler states are keyed by numeric job id, while PBS ids may have array brackets and server suffix.
+		self.key = re.match(r'\d*', job_id)[0] or job_id if job_id else None
+		self.submit_time = time.time()
+		self.proc = proc
+		self.state = 'PENDING' if job_id and not proc else 'RUNNING'
+		self.follower = LogFollower(logfile, end_time) if logfile else None
+		self.last_line = None
+		self.last_print_time = 0
+		self.finished = asyncio.Event()
+		if self.follower: self.follower.watch(asyncio.get_event_loop(), self.read_log)
+
+	def read_log(self):
+		if not self.follower: return
+		lines = self.follower.read()
+		if self.follower.failure:
+			cli.warning(f'Job {self.id} failed: {self.follower.failure}')
+			self.finish()
+			return
+		# Do not flood terminal when log is followed by inotify.
+		if len(lines) == 0 or lines[-1] == self.last_line or time.time() - self.last_print_time < 1: return
+		self.last_line = lines[-1]
+		self.last_print_time = time.time()
+		progress = self.follower.progress()
+		print(f'{cli.cyan("==>")} {self.last_line if len(self.last_line) <= 80 else self.last_line[:80]}{f" ({progress})" if progress else ""}')
+
+	def update(self, state):
+		if self.finished.is_set(): return
+		if state != self.state:
+			if state == 'PENDING':
+				cli.notice(f'Job {self.id} is still pending.')
+			elif state == 'RUNNING' and self.id:
+				cli.notice(f'Job {self.id} starts running.')
+		self.state = state
+		if state != 'PENDING': self.read_log()
+		if state == 'FINISHED': self.finish()
+
+	def finish(self):
+		self.state = 'FINISHED'
+		if self.follower: self.follower.close()
+		self.finished.set()
+
+	async def done(self):
+		await self.finished.wait()
+		if self.follower and self.follower.failure: raise JobFailed(self.follower.failure)
+		return self.proc.returncode if self.proc else None
+
+class JobMonitor:
+	def __init__(self, args):
+		self.args = args
+		self.jobs = []
+		self.task = None
+
+	def track(self, job_id=None, logfile=None, proc=None, end_time=None):
+		job = Job(job_id, logfile, proc, end_time)
+		self.jobs.append(job)
+		if not self.task or self.task.done():
+			self.task = asyncio.ensure_future(self.poll())
+		return job
+
+	async def poll(self):
+		query_interval = log_interval
+		next_query = 0
+		loop = asyncio.get_event_loop()
+		while len(self.jobs) > 0:
+			await asyncio.sleep(log_interval)
+			states = None
+			if (self.args.slurm or self.args.pbs) and any(job.id for job in self.jobs) and time.time() >= next_query:
+				# States queried before any job was submitted do not know it.
+				newer_than = max([time.time() - log_interval + 1] + [job.submit_time for job in self.jobs])
+				states = await loop.run_in_executor(None, shared_states, self.args, newer_than)
+				if states != None:
+					# Back off while all jobs are pending.
+					if all(states.get(job.key) == 'PENDING' for job in self.jobs if job.id):
+						query_interval = min(query_interval * 2, max_query_interval)
+					else:
+						query_interval = log_interval
+				next_query = time.time() + query_interval
+			for job in list(self.jobs):
+				if job.id and not self.args.slurm and not self.args.pbs and telemetry_env_name in os.environ:
+					sample_usage(job.id)
+				if job.proc:
+					job.update('RUNNING' if job.proc.poll() == None else 'FINISHED')
+				elif not self.args.slurm and not self.args.pbs:
+					job.update('RUNNING' if local_job_running(job.id) else 'FINISHED')
+				elif states != None:
+					job.update(states.get(job.key, 'FINISHED'))
+				else:
+					job.update(job.state)
+				if job.state == 'FINISHED': self.jobs.remove(job)
+
+async def wait_jobs(args, jobs, return_exceptions=False):
+	monitor = JobMonitor(args)
+	tracked = [monitor.track(*job) for job in jobs]
+	return await asyncio.gather(*[job.done() for job in tracked], return_exceptions=return_exceptions)
+
+def wait_job(args, job_id=None, logfile=None, proc=None, end_time=None):
+	return run_async(wait_jobs(args, [(job_id, logfile, proc, end_time)]))[0]
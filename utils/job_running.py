@@ -1,6 +1,7 @@
 import re
 import cli
 from run import run
+from local_scheduler import local_job_running
 
 def job_running(args, job_id):
 	if args.slurm:
@@ -9,3 +10,5 @@ def job_running(args, job_id):
 	elif args.pbs:
 		stdout = run(f'qstat -f {job_id}', stdout=True, echo=False)
 		return re.search('job_state = R', stdout) != None or re.search('job_state = Q', stdout) != None
+	else:
+		return local_job_running(job_id)
@@ -1,3 +1,5 @@
+import os
+import signal
 from job_running import job_running
 import cli
 from run import run
@@ -9,3 +11,5 @@ def kill_job(args, job_id):
 			run(f'scancel {job_id}')
 		elif args.pbs:
 			run(f'qdel {job_id}')
+		else:
+			os.kill(int(job_id), signal.SIGTERM)
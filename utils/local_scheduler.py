@@ -0,0 +1,80 @@
+import cli
+import fcntl
+import json
+import os
+import psutil
+import tempfile
+import time
+from run import run
+
+# Cores used by local jobs of all processes are recorded in this file.
+allocations_file = f'{tempfile.gettempdir()}/wrf_scripts_cores_{os.getuid()}.json'
+procs = {}
+
+def local_cores():
+	if 'WRF_SCRIPTS_LOCAL_CORES' in os.environ:
+		return list(range(int(os.environ['WRF_SCRIPTS_LOCAL_CORES'])))
+	return sorted(os.sched_getaffinity(0))
+
+def local_job_running(pid, create_time=None):
+	pid = int(pid)
+	if pid in procs: return procs[pid].poll() == None
+	try:
+		proc = psutil.Process(pid)
+		# PID may have been reused by another process after the job finished.
+		if create_time != None and abs(proc.create_time() - create_time) > 0.01: return False
+		return proc.status() != psutil.STATUS_ZOMBIE
+	except psutil.NoSuchProcess:
+		return False
+
+def update_allocations(func):
+	with open(f'{allocations_file}.lock', 'w') as lock:
+		fcntl.flock(lock, fcntl.LOCK_EX)
+		try:
+			allocations = json.load(open(allocations_file))
+		except (OSError, ValueError):
+			allocations = {}
+		# Remove cores of finished or killed jobs, and entries written before create_time was recorded.
+		allocations = { pid: allocation for pid, allocation in allocations.items()
+			if type(allocation) == dict and local_job_running(pid, allocation['create_time']) }
+		res = func(allocations)
+		with open(f'{allocations_file}.tmp', 'w') as f:
+			json.dump(allocations, f)
+		os.replace(f'{allocations_file}.tmp', allocations_file)
+		return res
+
+def launch_local_job(cmd, ntasks, cwd=None):
+	all_cores = local_cores()
+	def try_launch(allocations):
+		used_cores = set(sum([allocation['cores'] for allocation in allocations.values()], []))
+		free_cores = [core for core in all_cores if not core in used_cores]
+		if ntasks > len(all_cores):
+			# Job is larger than the node, so run it alone.
+			if len(used_cores) > 0: return None
+			cores = free_cores
+		elif ntasks > len(free_cores):
+			return None
+		else:
+			cores = free_cores[:ntasks]
+		if 'WRF_SCRIPTS_PIN_CORES' in os.environ:
+			proc = run(f'taskset -c {",".join([str(core) for core in cores])} {cmd}', bg=True, cwd=cwd)
+		else:
+			proc = run(cmd, bg=True, cwd=cwd)
+		procs[proc.pid] = proc
+		try:
+			create_time = psutil.Process(proc.pid).create_time()
+		except psutil.NoSuchProcess:
+			create_time = None
+		allocations[str(proc.pid)] = { 'cores': cores, 'create_time': create_time }
+		return proc
+	waiting = False
+	while True:
+		proc = update_allocations(try_launch)
+		if proc: return proc
+		if not waiting:
+			cli.notice(f'Wait for {min(ntasks, len(all_cores))} free cores.')
+			waiting = True
+		time.sleep(2)
+
+def release_local_job(pid):
+	update_allocations(lambda allocations: allocations.pop(str(pid), None))
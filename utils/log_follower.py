@@ -0,0 +1,104 @@
+import ctypes
+import ctypes.util
+from datetime import datetime
+import os
+import re
+import struct
+import time
+
+IN_MODIFY = 0x00000002
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+try:
+	libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+	libc.inotify_init1
+except (OSError, AttributeError):
+	libc = None
+
+datetime_fmt = '%Y-%m-%d_%H:%M:%S'
+timing_pattern = re.compile(r'Timing for main: time (\S+) on domain\s+1:')
+failure_pattern = re.compile(r'FATAL|forrtl:')
+
+class LogFollower:
+	def __init__(self, file_path, end_time=None):
+		self.file_path = os.path.abspath(file_path)
+		self.end_time = datetime.strptime(end_time, datetime_fmt) if end_time else None
+		self.offset = 0
+		self.failure = None
+		self.first_timing = None
+		self.rate = None
+		self.eta = None
+		self.fd = None
+
+	def read(self):
+		if not os.path.isfile(self.file_path): return []
+		if os.path.getsize(self.file_path) < self.offset: self.offset = 0
+		with open(self.file_path, 'rb') as f:
+			f.seek(self.offset)
+			data = f.read()
+		# Leave incomplete line for next read.
+		end = data.rfind(b'\n') + 1
+		self.offset += end
+		lines = [line.strip() for line in data[:end].decode('utf-8', errors='replace').splitlines() if line.strip() != '']
+		for line in lines: self.parse(line)
+		return lines
+
+	def parse(self, line):
+		if not self.failure and failure_pattern.search(line):
+			self.failure = line
+		match = timing_pattern.search(line)
+		if not match: return
+		try:
+			sim_time = datetime.strptime(match[1], datetime_fmt)
+		except ValueError:
+			return
+		if not self.first_timing:
+			self.first_timing = (sim_time, time.time())
+			return
+		sim_seconds = (sim_time - self.first_timing[0]).total_seconds()
+		wall_seconds = time.time() - self.first_timing[1]
+		if sim_seconds <= 0 or wall_seconds < 1: return
+		# Simulated seconds per wall second.
+		self.rate = sim_seconds / wall_seconds
+		if self.end_time: self.eta = max((self.end_time - sim_time).total_seconds(), 0) / self.rate
+
+	def progress(self):
+		if not self.rate: return ''
+		res = f'{self.rate:.1f}x realtime'
+		if self.eta != None: res += f', ETA {int(self.eta // 3600):02d}:{int(self.eta % 3600 // 60):02d}:{int(self.eta % 60):02d}'
+		return res
+
+	def watch(self, loop, callback):
+		# Log written on other nodes may not trigger inotify, so callers should still poll.
+		if not libc: return False
+		fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+		if fd < 0: return False
+		if libc.inotify_add_watch(fd, os.path.dirname(self.file_path).encode('utf-8'), IN_MODIFY | IN_CREATE | IN_MOVED_TO) < 0:
+			os.close(fd)
+			return False
+		file_name = os.path.basename(self.file_path)
+		def handle():
+			try:
+				data = os.read(fd, 65536)
+			except BlockingIOError:
+				return
+			i = 0
+			changed = False
+			while i + 16 <= len(data):
+				wd, mask, cookie, length = struct.unpack_from('iIII', data, i)
+				if data[i+16:i+16+length].rstrip(b'\0').decode('utf-8', errors='replace') == file_name: changed = True
+				i += 16 + length
+			if changed: callback()
+		loop.add_reader(fd, handle)
+		self.fd = fd
+		self.loop = loop
+		return True
+
+	def close(self):
+		if self.fd == None: return
+		self.loop.remove_reader(self.fd)
+		os.close(self.fd)
+		self.fd = None
@@ -2,10 +2,10 @@ import cli
 import os
 import subprocess
 
-def run(cmd, bg=False, raise_error=False, stdout=False, echo=True):
+def run(cmd, bg=False, raise_error=False, stdout=False, echo=True, cwd=None):
 	if echo: print(f'{cli.blue("==>")} {cmd}')
 	if bg:
-		return subprocess.Popen(cmd.split())
+		return subprocess.Popen(cmd.split(), cwd=cwd)
 	elif raise_error or stdout:
 		res = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 		if raise_error:
@@ -0,0 +1,11 @@
+import asyncio
+
+def run_async(coro):
+	# Same as asyncio.run, which is not available in Python 3.6.
+	loop = asyncio.new_event_loop()
+	asyncio.set_event_loop(loop)
+	try:
+		return loop.run_until_complete(coro)
+	finally:
+		asyncio.set_event_loop(None)
+		loop.close()
@@ -0,0 +1,118 @@
+import cli
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import time
+from check_files import check_files
+from cycle_state import open_state, last_record, stage_verified, record_start, record_end
+from telemetry import enable_telemetry, record_event, export_telemetry
+
+# Operators change working directory and edit shared config dicts, so each stage
+# runs in its own forked process instead of a thread.
+mp = multiprocessing.get_context('fork')
+
+def add_stage(stages, name, func, *args, inputs=None, outputs=None, depends=None, **kwargs):
+	if name in stages: cli.error(f'Stage {name} has been added!')
+	depends = list(depends) if depends else []
+	inputs = list(inputs) if inputs else []
+	outputs = list(outputs) if outputs else []
+	for dep in depends:
+		if not dep in stages: cli.error(f'Stage {name} depends on unknown stage {dep}!')
+	# Stages that produce our inputs are our dependencies.
+	for other_name, other in stages.items():
+		if other_name not in depends and set(other['outputs']) & set(inputs):
+			depends.append(other_name)
+	stages[name] = {
+		'name': name,
+		'func': func,
+		'args': args,
+		'kwargs': kwargs,
+		'inputs': inputs,
+		'outputs': outputs,
+		'depends': depends
+	}
+	return stages[name]
+
+def run_stage(stage, state_dir=None, record_id=None):
+	if not check_files(stage['inputs']):
+		missing = [file for file in stage['inputs'] if not os.path.isfile(file)]
+		cli.error(f'Stage {stage["name"]} misses inputs {missing}!')
+	start = time.time()
+	try:
+		stage['func'](*stage['args'], **stage['kwargs'])
+	finally:
+		record_event(stage['name'], 'stage', start, time.time())
+	if not check_files(stage['outputs']):
+		missing = [file for file in stage['outputs'] if not os.path.isfile(file)]
+		cli.error(f'Stage {stage["name"]} did not generate {missing}!')
+	# Checksum outputs here, so that the scheduler is not blocked by big files.
+	if state_dir: record_end(open_state(state_dir), record_id, 0, stage['outputs'])
+
+def invalidate_stage(db, stage):
+	# Outputs of interrupted or failed stages may be half-written, so operators must not reuse them.
+	record = last_record(db, stage['name'])
+	if not record or not record['status'] in ('running', 'failed'): return
+	for file_path in stage['outputs']:
+		if os.path.lexists(file_path):
+			cli.warning(f'Remove output {file_path} of interrupted stage {stage["name"]}.')
+			os.remove(file_path)
+
+def stop_stages(running, interrupt=True):
+	# Send SIGINT so that submit_job can cancel the batch jobs it is waiting for.
+	if interrupt:
+		for proc in running.values():
+			if proc.is_alive(): os.kill(proc.pid, signal.SIGINT)
+	for proc in running.values():
+		proc.join()
+
+def run_stages(stages, max_workers=None, state_dir=None, force=False):
+	db = open_state(state_dir) if state_dir else None
+	if state_dir: enable_telemetry(state_dir)
+	pending = dict(stages)
+	running = {}
+	record_ids = {}
+	done = set()
+	skipped = set()
+	try:
+		while len(pending) > 0 or len(running) > 0:
+			for name, stage in list(pending.items()):
+				if max_workers and len(running) >= max_workers: break
+				if not all(dep in done for dep in stage['depends']): continue
+				del pending[name]
+				if db:
+					# A stage is invalidated when any of its dependencies has been rerun.
+					if not force and all(dep in skipped for dep in stage['depends']) and \
+					   stage_verified(db, name, stage['inputs'], stage['outputs']):
+						cli.notice(f'Skip verified stage {cli.cyan(name)}.')
+						done.add(name)
+						skipped.add(name)
+						continue
+					invalidate_stage(db, stage)
+					record_ids[name] = record_start(db, name, stage['inputs'])
+				cli.notice(f'Start stage {cli.cyan(name)}.')
+				proc = mp.Process(target=run_stage, args=(stage, state_dir, record_ids.get(name)), name=name)
+				proc.start()
+				running[name] = proc
+			if len(running) == 0:
+				if len(pending) == 0: break
+				cli.error(f'Stages {list(pending.keys())} can not be scheduled!')
+			multiprocessing.connection.wait([proc.sentinel for proc in running.values()])
+			for name, proc in list(running.items()):
+				if proc.exitcode == None: continue
+				proc.join()
+				del running[name]
+				if proc.exitcode != 0:
+					if db: record_end(db, record_ids[name], proc.exitcode)
+					stop_stages(running)
+					cli.error(f'Stage {name} failed with exit code {proc.exitcode}!')
+				cli.notice(f'Stage {cli.cyan(name)} finished.')
+				done.add(name)
+	except KeyboardInterrupt:
+		# Running stages have received SIGINT from terminal too.
+		stop_stages(running, interrupt=False)
+		cli.warning('Ended by user!')
+		exit(1)
+	finally:
+		# Export failed cycles too, so that their time can be inspected.
+		if state_dir: export_telemetry(state_dir)
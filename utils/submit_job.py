@@ -1,18 +1,57 @@
-import subprocess
 import re
 import os
-from time import sleep
+import time
 import mach
 from run import run
-from job_running import job_running
-from job_pending import job_pending
+from job_monitor import wait_job, wait_jobs, JobFailed
+from dict_helpers import has_key
+from local_scheduler import launch_local_job, release_local_job
 from kill_job import kill_job
+from telemetry import record_job
+from run_async import run_async
 import cli
 import signal
 signal.signal(signal.SIGINT, signal.default_int_handler)
 
-def submit_job(cmd, ntasks, config, args, logfile='rsl.out.0000', wait=False, queue_idx=0):
-	if logfile: run(f'rm -f {logfile}')
+def array_element_id(args, job_id, index):
+	# PBS Pro array ids look like 123[].server, SLURM ones are plain numbers.
+	if args.slurm: return f'{job_id}_{index}'
+	return job_id.replace('[]', f'[{index}]')
+
+def job_script_commands(cmd, ntasks, expected_files=None, pre_cmds=None, post_cmds=None, mpiexec_args='', work_dirs=None, array_index=None):
+	lines = []
+	if work_dirs:
+		# Each array element runs in its own work directory.
+		lines.append(f'work_dirs=({" ".join(work_dirs)})')
+		lines.append(f'cd ${{work_dirs[{array_index}]}} || exit 1')
+	if pre_cmds: lines.extend(pre_cmds)
+	lines.append(f'mpiexec -np {ntasks}{mpiexec_args} {cmd}')
+	# Fail the job when outputs are missing, so that its dependent jobs are cancelled.
+	for file in expected_files if expected_files else []:
+		lines.append(f'[[ -f {file} ]] || {{ echo "File {file} has not been generated!"; exit 1; }}')
+	if post_cmds: lines.extend(post_cmds)
+	return '\n'.join(lines)
+
+def submit_job(cmd, ntasks, config, args, logfile='rsl.out.0000', wait=False, queue_idx=0, depends=None, expected_files=None, pre_cmds=None, post_cmds=None, work_dirs=None):
+	submit_time = time.time()
+	job_name = os.path.basename(cmd.split()[0])
+	if work_dirs:
+		# Submit one job array running cmd in each of work_dirs.
+		if logfile:
+			for work_dir in work_dirs: run(f'rm -f {work_dir}/{logfile}')
+		# Only follow the log of the first element.
+		if logfile: logfile = f'{work_dirs[0]}/{logfile}'
+	elif logfile:
+		run(f'rm -f {logfile}')
+	end_time = config['custom']['end_time'].format('YYYY-MM-DD_HH:mm:ss') if has_key(config, ('custom', 'end_time')) else None
+	# In chain mode, jobs are submitted without waiting, and each one depends on the previous submitted one.
+	chain = getattr(args, 'chain', False)
+	if chain:
+		if not args.slurm and not args.pbs: cli.error('Chain mode needs SLURM or PBS!')
+		if not depends: depends = getattr(args, 'depends', None)
+		wait = False
+	# Local jobs are always waited as before, since callers use their outputs right after.
+	if not args.slurm and not args.pbs: wait = True
 	ntasks_per_node = None
 	if args.ntasks_per_node != None:
 		ntasks_per_node = args.ntasks_per_node
@@ -32,8 +71,10 @@ def submit_job(cmd, ntasks, config, args, logfile='rsl.out.0000', wait=False, qu
 #SBATCH --ntasks {ntasks}
 #SBATCH --ntasks-per-node {ntasks_per_node}
 #SBATCH --nodes {int(ntasks / ntasks_per_node)}
+{f'#SBATCH --dependency=afterok:{":".join(depends)}{chr(10)}#SBATCH --kill-on-invalid-dep=yes' if depends else ''}
+{f'#SBATCH --array 0-{len(work_dirs)-1}' if work_dirs else ''}
 
-mpiexec -np {ntasks} {cmd}
+{job_script_commands(cmd, ntasks, expected_files, pre_cmds, post_cmds, work_dirs=work_dirs, array_index='$SLURM_ARRAY_TASK_ID')}
 ''')
 		f.close()
 		stdout = run('sbatch < submit.sh', stdout=True)
@@ -41,29 +82,30 @@ mpiexec -np {ntasks} {cmd}
 		if not match:
 			if queue_idx < len(mach.queue) - 1:
 				cli.warning(f'Failed to submit to queue {mach.queue[queue_idx]}, try queue {mach.queue[queue_idx+1]}.')
-				submit_job(cmd, ntasks, config, args, logfile, wait, queue_idx+1)
-				return
+				return submit_job(cmd, ntasks, config, args, logfile, wait, queue_idx+1, depends, expected_files, pre_cmds, post_cmds, work_dirs)
 			else:
 				cli.error(f'Failed to submit job!')
 		job_id = match[1]
-		cli.notice(f'Job {job_id} submitted running {ntasks} tasks.')
+		cli.notice(f'Job {job_id} submitted running {ntasks} tasks' + (f' in {len(work_dirs)} directories.' if work_dirs else '.'))
+		if chain:
+			args.depends = [job_id]
+			args.chain_jobs.append(job_id)
 		if wait:
 			cli.notice(f'Wait for job {job_id}.')
 			try:
-				last_line = None
-				while job_running(args, job_id):
-					sleep(10)
-					if not os.path.isfile(logfile):
-						if job_pending(args, job_id):
-							cli.notice(f'Job {job_id} is still pending.')
-						continue
-					line = subprocess.run(['tail', '-n', '1', logfile], stdout=subprocess.PIPE).stdout.decode('utf-8').strip()
-					if last_line != line and line != '':
-						last_line = line
-						print(f'{cli.cyan("==>")} {last_line if len(last_line) <= 80 else last_line[:80]}')
+				wait_job(args, job_id, logfile, end_time=end_time)
+			except JobFailed:
+				# Do not wait for the failed job to vanish, let caller check its outputs.
+				if work_dirs:
+					# Only the first element is followed, so leave other elements running.
+					kill_job(args, array_element_id(args, job_id, 0))
+					wait_job(args, job_id, end_time=end_time)
+				else:
+					kill_job(args, job_id)
 			except KeyboardInterrupt:
 				kill_job(args, job_id)
 				exit(1)
+			record_job(args, job_id, job_name, ntasks, submit_time)
 		return job_id
 	elif args.pbs:
 		f = open('submit.sh', 'w')
@@ -72,44 +114,74 @@ mpiexec -np {ntasks} {cmd}
 #PBS -N {config["tag"]}
 #PBS -q {mach.queue}
 #PBS -l nodes={int(ntasks / ntasks_per_node)}:ppn={ntasks_per_node}
+{f'#PBS -W depend=afterok:{":".join(depends)}' if depends else ''}
+{f'#PBS -J 0-{len(work_dirs)-1}' if work_dirs else ''}
 
 cd $PBS_O_WORKDIR
-mpiexec -np {ntasks} -machinefile $PBS_NODEFILE {cmd}
+{job_script_commands(cmd, ntasks, expected_files, pre_cmds, post_cmds, ' -machinefile $PBS_NODEFILE', work_dirs, '${PBS_ARRAY_INDEX:-$PBS_ARRAYID}')}
 ''')
 		f.close()
 		stdout = run('qsub < submit.sh', stdout=True)
-		match = re.search('(\w+)', stdout)
+		# Keep full job id (e.g. 123.server or 123[].server for arrays), so that array elements can be addressed.
+		match = re.search('(\S+)', stdout)
 		if not match: cli.error(f'Failed to parse job id from {stdout}')
 		job_id = match[1]
-		cli.notice(f'Job {job_id} submitted running {ntasks} tasks.')
+		cli.notice(f'Job {job_id} submitted running {ntasks} tasks' + (f' in {len(work_dirs)} directories.' if work_dirs else '.'))
+		if chain:
+			args.depends = [job_id]
+			args.chain_jobs.append(job_id)
 		if wait:
 			cli.notice(f'Wait for job {job_id}.')
 			try:
-				last_line = None
-				while job_running(args, job_id):
-					sleep(10)
-					if not os.path.isfile(logfile):
-                                            if job_pending(args, job_id):
-                                                cli.notice(f'Job {job_id} is still pending.')
-                                            continue
-					line = subprocess.run(['tail', '-n', '1', logfile], stdout=subprocess.PIPE).stdout.decode('utf-8').strip()
-					if last_line != line and line != '':
-						last_line = line
-						print(f'{cli.cyan("==>")} {last_line if len(last_line) <= 80 else last_line[:80]}')
+				wait_job(args, job_id, logfile, end_time=end_time)
+			except JobFailed:
+				# Do not wait for the failed job to vanish, let caller check its outputs.
+				if work_dirs:
+					# Only the first element is followed, so leave other elements running.
+					kill_job(args, array_element_id(args, job_id, 0))
+					wait_job(args, job_id, end_time=end_time)
+				else:
+					kill_job(args, job_id)
 			except KeyboardInterrupt:
 				kill_job(args, job_id)
 				exit(1)
+			record_job(args, job_id, job_name, ntasks, submit_time)
 		return job_id
+	elif work_dirs:
+		# Run array elements as concurrent local jobs.
+		procs = [launch_local_job(f'mpiexec -np {ntasks} {cmd}', ntasks, cwd=work_dir) for work_dir in work_dirs]
+		job_ids = [str(proc.pid) for proc in procs]
+		cli.notice(f'Jobs {", ".join(job_ids)} started running {ntasks} tasks in {len(work_dirs)} directories.')
+		if wait:
+			try:
+				# Failed elements are killed below, others are waited to the end.
+				run_async(wait_jobs(args, [(job_id, logfile if i == 0 else None, proc) for i, (job_id, proc) in enumerate(zip(job_ids, procs))], return_exceptions=True))
+			except KeyboardInterrupt:
+				cli.warning('Ended by user!')
+				for job_id in job_ids: kill_job(args, job_id)
+				exit(1)
+			finally:
+				for job_id in job_ids: release_local_job(job_id)
+			for proc in procs:
+				if proc.poll() == None: kill_job(args, str(proc.pid))
+				proc.wait()
+				record_job(args, str(proc.pid), job_name, ntasks, submit_time)
+		return job_ids
 	else:
-		proc = run(f'mpiexec -np {ntasks} {cmd}', bg=True)
-		try:
-			while proc.poll() == None:
-				sleep(10)
-				if not os.path.isfile(logfile): continue
-				res = subprocess.run(['tail', '-n', '1', logfile], stdout=subprocess.PIPE)
-				last_line = res.stdout.decode("utf-8").strip()
-				print(f'{cli.cyan("==>")} {last_line if len(last_line) <= 80 else last_line[:80]}')
-		except KeyboardInterrupt:
-			cli.warning('Ended by user!')
-			proc.kill()
-			exit(1)
+		# Local jobs from concurrent stages share the cores of current node.
+		proc = launch_local_job(f'mpiexec -np {ntasks} {cmd}', ntasks)
+		job_id = str(proc.pid)
+		cli.notice(f'Job {job_id} started running {ntasks} tasks.')
+		if wait:
+			try:
+				wait_job(args, job_id, logfile, proc, end_time)
+			except JobFailed:
+				kill_job(args, job_id)
+			except KeyboardInterrupt:
+				cli.warning('Ended by user!')
+				kill_job(args, job_id)
+				exit(1)
+			finally:
+				release_local_job(job_id)
+			record_job(args, job_id, job_name, ntasks, submit_time)
+		return job_id
@@ -0,0 +1,174 @@
+import functools
+import json
+import os
+import psutil
+import re
+import subprocess
+import time
+
+events_file_name = 'telemetry.jsonl'
+summary_file_name = 'telemetry.json'
+trace_file_name = 'telemetry_trace.json'
+# Forked stages and operator scripts inherit the events file from environment.
+env_name = 'WRF_SCRIPTS_TELEMETRY'
+
+# Resource usages of local jobs sampled by job monitor.
+usages = {}
+
+def enable_telemetry(work_dir):
+	os.environ[env_name] = f'{os.path.abspath(work_dir)}/{events_file_name}'
+
+def record_event(name, cat, start, end, **fields):
+	if not env_name in os.environ: return
+	event = { 'name': name, 'cat': cat, 'start': start, 'end': end, 'duration': end - start, 'pid': os.getpid() }
+	event.update({ key: value for key, value in fields.items() if value != None })
+	# One write call with O_APPEND, so that lines from concurrent stages are not mixed.
+	fd = os.open(os.environ[env_name], os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+	try:
+		os.write(fd, (json.dumps(event) + '\n').encode('utf-8'))
+	finally:
+		os.close(fd)
+
+def timed(cat):
+	def decorator(func):
+		@functools.wraps(func)
+		def wrapper(*args, **kwargs):
+			start = time.time()
+			status = 'failed'
+			try:
+				res = func(*args, **kwargs)
+				status = 'succeeded'
+				return res
+			finally:
+				record_event(func.__name__, cat, start, time.time(), status=status)
+		return wrapper
+	return decorator
+
+def parse_size(size):
+	match = re.match(r'^([\d.]+)([KMGTP]?)', size.strip(), re.I)
+	if not match: return None
+	return int(float(match[1]) * 1024**('KMGTP'.find(match[2].upper()) + 1 if match[2] else 0))
+
+def parse_timestamp(timestamp, fmt):
+	try:
+		return time.mktime(time.strptime(timestamp.strip(), fmt))
+	except ValueError:
+		return None
+
+def sample_usage(pid):
+	try:
+		procs = [psutil.Process(int(pid))]
+		procs += procs[0].children(recursive=True)
+	except psutil.NoSuchProcess:
+		return
+	usage = usages.setdefault(str(pid), { 'start': procs[0].create_time(), 'max_rss': 0 })
+	rss = 0
+	read_bytes = write_bytes = 0
+	for proc in procs:
+		try:
+			rss += proc.memory_info().rss
+			io = proc.io_counters()
+			read_bytes += io.read_bytes
+			write_bytes += io.write_bytes
+		except (psutil.NoSuchProcess, psutil.AccessDenied, AttributeError):
+			pass
+	usage['max_rss'] = max(usage['max_rss'], rss)
+	# Counters of finished ranks are lost, so keep the largest ones seen.
+	usage['read_bytes'] = max(usage.get('read_bytes', 0), read_bytes)
+	usage['write_bytes'] = max(usage.get('write_bytes', 0), write_bytes)
+
+def slurm_usage(job_id):
+	res = subprocess.run(['sacct', '-n', '-P', '-j', job_id, '-o', 'JobID,Submit,Start,End,NNodes,NTasks,MaxRSS,MaxDiskRead,MaxDiskWrite'],
+		stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+	if res.returncode != 0: return {}
+	usage = {}
+	for line in res.stdout.decode('utf-8').splitlines():
+		fields = line.split('|')
+		if len(fields) != 9: continue
+		if not '.' in fields[0]:
+			# Job line has scheduler timestamps, step lines have resource usages.
+			usage['submit'] = parse_timestamp(fields[1], '%Y-%m-%dT%H:%M:%S')
+			usage['start'] = parse_timestamp(fields[2], '%Y-%m-%dT%H:%M:%S')
+			usage['end'] = parse_timestamp(fields[3], '%Y-%m-%dT%H:%M:%S')
+			usage['nodes'] = int(fields[4]) if fields[4].isdigit() else None
+			continue
+		for key, value in zip(('max_rss', 'read_bytes', 'write_bytes'), fields[6:9]):
+			size = parse_size(value)
+			if size != None: usage[key] = max(usage.get(key, 0), size)
+	return usage
+
+def pbs_usage(job_id):
+	res = subprocess.run(['qstat', '-fx', job_id], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+	if res.returncode != 0: return {}
+	attrs = {}
+	for line in res.stdout.decode('utf-8').splitlines():
+		if ' = ' in line:
+			key, value = line.split(' = ', 1)
+			attrs[key.strip()] = value.strip()
+	fmt = '%a %b %d %H:%M:%S %Y'
+	usage = {
+		'submit': parse_timestamp(attrs['qtime'], fmt) if 'qtime' in attrs else None,
+		'start': parse_timestamp(attrs['stime'], fmt) if 'stime' in attrs else None,
+		'end': parse_timestamp(attrs['mtime'], fmt) if 'mtime' in attrs else None,
+		'nodes': int(attrs['Resource_List.nodect']) if attrs.get('Resource_List.nodect', '').isdigit() else None
+	}
+	if 'resources_used.mem' in attrs: usage['max_rss'] = parse_size(attrs['resources_used.mem'])
+	return usage
+
+def record_job(args, job_id, name, ntasks=None, submit_time=None):
+	if not env_name in os.environ: return
+	end = time.time()
+	if args.slurm:
+		usage = slurm_usage(job_id)
+	elif args.pbs:
+		usage = pbs_usage(job_id)
+	else:
+		usage = usages.pop(str(job_id), {})
+		usage['nodes'] = 1
+		# Local jobs wait for free cores before they start.
+		usage['submit'] = submit_time
+	submit = usage.get('submit') or submit_time or end
+	start = usage.get('start') or submit
+	record_event(name, 'job', submit, usage.get('end') or end, job_id=job_id, ntasks=ntasks, nodes=usage.get('nodes'),
+		queue_wait=max(start - submit, 0), run_start=start, max_rss=usage.get('max_rss'),
+		read_bytes=usage.get('read_bytes'), write_bytes=usage.get('write_bytes'))
+
+def read_events(work_dir):
+	events_file = f'{work_dir}/{events_file_name}'
+	if not os.path.isfile(events_file): return []
+	events = []
+	for line in open(events_file):
+		try:
+			events.append(json.loads(line))
+		except ValueError:
+			pass
+	return sorted(events, key=lambda event: event['start'])
+
+def export_telemetry(work_dir):
+	events = read_events(work_dir)
+	if len(events) == 0: return
+	with open(f'{work_dir}/{summary_file_name}', 'w') as f:
+		json.dump({ 'work_dir': os.path.abspath(work_dir), 'events': events }, f, indent=2)
+	trace_events = []
+	origin = events[0]['start']
+	for event in events:
+		fields = { key: value for key, value in event.items() if not key in ('name', 'cat', 'start', 'end', 'pid') }
+		if event['cat'] == 'job' and event.get('queue_wait', 0) > 0:
+			# Show queue wait and run of batch job as separate slices.
+			trace_events.append({ 'name': f'{event["name"]} (queue)', 'cat': 'queue', 'ph': 'X', 'pid': event['pid'], 'tid': event['pid'],
+				'ts': (event['start'] - origin) * 1e6, 'dur': event['queue_wait'] * 1e6, 'args': fields })
+			start = event['run_start']
+		else:
+			start = event['start']
+		trace_events.append({ 'name': event['name'], 'cat': event['cat'], 'ph': 'X', 'pid': event['pid'], 'tid': event['pid'],
+			'ts': (start - origin) * 1e6, 'dur': (event['end'] - start) * 1e6, 'args': fields })
+	with open(f'{work_dir}/{trace_file_name}', 'w') as f:
+		json.dump({ 'traceEvents': trace_events, 'displayTimeUnit': 'ms' }, f)
+
+def percentile(values, p):
+	values = sorted(values)
+	if len(values) == 0: return None
+	i = (len(values) - 1) * p / 100
+	lo = int(i)
+	hi = min(lo + 1, len(values) - 1)
+	return values[lo] + (values[hi] - values[lo]) * (i - lo)
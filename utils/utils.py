@@ -1,5 +1,5 @@
 import cli
-from check_files import check_files, check_file_size, is_downloading
+from check_files import check_files, check_file_size, download_lock
 from edit_file import edit_file
 from search_files import search_files
 from copy_file import copy_netcdf_file
@@ -10,10 +10,20 @@ from wrf_version import wrf_version, Version
 from gsi_version import gsi_version
 from upp_version import upp_version
 from submit_job import submit_job
+from job_monitor import JobMonitor, wait_job, wait_jobs
 from kill_job import kill_job
 from job_running import job_running
 from job_pending import job_pending
 from ftp_exist import ftp_exist
 from ftp_get import ftp_get
 from ftp_list import ftp_list
+from stage_graph import add_stage, run_stages
+from cycle_state import open_state, record_start, record_end, state_file_name, file_checksum
+from file_cache import file_identity, cache_key, cache_get, cache_put, cache_prune
 from dict_helpers import has_key, get_value
+from telemetry import enable_telemetry, record_event, record_job, timed, export_telemetry, read_events, percentile, summary_file_name as telemetry_file_name
+from http_get import http_get_files
+from grib_idx import idx_selector, vtable_variables
+from bkg_catalog import open_catalog, has_catalog, register_bkg_file, find_bkg_file, find_bkg_resolution, ready_file_path
+from gts_omb_oma import read_gts_omb_oma
+from incr_stats import incr_stats, write_incr_stats, stats_file_name as incr_stats_file_name
\ No newline at end of file